@@ -1,4 +1,6 @@
 import cv2
+import threading
+import Instrumentation
 
 SCALE_FACTOR = 50  # 1 unit of distance = 50 pixels
 
@@ -19,6 +21,7 @@ class Camera:
         self.x_max = 0  # Maximum x-coordinate in world units
         self.y_min = 0  # Minimum y-coordinate in world units
         self.y_max = 0  # Maximum y-coordinate in world units
+        self.lock = threading.Lock()  # Serializes captures from the Spheros planned in parallel
 
         if not self.cap.isOpened():
             raise ValueError(f"Unable to access camera at index {self.camera_index}")
@@ -46,11 +49,12 @@ class Camera:
         Returns:
             frame (numpy.ndarray): Captured frame from the camera.
         """
-        ret, frame = self.cap.read()
-
-        for _ in range(5):
+        with self.lock, Instrumentation.timer("capture"):
             ret, frame = self.cap.read()
 
+            for _ in range(5):
+                ret, frame = self.cap.read()
+
         if ret:
             self.display.set_image(frame)  # Update the display with the captured frame
             return frame
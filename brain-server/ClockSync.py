@@ -0,0 +1,77 @@
+import collections
+import threading
+import time
+
+class ClockSync:
+    def __init__(self, window=8):
+        """
+        Estimate the offset of the Controller Server clock from the Brain Server clock with NTP-style pings.
+
+        Each ping records the brain send time t0, the controller receive and reply times t1 and t2, and
+        the brain receive time t3. The sample with the smallest round trip in the window is the least
+        affected by queueing, so its offset is used.
+
+        Pings are broadcast to every controller connection, but a single controller clock is supported:
+        samples are keyed by the host in each pong, and only the first host to answer is tracked, so that
+        the offsets of different machines are never mixed.
+
+        Args:
+            window: Number of recent samples kept.
+        """
+        self.samples = collections.deque(maxlen=window)  # (round trip, offset) pairs
+        self.controller = None  # Host of the tracked controller clock
+        self.ignored = set()  # Other hosts that answered, reported once each
+        self.lock = threading.Lock()  # Pongs arrive on the event loop, commands are timed on planner threads
+
+    def ping_message(self):
+        """
+        Returns:
+            Content of a BrainClockPing message.
+        """
+        return {"t0": time.time()}
+
+    def add_pong(self, message, received_at):
+        """
+        Add the sample from a SpheroClockPong.
+
+        Args:
+            message: Pong with the brain send time "t0", the controller times "t1" and "t2", and the
+                     controller's "host".
+            received_at: Brain time the pong was received (t3).
+        """
+        t0, t1, t2 = message["t0"], message["t1"], message["t2"]
+        round_trip = (received_at - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - received_at)) / 2
+        host = message.get("host")
+        with self.lock:
+            if self.controller is None:
+                self.controller = host
+            elif host != self.controller:
+                if host not in self.ignored:
+                    self.ignored.add(host)
+                    print(f"Clock sync: ignoring pongs from controller {host}, only {self.controller} is synchronized")
+                return
+            self.samples.append((round_trip, offset))
+
+    @property
+    def synchronized(self):
+        return len(self.samples) > 0
+
+    @property
+    def offset(self):
+        """
+        Controller clock minus brain clock in seconds, from the sample with the smallest round trip.
+        """
+        with self.lock:
+            return min(self.samples)[1] if self.samples else 0.0
+
+    @property
+    def round_trip(self):
+        with self.lock:
+            return min(self.samples)[0] if self.samples else None
+
+    def controller_time(self, brain_time):
+        """
+        Convert a brain timestamp into the controller clock.
+        """
+        return brain_time + self.offset
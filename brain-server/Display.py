@@ -1,5 +1,11 @@
 import threading
+import time
 import cv2
+import numpy as np
+
+# Drawing layers, in drawing order. Static layers are rendered once into a cached overlay.
+STATIC_LAYERS = ("obstacles", "roadmap")
+DYNAMIC_LAYERS = ("vectors", "robots")
 
 class Display:
     mouse_x = 0
@@ -7,15 +13,22 @@ class Display:
     mouse_x_original = 0
     mouse_y_original = 0
 
-    def __init__(self):
+    def __init__(self, max_fps=30):
         """
         Initialize the Display class to manage image display and drawing functionality.
+        Args:
+            max_fps: Maximum number of frames rendered per second.
         """
         self.image = None  # Current image to be displayed
         self.width = None  # Width of the current image
         self.height = None  # Height of the current image
-        self.drawings = []  # List to store drawing instructions (e.g., points, lines, rectangles)
-        self.lock = threading.Lock()  # Lock for thread-safe operations
+        self.layers = {layer: {} for layer in STATIC_LAYERS + DYNAMIC_LAYERS}  # Layer to drawings keyed by ID
+        self.drawing_layers = {}  # Drawing ID to the layer holding it
+        self.static_version = 0  # Incremented whenever a static layer changes
+        self.static_cache = None  # (version, size, drawings, overlay, mask) of the rendered static layers
+        self.version = 0  # Incremented whenever the image or a drawing changes
+        self.max_fps = max_fps
+        self.lock = threading.Lock()  # Lock for thread-safe operations, never held while rendering
         self.running = True  # Controls the display loop
 
     def set_image(self, image):
@@ -26,6 +39,7 @@ class Display:
         """
         with self.lock:
             self.image = image
+            self.version += 1
             if image is not None:
                 self.height, self.width = image.shape[:2]  # Dynamically update dimensions
 
@@ -60,7 +74,27 @@ class Display:
         # Return as BGR (OpenCV format)
         return (b, g, r)
 
-    def draw_point(self, id, x, y, weight, color):
+    def _store(self, layer, drawing):
+        """
+        Store a drawing in a layer, replacing any existing drawing with the same ID.
+        Args:
+            layer: Name of the layer.
+            drawing: Drawing instruction with its "id".
+        """
+        with self.lock:
+            # Remove any existing drawing with the same ID, which moves the new one to the top
+            previous_layer = self.drawing_layers.get(drawing["id"])
+            if previous_layer is not None:
+                del self.layers[previous_layer][drawing["id"]]
+                if previous_layer in STATIC_LAYERS:
+                    self.static_version += 1
+            self.layers[layer][drawing["id"]] = drawing
+            self.drawing_layers[drawing["id"]] = layer
+            self.version += 1
+            if layer in STATIC_LAYERS:
+                self.static_version += 1
+
+    def draw_point(self, id, x, y, weight, color, layer="robots"):
         """
         Draw a visualization for a specific object on the display using the color from the color map.
         Args:
@@ -69,17 +103,15 @@ class Display:
             y: Y-coordinate.
             weight: Weight or size of the object.
             color: The color in hex.
+            layer: Drawing layer (see STATIC_LAYERS and DYNAMIC_LAYERS).
         """
         # Convert hex to BGR
         color = self.hex_to_bgr(color)
 
-        with self.lock:
-            # Remove any existing drawings with the same ID
-            self.drawings = [drawing for drawing in self.drawings if drawing["id"] != id]
-            # Add the new drawing with the specified color
-            self.drawings.append({"id": id, "x": x, "y": y, "weight": weight, "color": color})
+        # Add the new drawing with the specified color
+        self._store(layer, {"id": id, "x": x, "y": y, "weight": weight, "color": color})
 
-    def draw_line(self, id, point1, point2, weight, color):
+    def draw_line(self, id, point1, point2, weight, color, layer="vectors"):
         """
         Draw a line between two points on the display.
 
@@ -89,22 +121,20 @@ class Display:
             point2: Tuple (x2, y2) representing the end of the line.
             weight: Thickness of the line.
             color: The color in hex.
+            layer: Drawing layer (see STATIC_LAYERS and DYNAMIC_LAYERS).
         """
         color = self.hex_to_bgr(color)  # Convert hex color to BGR
 
-        with self.lock:
-            # Remove any existing drawings with the same ID
-            self.drawings = [drawing for drawing in self.drawings if drawing["id"] != id]
-            # Add the new line drawing
-            self.drawings.append({
-                "id": id,
-                "start": point1,
-                "end": point2,
-                "weight": weight,
-                "color": color
-            })
-
-    def draw_rectangle(self, id, x, y, w, h, weight, color):
+        # Add the new line drawing
+        self._store(layer, {
+            "id": id,
+            "start": point1,
+            "end": point2,
+            "weight": weight,
+            "color": color
+        })
+
+    def draw_rectangle(self, id, x, y, w, h, weight, color, layer="robots"):
         """
         Draw a rectangle on the display.
 
@@ -114,24 +144,22 @@ class Display:
             w, h: Width and height of the rectangle.
             weight: Thickness of the rectangle edges.
             color: The color in hex format.
+            layer: Drawing layer (see STATIC_LAYERS and DYNAMIC_LAYERS).
         """
         color = self.hex_to_bgr(color)  # Convert hex color to BGR
 
-        with self.lock:
-            # Remove any existing drawings with the same ID
-            self.drawings = [drawing for drawing in self.drawings if drawing["id"] != id]
-            # Add the new rectangle drawing
-            self.drawings.append({
-                "id": id,
-                "x": x,
-                "y": y,
-                "w": w,
-                "h": h,
-                "weight": weight,
-                "color": color
-            })
-
-    def draw_label(self, id, x, y, label, color):
+        # Add the new rectangle drawing
+        self._store(layer, {
+            "id": id,
+            "x": x,
+            "y": y,
+            "w": w,
+            "h": h,
+            "weight": weight,
+            "color": color
+        })
+
+    def draw_label(self, id, x, y, label, color, layer="robots"):
         """
         Draw a label next to a point offset by 10 pixels up and to the left.
 
@@ -141,124 +169,189 @@ class Display:
             y: Y-coordinate of the point.
             label: Text of the label to display.
             color: The color in hex format for the text.
+            layer: Drawing layer (see STATIC_LAYERS and DYNAMIC_LAYERS).
         """
         # Convert hex to BGR
         color = self.hex_to_bgr(color)
 
-        with self.lock:
-            # Remove any existing drawings with the same ID
-            self.drawings = [drawing for drawing in self.drawings if drawing["id"] != id]
-            # Add the label drawing
-            self.drawings.append({
-                "id": id,
-                "x": x - 10,  # Offset x by 10 pixels to the left
-                "y": y - 10,  # Offset y by 10 pixels up
-                "label": label,
-                "color": color
-            })
+        # Add the label drawing
+        self._store(layer, {
+            "id": id,
+            "x": x - 10,  # Offset x by 10 pixels to the left
+            "y": y - 10,  # Offset y by 10 pixels up
+            "label": label,
+            "color": color
+        })
+
 
 
+    def _render(self, image, drawings, scale_x, scale_y, color=None):
+        """
+        Draw a list of drawing instructions onto an image.
+        Args:
+            image: Image to draw on.
+            drawings: Drawing instructions.
+            scale_x, scale_y: Factors mapping original coordinates to the image.
+            color: Color used for every drawing instead of its own (e.g., 255 to draw a mask).
+        """
+        for drawing in drawings:
+            drawing_color = drawing["color"] if color is None else color
+            if "x" in drawing and "y" in drawing and "w" in drawing and "h" in drawing:  # Rectangle
+                scaled_x = int(drawing["x"] / scale_x)
+                scaled_y = int(drawing["y"] / scale_y)
+                scaled_w = int(drawing["w"] / scale_x)
+                scaled_h = int(drawing["h"] / scale_y)
+                cv2.rectangle(
+                    image,
+                    (scaled_x, scaled_y),  # Top-left corner
+                    (scaled_x + scaled_w, scaled_y + scaled_h),  # Bottom-right corner
+                    color=drawing_color,
+                    thickness=drawing["weight"]
+                )
+            elif "label" in drawing:  # Label
+                scaled_x = int(drawing["x"] / scale_x)
+                scaled_y = int(drawing["y"] / scale_y)
+                cv2.putText(
+                    image,
+                    drawing["label"],
+                    (scaled_y, scaled_x),  # OpenCV format (y, x)
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.5,  # Font scale
+                    color=drawing_color,
+                )
+            elif "x" in drawing and "y" in drawing:  # Point
+                scaled_x = int(drawing["x"] / scale_x)
+                scaled_y = int(drawing["y"] / scale_y)
+                radius = int(drawing["weight"] * 50)  # Example scaling
+                cv2.circle(
+                    image,
+                    (scaled_y, scaled_x), # OpenCV format (y, x)
+                    radius=radius,
+                    color=drawing_color,
+                    thickness=2
+                )
+            elif "start" in drawing and "end" in drawing:  # Line
+                start_x = int(drawing["start"][0] / scale_x)
+                start_y = int(drawing["start"][1] / scale_y)
+                end_x = int(drawing["end"][0] / scale_x)
+                end_y = int(drawing["end"][1] / scale_y)
+                cv2.line(
+                    image,
+                    (start_y, start_x),  # Start point
+                    (end_y, end_x),  # End point
+                    color=drawing_color,
+                    thickness=drawing["weight"]
+                )
+
+    def _snapshot(self):
+        """
+        Take the state needed to render a frame. Called with the lock held, so it only copies the frame
+        reference and the dynamic layers. The static layers are only copied after they changed.
+        Returns:
+            Tuple (version, image, static_version, static_drawings, dynamic_drawings), where static_drawings
+            is None if the cached static overlay is still current.
+        """
+        static_drawings = None
+        if self.static_cache is None or self.static_cache[0] != self.static_version:
+            static_drawings = [drawing for layer in STATIC_LAYERS for drawing in self.layers[layer].values()]
+        dynamic_drawings = [drawing for layer in DYNAMIC_LAYERS for drawing in self.layers[layer].values()]
+        return self.version, self.image, self.static_version, static_drawings, dynamic_drawings
+
+    def _static_overlay(self, width, height, scale_x, scale_y, version, drawings):
+        """
+        Get the static layers rendered at the given size, re-rendering them only after they changed.
+        Args:
+            width, height: Size of the rendered frame.
+            scale_x, scale_y: Factors mapping original coordinates to the frame.
+            version: Static layer version of the snapshot.
+            drawings: Static drawings of the snapshot, or None if they did not change since the last render.
+        Returns:
+            Tuple (overlay, mask) of the rendered layers and the boolean mask of their pixels.
+        """
+        if drawings is None:
+            if self.static_cache[1] == (width, height):
+                return self.static_cache[3], self.static_cache[4]
+            drawings = self.static_cache[2]  # Same drawings at a new frame size
+
+        overlay = np.zeros((height, width, 3), dtype=np.uint8)
+        mask = np.zeros((height, width), dtype=np.uint8)
+        self._render(overlay, drawings, scale_x, scale_y)
+        self._render(mask, drawings, scale_x, scale_y, color=255)  # Black drawings still cover the image
+        self.static_cache = (version, (width, height), drawings, overlay, mask.astype(bool))
+        return overlay, self.static_cache[4]
+
+    def render(self, image, static_version, static_drawings, dynamic_drawings):
+        """
+        Render a snapshot at half the image size.
+        Args:
+            image: Frame of the snapshot.
+            static_version, static_drawings, dynamic_drawings: Drawing state of the snapshot (see _snapshot).
+        Returns:
+            Tuple (overlay_image, scale_x, scale_y) of the rendered frame and the factors mapping original
+            coordinates to it.
+        """
+        # Resize overlay image to half the dimensions
+        height, width = image.shape[:2]
+        half_width = width // 2
+        half_height = height // 2
+        overlay_image = cv2.resize(image, (half_width, half_height))
+
+        # Scale factors for mapping coordinates back to the original
+        scale_x = width / half_width
+        scale_y = height / half_height
+
+        # Composite the cached static layers, then draw the dynamic ones
+        static_overlay, static_mask = self._static_overlay(half_width, half_height, scale_x, scale_y,
+                                                           static_version, static_drawings)
+        np.copyto(overlay_image, static_overlay, where=static_mask[..., None])
+        self._render(overlay_image, dynamic_drawings, scale_x, scale_y)
+        return overlay_image, scale_x, scale_y
 
     def show(self):
         """
-        Continuously display the current image with any drawings.
+        Continuously display the current image with any drawings, at most max_fps times per second.
+        Only a snapshot of the state is taken under the lock, and the frame is rendered outside of it,
+        so that capture and drawing calls are never blocked by the display.
         """
         cv2.namedWindow("Display")
+        rendered = None  # Version and mouse position of the last rendered frame
 
         while self.running:
-            image = self.get_image()
-            if image is not None:
-                with self.lock:
-                    overlay_image = image.copy()
-
-                    # Resize overlay image to half the dimensions
-                    half_width = self.width // 2
-                    half_height = self.height // 2
-                    overlay_image = cv2.resize(overlay_image, (half_width, half_height))
-
-                    # Scale factors for mapping coordinates back to the original
-                    scale_x = self.width / half_width
-                    scale_y = self.height / half_height
-
-                    # Update mouse callback with scaling factors
-                    cv2.setMouseCallback("Display", self.mouse_callback, {"scale_x": scale_x, "scale_y": scale_y})
-
-                    # Draw all the overlays
-                    for drawing in self.drawings:
-                        if "x" in drawing and "y" in drawing and "w" in drawing and "h" in drawing:  # Rectangle
-                            scaled_x = int(drawing["x"] / scale_x)
-                            scaled_y = int(drawing["y"] / scale_y)
-                            scaled_w = int(drawing["w"] / scale_x)
-                            scaled_h = int(drawing["h"] / scale_y)
-                            color = drawing["color"]
-                            cv2.rectangle(
-                                overlay_image,
-                                (scaled_x, scaled_y),  # Top-left corner
-                                (scaled_x + scaled_w, scaled_y + scaled_h),  # Bottom-right corner
-                                color=color,
-                                thickness=drawing["weight"]
-                            )
-                        elif "label" in drawing:  # Label
-                            scaled_x = int(drawing["x"] / scale_x)
-                            scaled_y = int(drawing["y"] / scale_y)
-                            color = drawing["color"]
-                            cv2.putText(
-                                overlay_image,
-                                drawing["label"],
-                                (scaled_y, scaled_x),  # OpenCV format (y, x)
-                                cv2.FONT_HERSHEY_SIMPLEX,
-                                0.5,  # Font scale
-                                color=color,
-                            )    
-                        elif "x" in drawing and "y" in drawing:  # Point
-                            scaled_x = int(drawing["x"] / scale_x)
-                            scaled_y = int(drawing["y"] / scale_y)
-                            radius = int(drawing["weight"] * 50)  # Example scaling
-                            color = drawing["color"]
-                            cv2.circle(
-                                overlay_image,
-                                (scaled_y, scaled_x), # OpenCV format (y, x)
-                                radius=radius,
-                                color=color,
-                                thickness=2
-                            )
-                        elif "start" in drawing and "end" in drawing:  # Line
-                            start_x = int(drawing["start"][0] / scale_x)
-                            start_y = int(drawing["start"][1] / scale_y)
-                            end_x = int(drawing["end"][0] / scale_x)
-                            end_y = int(drawing["end"][1] / scale_y)
-                            color = drawing["color"]
-                            cv2.line(
-                                overlay_image,
-                                (start_y, start_x),  # Start point
-                                (end_y, end_x),  # End point
-                                color=color,
-                                thickness=drawing["weight"]
-                            )
-                            # Update the `show` method to handle labels
-
-
-
-                    # Display mouse coordinates
-                    mouse_text = f"Y: {Display.mouse_y_original}, X: {Display.mouse_x_original}"
-                    cv2.putText(
-                        overlay_image,
-                        mouse_text,
-                        (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        1.0,
-                        (255, 255, 255),
-                        2
-                    )
-
-                    # Show the resized image
-                    cv2.imshow("Display", overlay_image)
-
-                if cv2.waitKey(1) & 0xFF == ord('q'):  # Press 'q' to quit
-                    self.running = False
-                    break
-            else:
+            frame_start = time.monotonic()
+            with self.lock:
+                version, image, static_version, static_drawings, dynamic_drawings = self._snapshot()
+
+            mouse = (Display.mouse_y_original, Display.mouse_x_original)
+            if image is not None and (version, mouse) != rendered:
+                overlay_image, scale_x, scale_y = self.render(image, static_version, static_drawings, dynamic_drawings)
+
+                # Update mouse callback with scaling factors
+                cv2.setMouseCallback("Display", self.mouse_callback, {"scale_x": scale_x, "scale_y": scale_y})
+
+                # Display mouse coordinates
+                mouse_text = f"Y: {mouse[0]}, X: {mouse[1]}"
+                cv2.putText(
+                    overlay_image,
+                    mouse_text,
+                    (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0,
+                    (255, 255, 255),
+                    2
+                )
+
+                # Show the resized image
+                cv2.imshow("Display", overlay_image)
+                rendered = (version, mouse)
+            elif image is None:
                 cv2.waitKey(100)
+                continue
+
+            # Wait out the rest of the frame, handling window events meanwhile
+            remaining = 1 / self.max_fps - (time.monotonic() - frame_start)
+            if cv2.waitKey(max(1, int(remaining * 1000))) & 0xFF == ord('q'):  # Press 'q' to quit
+                self.running = False
+                break
 
     @staticmethod
     def mouse_callback(event, x, y, flags, param):
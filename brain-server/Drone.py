@@ -1,11 +1,13 @@
 import numpy as np
 import heapq
+import Instrumentation
+import KalmanTracker
 import Localizer
 import math
 import time
 
 class Drone:
-    def __init__(self, planner, camera, display, sphero_id, sphero_color, map):
+    def __init__(self, planner, camera, display, sphero_id, sphero_color, map, estimator="particle", camera_every=1):
         """
         Initialize a Drone (Sphero) with its display, ID, and color.
         Args:
@@ -14,6 +16,9 @@ class Drone:
             sphero_id: Unique identifier for the Sphero.
             sphero_color: Color used for identifying the Sphero.
             map: Reference to the Map instance containing PRM and obstacles.
+            estimator: Position estimator to use, either "particle" or "kalman".
+            camera_every: Run the camera pipeline every k-th step once odometry is calibrated,
+                dead-reckoning with onboard odometry in between.
         """
         try:
             self.planner = planner
@@ -21,7 +26,12 @@ class Drone:
             self.sphero_id = sphero_id
             self.sphero_color = sphero_color
             print(f"Sphero Initialized: {sphero_id}")
-            self.localizer = Localizer.Localizer(camera, display, sphero_color, 500)
+            if estimator == "kalman":
+                self.estimator = KalmanTracker.KalmanTracker(camera, display, sphero_color)
+            elif estimator == "particle":
+                self.estimator = Localizer.Localizer(camera, display, sphero_color, 500)
+            else:
+                raise ValueError(f"Unknown estimator: {estimator}")
             self.map = map
             if len(self.map.goal) == 4:
                 gx, gy, gw, gh = self.map.goal
@@ -41,6 +51,15 @@ class Drone:
             self.speed = None
             self.timing = 2
             self.angle_offset = None
+
+            # Onboard odometry from SpheroTelemetry
+            self.camera_every = max(1, camera_every)
+            self.steps_since_camera = 0
+            self.odometry = None  # Latest (timestamp, x, y) locator sample in cm
+            self.odometry_at_fix = None  # Locator sample at the last camera fix
+            self.fix_position = None  # (y, x) image position at the last camera fix
+            self.odometry_transform = None  # Complex scale and rotation from locator cm to image pixels (y up)
+
             self.states = [
                 {
                     "state": "move_to_goal",
@@ -84,9 +103,14 @@ class Drone:
                 self.last_location = (self.current_y, self.current_x)
                 return self.angle, self.timing
 
-            # Calculate actual movement vector
-            delta_x_actual = self.current_x - self.last_location[1]
-            delta_y_actual = self.current_y - self.last_location[0]
+            # Calculate actual movement vector, preferring the estimator's filtered velocity
+            velocity = self.estimator.get_velocity()
+            if velocity is not None:
+                delta_x_actual = velocity[1] * self.timing
+                delta_y_actual = velocity[0] * self.timing
+            else:
+                delta_x_actual = self.current_x - self.last_location[1]
+                delta_y_actual = self.current_y - self.last_location[0]
 
             actual_angle = math.degrees(math.atan2(delta_x_actual, -delta_y_actual)) % 360
             distance_moved = math.sqrt(delta_x_actual**2 + delta_y_actual**2)
@@ -149,14 +173,172 @@ class Drone:
             print(f"Unexpected error in calculate_movement_parameters: {e}")
             return self.angle, 2  # Fallback timing
 
+    def calculate_segment_parameters(self, start_position, target_position):
+        """
+        Calculate the angle and timing for a follow-up segment of a batched move without
+        updating the feedback correction state.
+
+        Args:
+            start_position: Tuple (y, x) where the segment starts.
+            target_position: Tuple (y, x) where the segment ends.
+
+        Returns:
+            tuple: (angle, timing), or None if no speed or heading estimate is available yet.
+        """
+        try:
+            if self.speed is None or self.angle_offset is None:
+                return None
+
+            delta_x_target = target_position[1] - start_position[1]
+            delta_y_target = target_position[0] - start_position[0]
+            target_angle = (math.degrees(math.atan2(delta_x_target, -delta_y_target)) - self.angle_offset) % 360
+
+            distance_to_target = math.sqrt(delta_x_target**2 + delta_y_target**2)
+            timing = distance_to_target / (self.speed + 1e-6)
+
+            return target_angle, timing
+        except Exception as e:
+            print(f"Unexpected error in calculate_segment_parameters: {e}")
+            return None
+
+    def plan_segments(self, waypoints):
+        """
+        Calculate the timed heading segments for a batched move through several waypoints.
+
+        Args:
+            waypoints: List of (x, y) points to visit in order.
+
+        Returns:
+            List of (angle, timing) tuples, one per waypoint that could be planned.
+        """
+        try:
+            target_x, target_y = waypoints[0]
+            segments = [self.calculate_movement_parameters((target_y, target_x))]
+
+            previous = (target_y, target_x)
+            path_length = self._euclidean_distance((self.current_y, self.current_x), previous)
+            for target_x, target_y in waypoints[1:]:
+                segment = self.calculate_segment_parameters(previous, (target_y, target_x))
+                if segment is None:
+                    break
+                segments.append(segment)
+                path_length += self._euclidean_distance(previous, (target_y, target_x))
+                previous = (target_y, target_x)
+
+            # The next speed estimate divides the straight-line displacement by self.timing,
+            # so scale the total duration down by how much the path bends
+            if len(segments) > 1:
+                displacement = self._euclidean_distance((self.current_y, self.current_x), previous)
+                total_timing = sum(timing for _, timing in segments)
+                self.timing = total_timing * displacement / (path_length + 1e-6)
+
+            return segments
+        except Exception as e:
+            print(f"Error planning segments: {e}")
+            return []
+
+    def predict_motion(self, angle, timing):
+        """
+        Feed a commanded move into the estimator as a motion prior.
+        Args:
+            angle: Commanded roll angle relative to the Sphero's heading offset.
+            timing: Commanded roll duration in seconds.
+        """
+        try:
+            if self.speed is None or self.angle_offset is None:
+                return  # No speed or heading estimate yet
+            if self.odometry_transform is not None:
+                return  # Measured odometry replaces the commanded motion as the prior
+            heading = (angle + self.angle_offset) % 360  # Convert back to image degrees
+            self.estimator.predict(heading, timing, self.speed)
+        except Exception as e:
+            print(f"Error predicting motion: {e}")
+
+    def get_estimator_metrics(self):
+        """
+        Get the runtime metrics of this Sphero's position estimator.
+        Returns:
+            Dictionary of metrics (e.g., particle count and resample rate for the particle filter).
+        """
+        return dict(self.estimator.metrics)
+
+    def add_telemetry(self, timestamp, x, y):
+        """
+        Record an onboard odometry sample from the Sphero's locator.
+        Args:
+            timestamp: Unix time of the sample.
+            x: Locator x-coordinate in cm.
+            y: Locator y-coordinate in cm.
+        """
+        self.odometry = (timestamp, x, y)
+
+    def _odometry_delta(self):
+        """
+        Map the odometry displacement since the last camera fix into image coordinates.
+        Returns:
+            Tuple (dy, dx, dt) in pixels and seconds, or None if odometry is unavailable or not calibrated yet.
+        """
+        if self.odometry is None or self.odometry_at_fix is None or self.odometry_transform is None:
+            return None
+        t0, x0, y0 = self.odometry_at_fix
+        t1, x1, y1 = self.odometry
+        displacement = self.odometry_transform * complex(x1 - x0, y1 - y0)
+        return -displacement.imag, displacement.real, t1 - t0
+
+    def _calibrate_odometry(self, previous_fix):
+        """
+        Refine the locator-to-image transform by comparing the camera and odometry displacements between two fixes.
+        Args:
+            previous_fix: (y, x) image position at the previous camera fix.
+        """
+        if previous_fix is None or self.odometry is None or self.odometry_at_fix is None:
+            return
+        odometry = complex(self.odometry[1] - self.odometry_at_fix[1], self.odometry[2] - self.odometry_at_fix[2])
+        if abs(odometry) < 1.0:
+            return  # Too short to tell the heading apart from noise
+
+        # Image displacement with y pointing up, so both frames have the same handedness
+        image = complex(self.current_x - previous_fix[1], -(self.current_y - previous_fix[0]))
+        estimate = image / odometry
+        if self.odometry_transform is None:
+            self.odometry_transform = estimate
+        else:
+            weight = self.current_confidence
+            self.odometry_transform = (1 - weight) * self.odometry_transform + weight * estimate
+
     def get_position(self):
         """
-        Get the current position of the Sphero using localization.
+        Get the current position of the Sphero using localization, fused with onboard odometry when available.
         Returns:
             Tuple (y, x) representing the current position.
         """
         try:
-            self.current_y, self.current_x, self.current_confidence = self.localizer.updateParticles()
+            delta = self._odometry_delta()
+            if delta is not None and self.steps_since_camera + 1 < self.camera_every:
+                # Dead-reckon from the last camera fix instead of running the camera pipeline
+                dy, dx, _ = delta
+                self.current_y = self.fix_position[0] + dy
+                self.current_x = self.fix_position[1] + dx
+                self.steps_since_camera += 1
+                return
+
+            if delta is not None:
+                # Use the measured odometry as the estimator's motion prior
+                dy, dx, elapsed = delta
+                elapsed = max(elapsed, 1e-3)
+                heading = math.degrees(math.atan2(dx, -dy)) % 360
+                self.estimator.predict(heading, elapsed, math.hypot(dx, dy) / elapsed)
+
+            # The Sphero only moved for the commanded timing since the last update
+            dt = self.timing if self.last_location is not None else None
+            with Instrumentation.timer("estimate"):
+                self.current_y, self.current_x, self.current_confidence = self.estimator.update(dt)
+
+            previous_fix = self.fix_position
+            self._calibrate_odometry(previous_fix)
+            self.fix_position = (self.current_y, self.current_x)
+            self.odometry_at_fix = self.odometry
+            self.steps_since_camera = 0
         except Exception as e:
             print(f"Error getting position: {e}")
 
@@ -215,12 +397,13 @@ class Drone:
             state_name = current_state["state"]
             print(f"Sphero [{self.sphero_id}] executing state: {state_name}")
 
-            self.get_position()
+            with Instrumentation.timer("step"):
+                self.get_position()
 
-            if state_name == "move_to_goal":
-                self._move_to_goal()
-            elif state_name == "interact":
-                self._interact()
+                if state_name == "move_to_goal":
+                    self._move_to_goal()
+                elif state_name == "interact":
+                    self._interact()
         except Exception as e:
             print(f"Error executing state: {e}")
 
@@ -305,8 +488,8 @@ class Drone:
                 return []
 
             # Get indices of the closest nodes in the PRM node list
-            start_idx = self.map.nodes.index(closest_node)
-            goal_idx = self.map.nodes.index(goal_node)
+            start_idx = self.map.node_index[closest_node]
+            goal_idx = self.map.node_index[goal_node]
             #print(f"Closest Node to Start: y:{closest_node[1]}, x: {closest_node[0]}")
             #print(f"Closest Node to Goal: y:{goal_node[1]}, x: {goal_node[0]}")
 
@@ -364,16 +547,7 @@ class Drone:
             List of neighbor indices.
         """
         try:
-            neighbors = []
-            current_node = self.map.nodes[idx]
-            for node1, node2 in self.map.edges:
-                if node1 == current_node:
-                    neighbor_idx = self.map.nodes.index(node2)
-                    neighbors.append(neighbor_idx)
-                elif node2 == current_node:
-                    neighbor_idx = self.map.nodes.index(node1)
-                    neighbors.append(neighbor_idx)
-            return neighbors
+            return self.map.neighbors(idx)
         except Exception as e:
             print(f"Error getting neighbors: {e}")
             return []
@@ -386,7 +560,8 @@ class Drone:
         """
         try:
             current_position = (self.current_y, self.current_x)
-            trajectory = (self._find_path(current_position))[:2]
+            with Instrumentation.timer("planning"):
+                trajectory = (self._find_path(current_position))[:self.planner.max_segments + 1]
             self.planner.add_trajectory((trajectory, self))
             #print(f"Sphero [{self.sphero_id}] submitted trajectory: {trajectory}")
         except Exception as e:
@@ -0,0 +1,117 @@
+import numpy as np
+import cv2
+import Instrumentation
+from color_ranges import color_ranges
+
+class Estimator:
+    def __init__(self, camera, display, color):
+        """
+        Initialize the Estimator base class shared by all Sphero position estimators.
+        Args:
+            camera: Camera instance for capturing images.
+            display: Display instance for visualization.
+            color: Target color for localization (hex format).
+        """
+        self.camera = camera  # Reference to the camera instance
+        self.display = display  # Reference to the display instance
+        self.color = color  # Target color for tracking
+        self.metrics = {"updates": 0}  # Runtime metrics reported per Sphero
+
+    def update(self, dt=None):
+        """
+        Capture a new frame and update the position estimate.
+        Args:
+            dt: Seconds the Sphero was commanded to move since the previous update, if known.
+        Returns:
+            Tuple (y, x, confidence) of the estimated position.
+        """
+        raise NotImplementedError
+
+    def predict(self, heading, timing, speed):
+        """
+        Propagate the estimate with a commanded motion before the next measurement.
+        Args:
+            heading: Commanded heading in image degrees (0 is up, 90 is right).
+            timing: Commanded roll duration in seconds.
+            speed: Estimated roll speed in pixels per second.
+        """
+        pass
+
+    def get_velocity(self):
+        """
+        Get the estimated velocity of the Sphero.
+        Returns:
+            Tuple (vy, vx) in pixels per second, or None if the estimator does not track velocity.
+        """
+        return None
+
+    def _measure(self, center=None, radius=None):
+        """
+        Capture a frame and extract the pixels matching the target color.
+        Args:
+            center: Optional predicted (y, x) position to restrict the search to.
+            radius: Half-size of the square search window around the center, in pixels.
+        Returns:
+            Tuple (points, height, width) where points is an (N, 2) array of (y, x) pixel coordinates.
+        """
+        image = self.camera.capture_image()
+        height, width = image.shape[:2]  # Extract height and width from the image
+
+        with Instrumentation.timer("segmentation"):
+            if center is not None and radius is not None:
+                # Only segment the window around the predicted position
+                top = int(max(0, min(height, center[0] - radius)))
+                bottom = int(max(0, min(height, center[0] + radius)))
+                left = int(max(0, min(width, center[1] - radius)))
+                right = int(max(0, min(width, center[1] + radius)))
+                if bottom > top and right > left:
+                    mask = self._getColorMask(image[top:bottom, left:right], self.color)
+                    points = np.column_stack(np.where(mask > 0))
+                    if len(points) > 0:
+                        return points + np.array([top, left]), height, width
+
+            # Extract the region of interest (mask) based on the target color
+            mask = self._getColorMask(image, self.color)
+            points = np.column_stack(np.where(mask > 0))  # Extract pixel coordinates
+            return points, height, width
+
+    def _getColorMask(self, image, color):
+        """
+        Generate a binary mask isolating the target color.
+        Args:
+            image: Input image in BGR format.
+            color: Target color in hex format.
+        Returns:
+            Binary mask isolating the target color.
+        """
+        try:
+            hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)  # Convert image to HSV color space
+            lower_bound, upper_bound = self._getColorBounds(color)  # Get color bounds
+            mask = cv2.inRange(hsv_image, lower_bound, upper_bound)  # Generate mask
+
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+            return mask
+        except Exception as e:
+            print(f"Error generating color mask: {e}")
+            return None
+
+    def _getColorBounds(self, color):
+        """
+        Return the lower and upper HSV bounds for the target color.
+        Args:
+            color: Target color in hex format.
+        Returns:
+            Tuple (lower_bound, upper_bound) for the color in HSV.
+        """
+        try:
+            if color in color_ranges:
+                lower, upper = color_ranges[color]
+                return np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8)
+            else:
+                raise ValueError(f"Color '{color}' is not defined in color ranges.")
+        except Exception as e:
+            print(f"Error getting color bounds: {e}")
+            return None, None
@@ -0,0 +1,131 @@
+import http.server
+import threading
+import time
+import cv2
+import Display
+
+BOUNDARY = "frame"  # Separator of the MJPEG parts
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><title>Sphero Brain</title></head>
+<body style="margin:0;background:#000"><img src="/stream" style="max-width:100%"></body></html>
+"""
+
+class HeadlessDisplay(Display.Display):
+    def __init__(self, host="localhost", port=8081, max_fps=5, quality=80):
+        """
+        Display backend for machines without a screen. Instead of an OpenCV window, frames are composited
+        in the display thread, JPEG-encoded and served as an MJPEG stream over HTTP.
+        Frames are only rendered and encoded while a viewer is connected.
+
+        Args:
+            host: Interface the HTTP server listens on.
+            port: Port of the HTTP server (the stream is at /stream, with a viewer page at /).
+            max_fps: Maximum number of frames encoded per second.
+            quality: JPEG quality, from 0 to 100.
+        """
+        super().__init__(max_fps)
+        self.host = host
+        self.port = port
+        self.quality = quality
+        self.viewers = 0  # Number of connected stream clients
+        self.frame = None  # Latest JPEG-encoded frame
+        self.frame_id = 0  # Incremented for every encoded frame
+        self.frame_condition = threading.Condition()  # Notifies stream clients of new frames
+        self.server = None
+
+    def show(self):
+        """
+        Serve the stream and encode frames at most max_fps times per second while a viewer is connected.
+        """
+        self.server = http.server.ThreadingHTTPServer((self.host, self.port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Display: Streaming on http://{self.host}:{self.port}/")
+
+        rendered = None  # Version of the last encoded frame
+        while self.running:
+            frame_start = time.monotonic()
+            if self.viewers > 0:
+                with self.lock:
+                    version, image, static_version, static_drawings, dynamic_drawings = self._snapshot()
+
+                if image is not None and version != rendered:
+                    overlay_image, _, _ = self.render(image, static_version, static_drawings, dynamic_drawings)
+                    ok, jpeg = cv2.imencode(".jpg", overlay_image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                    if ok:
+                        with self.frame_condition:
+                            self.frame = jpeg.tobytes()
+                            self.frame_id += 1
+                            self.frame_condition.notify_all()
+                    rendered = version
+            else:
+                rendered = None  # Encode a fresh frame for the next viewer
+
+            time.sleep(max(0, 1 / self.max_fps - (time.monotonic() - frame_start)))
+
+    def _handler(self):
+        """
+        Request handler class bound to this display.
+        """
+        display = self
+
+        class StreamHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/":
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html")
+                    self.send_header("Content-Length", str(len(PAGE)))
+                    self.end_headers()
+                    self.wfile.write(PAGE)
+                elif self.path == "/stream":
+                    self.send_response(200)
+                    self.send_header("Cache-Control", "no-cache")
+                    self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+                    self.end_headers()
+                    display.stream(self.wfile)
+                else:
+                    self.send_error(404)
+
+            def log_message(self, format, *args):
+                pass  # Keep request logs out of the planner output
+
+        return StreamHandler
+
+    def stream(self, output):
+        """
+        Write encoded frames to a stream client until it disconnects or the display stops.
+        Args:
+            output: Writable file of the client connection.
+        """
+        with self.frame_condition:
+            self.viewers += 1
+            # Start with the frame already encoded, which a still scene would not replace
+            last_frame_id = self.frame_id - 1 if self.frame is not None else self.frame_id
+        try:
+            while self.running:
+                with self.frame_condition:
+                    if not self.frame_condition.wait_for(lambda: self.frame_id != last_frame_id or not self.running, timeout=1):
+                        continue
+                    frame, last_frame_id = self.frame, self.frame_id
+                if frame is None:
+                    continue
+                output.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(frame)}\r\n\r\n".encode())
+                output.write(frame)
+                output.write(b"\r\n")
+                output.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Viewer disconnected
+        finally:
+            with self.frame_condition:
+                self.viewers -= 1
+
+    def stop(self):
+        """
+        Stop the display loop and the HTTP server.
+        """
+        self.running = False
+        with self.frame_condition:
+            self.frame_condition.notify_all()
+        if self.server is not None:
+            self.server.shutdown()
@@ -0,0 +1,185 @@
+import threading
+import time
+
+SIGNIFICANT_BITS = 8  # 128 sub-buckets per power of two, for a relative error below 0.8%
+
+class Histogram:
+    def __init__(self):
+        """
+        Latency histogram with log-linear buckets (as in HdrHistogram).
+
+        Values are recorded in microseconds. Values below 2^SIGNIFICANT_BITS get a bucket each, and larger
+        ones share a bucket with the values that have the same leading SIGNIFICANT_BITS bits. This keeps the
+        relative error constant from microseconds to minutes with a few hundred buckets.
+        """
+        self.counts = {}  # Bucket index to number of values
+        self.count = 0
+        self.total = 0  # Sum of the recorded values in microseconds
+        self.min = None
+        self.max = None
+        self.lock = threading.Lock()  # Stages are recorded from planner, display and event loop threads
+
+    @staticmethod
+    def _bucket(value):
+        if value < (1 << SIGNIFICANT_BITS):
+            return value
+        shift = value.bit_length() - SIGNIFICANT_BITS
+        return (shift << (SIGNIFICANT_BITS - 1)) + (value >> shift)
+
+    @staticmethod
+    def _bucket_value(index):
+        """
+        Highest value in microseconds that falls into a bucket.
+        """
+        if index < (1 << SIGNIFICANT_BITS):
+            return index
+        shift, top = divmod(index, 1 << (SIGNIFICANT_BITS - 1))
+        top += 1 << (SIGNIFICANT_BITS - 1)
+        shift -= 1
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds):
+        """
+        Record a duration.
+        Args:
+            seconds: Duration in seconds.
+        """
+        self.record_us(max(0, int(seconds * 1e6)))
+
+    def record_us(self, value):
+        """
+        Record a duration in whole microseconds.
+        """
+        bucket = self._bucket(value)
+        with self.lock:
+            self.counts[bucket] = self.counts.get(bucket, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        """
+        Get a percentile of the recorded durations.
+        Args:
+            percent: Percentile between 0 and 100.
+        Returns:
+            The duration in seconds, or None if nothing was recorded.
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            rank = max(1, round(percent / 100 * self.count))
+            seen = 0
+            for bucket in sorted(self.counts):
+                seen += self.counts[bucket]
+                if seen >= rank:
+                    return min(self._bucket_value(bucket), self.max) / 1e6
+        return self.max / 1e6
+
+    def summary(self):
+        """
+        Get the count, mean, percentiles and extremes of the recorded durations.
+        Returns:
+            Dictionary of durations in seconds, or only the count if nothing was recorded.
+        """
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count / 1e6,
+            "min": self.min / 1e6,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max / 1e6,
+        }
+
+class Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        """
+        Context manager recording the duration of its block into a histogram.
+        Args:
+            histogram: Histogram of the timed stage.
+        """
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record_us((time.perf_counter_ns() - self.start) // 1000)
+        return False
+
+# Histograms of the perception-planning stages, shared by the whole process
+histograms = {}
+histograms_lock = threading.Lock()
+
+def histogram(stage):
+    """
+    Get the histogram of a stage, creating it on first use.
+    Args:
+        stage: Name of the stage (e.g., "capture").
+    Returns:
+        The stage's Histogram.
+    """
+    stage_histogram = histograms.get(stage)
+    if stage_histogram is None:
+        with histograms_lock:
+            stage_histogram = histograms.setdefault(stage, Histogram())
+    return stage_histogram
+
+def timer(stage):
+    """
+    Time a block with a monotonic clock, e.g. `with Instrumentation.timer("planning"): ...`.
+    Args:
+        stage: Name of the stage.
+    Returns:
+        A Timer context manager.
+    """
+    return Timer(histogram(stage))
+
+def record(stage, seconds):
+    """
+    Record a duration measured elsewhere (e.g., the delay of a feedback message).
+    Args:
+        stage: Name of the stage.
+        seconds: Duration in seconds.
+    """
+    histogram(stage).record(seconds)
+
+def summary():
+    """
+    Get the timing summary of every stage.
+    Returns:
+        Dictionary mapping each stage to its Histogram summary.
+    """
+    with histograms_lock:
+        stages = dict(histograms)
+    return {stage: stage_histogram.summary() for stage, stage_histogram in stages.items()}
+
+def format_summary():
+    """
+    Format the timing summary of every stage as a table in milliseconds.
+    """
+    stages = summary()
+    width = max([14] + [len(stage) + 2 for stage in stages])  # Room for the hop names of traced commands
+    lines = [f"{'stage':<{width}}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}"]
+    for stage, stats in sorted(stages.items()):
+        if stats["count"] == 0:
+            continue
+        lines.append(f"{stage:<{width}}{stats['count']:>8}" + "".join(
+            f"{stats[key] * 1000:>10.2f}" for key in ("mean", "p50", "p90", "p99", "max")))
+    return "\n".join(lines)
+
+def print_summary():
+    """
+    Print the timing summary, e.g. at exit.
+    """
+    if any(stage_histogram.count for stage_histogram in list(histograms.values())):
+        print(f"Stage timings (ms):\n{format_summary()}")
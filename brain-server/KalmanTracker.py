@@ -0,0 +1,150 @@
+import time
+import numpy as np
+import Estimator
+
+class KalmanTracker(Estimator.Estimator):
+    def __init__(self, camera, display, color, process_noise=50.0, robot_size=50.0):
+        """
+        Initialize a constant-velocity Kalman filter that tracks the centroid of the target color blob.
+        Args:
+            camera: Camera instance for capturing images.
+            display: Display instance for visualization.
+            color: Target color for localization (hex format).
+            process_noise: Standard deviation of the unmodelled acceleration, in pixels per second squared.
+            robot_size: Approximate Sphero size in pixels, used to scale the blob covariance.
+        """
+        super().__init__(camera, display, color)
+        self.process_noise = process_noise
+        self.robot_size = robot_size
+        self.state = None  # State vector [y, x, vy, vx]
+        self.covariance = None  # State covariance (4x4)
+        self.measurements = 0  # Number of measurements folded into the estimate
+        self.last_update = None  # Monotonic time of the previous update
+        self.pending_motion = None  # Commanded (dy, dx) displacement since the previous update
+        self.pending_time = 0.0  # Commanded roll time since the previous update
+
+    def update(self, dt=None):
+        """
+        Predict the blob position forward and correct it with the centroid of the current frame.
+        Args:
+            dt: Seconds the Sphero was commanded to move since the previous update.
+                Defaults to the wall-clock time since the previous update.
+        Returns:
+            Tuple (y, x, confidence) of the estimated position.
+        """
+        try:
+            now = time.monotonic()
+            if dt is None:
+                dt = 0 if self.last_update is None else now - self.last_update
+            self.last_update = now
+
+            center, radius = None, None
+            if self.state is not None:
+                if self.pending_motion is not None and self.pending_time > 0:
+                    # Use the commanded motion as the velocity prior for this step
+                    self.state[2:] = np.array(self.pending_motion) / self.pending_time
+                    dt = self.pending_time
+                self._predict(dt)
+
+                # Only search the window the predicted covariance allows for
+                center = self.state[:2]
+                radius = 3 * np.sqrt(max(self.covariance[0, 0], self.covariance[1, 1])) + 2 * self.robot_size
+            self.pending_motion = None
+            self.pending_time = 0.0
+            self.metrics["updates"] += 1
+
+            points, height, width = self._measure(center, radius)
+
+            if len(points) == 0:
+                if self.state is None:
+                    return height // 2, width // 2, 0  # Default to image center
+                return self.state[0], self.state[1], 0
+
+            # Measure the blob centroid and its spread
+            centroid = np.mean(points, axis=0)
+            if len(points) > 1:
+                measurement_cov = np.cov(points, rowvar=False) / (self.robot_size * 2)
+            else:
+                measurement_cov = np.eye(2)
+            measurement_cov += np.eye(2) * 1e-6  # Ensure covariance matrix is not singular
+
+            if self.state is None:
+                # Velocity is unknown until a second measurement arrives
+                self.state = np.array([centroid[0], centroid[1], 0.0, 0.0])
+                self.covariance = np.diag([measurement_cov[0, 0], measurement_cov[1, 1], 1e4, 1e4])
+            else:
+                self._correct(centroid, measurement_cov)
+            self.measurements += 1
+
+            confidence = np.exp(-np.linalg.det(self.covariance[:2, :2]))
+            return self.state[0], self.state[1], confidence
+        except Exception as e:
+            print(f"Error updating Kalman tracker: {e}")
+            if self.state is not None:
+                return self.state[0], self.state[1], 0  # Keep the last estimate, without confidence
+            return None, None, None
+
+    def predict(self, heading, timing, speed):
+        """
+        Record a commanded motion to use as the motion prior of the next update.
+        Args:
+            heading: Commanded heading in image degrees (0 is up, 90 is right).
+            timing: Commanded roll duration in seconds.
+            speed: Estimated roll speed in pixels per second.
+        """
+        distance = speed * timing
+        delta_y = -distance * np.cos(np.radians(heading))
+        delta_x = distance * np.sin(np.radians(heading))
+        if self.pending_motion is None:
+            self.pending_motion = (delta_y, delta_x)
+        else:
+            self.pending_motion = (self.pending_motion[0] + delta_y, self.pending_motion[1] + delta_x)
+        self.pending_time += timing
+
+    def get_velocity(self):
+        """
+        Get the estimated velocity of the Sphero.
+        Returns:
+            Tuple (vy, vx) in pixels per second, or None until two measurements have been observed.
+        """
+        if self.state is None or self.measurements < 2:
+            return None
+        return self.state[2], self.state[3]
+
+    def _predict(self, dt):
+        """
+        Propagate the state with the constant-velocity motion model.
+        Args:
+            dt: Time step in seconds.
+        """
+        transition = np.eye(4)
+        transition[0, 2] = dt
+        transition[1, 3] = dt
+
+        # White-noise acceleration model, applied independently on each axis
+        q = self.process_noise ** 2
+        block = q * np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]])
+        process_cov = np.zeros((4, 4))
+        process_cov[np.ix_([0, 2], [0, 2])] = block
+        process_cov[np.ix_([1, 3], [1, 3])] = block
+
+        self.state = transition @ self.state
+        self.covariance = transition @ self.covariance @ transition.T + process_cov
+
+    def _correct(self, measurement, measurement_cov):
+        """
+        Fold a position measurement into the state estimate.
+        Args:
+            measurement: Measured (y, x) position.
+            measurement_cov: Measurement covariance (2x2).
+        """
+        observation = np.zeros((2, 4))
+        observation[0, 0] = 1
+        observation[1, 1] = 1
+
+        innovation = measurement - observation @ self.state
+        innovation_cov = observation @ self.covariance @ observation.T + measurement_cov
+        gain = self.covariance @ observation.T @ np.linalg.inv(innovation_cov)
+
+        self.state = self.state + gain @ innovation
+        self.covariance = (np.eye(4) - gain @ observation) @ self.covariance
@@ -1,30 +1,93 @@
 import numpy as np
-import cv2
 from sklearn.mixture import GaussianMixture
-import Particle
-from color_ranges import color_ranges
+import Estimator
+import Instrumentation
 
-class Localizer:
-    def __init__(self, camera, display, color, num_particles):
+class Localizer(Estimator.Estimator):
+    def __init__(self, camera, display, color, num_particles, min_particles=30, max_particles=5000,
+                 kld_error=0.05, kld_quantile=2.326, bin_size=20, resample_threshold=0.5):
         """
         Initialize the Localizer class.
         Args:
             camera: Camera instance for capturing images.
             display: Display instance for visualization.
             color: Target color for localization (hex format).
-            num_particles: Number of particles to use in the particle filter.
+            num_particles: Number of particles used when the filter is first initialized.
+            min_particles: Lower bound of the adaptive particle count.
+            max_particles: Upper bound of the adaptive particle count.
+            kld_error: Maximum KL divergence between the sampled and true posterior (KLD sampling epsilon).
+            kld_quantile: Upper standard normal quantile for the KLD bound (2.326 is 99%).
+            bin_size: Size in pixels of the histogram bins used to measure the posterior spread.
+            resample_threshold: Resample when the effective sample size falls below this fraction of the particles.
         """
         try:
-            self.camera = camera  # Reference to the camera instance
-            self.display = display  # Reference to the display instance
-            self.color = color  # Target color for tracking
-            self.num_particles = num_particles  # Number of particles for tracking
-
-            # Initialize particles
-            self.particles = [Particle.Particle(display, color) for _ in range(num_particles)]
+            super().__init__(camera, display, color)
+            self.num_particles = num_particles  # Current number of particles
+            self.min_particles = min_particles
+            self.max_particles = max_particles
+            self.kld_error = kld_error
+            self.kld_quantile = kld_quantile
+            self.bin_size = bin_size
+            self.resample_threshold = resample_threshold
+            self.motion_noise = 0.1  # Spread of the motion prior as a fraction of the commanded distance
+            self.robot_size = 50.0  # Approximate Sphero size in pixels
+            self.predicted = False  # Whether a motion prior was applied since the last update
+
+            # Particle set as (x, y) positions and normalized weights, created on the first detection
+            self.positions = None
+            self.weights = None
+
+            self.metrics = {
+                "particles": num_particles,  # Particles used in the last update
+                "updates": 0,  # Number of updates
+                "resamples": 0,  # Number of updates that resampled
+                "resample_rate": 0.0,  # Fraction of updates that resampled
+                "ess": float(num_particles),  # Effective sample size in the last update
+            }
         except Exception as e:
             print(f"Error initializing Localizer: {e}")
 
+    def update(self, dt=None):
+        """
+        Update the particle filter with a new frame.
+        Args:
+            dt: Seconds the Sphero was commanded to move since the previous update (unused).
+        Returns:
+            Tuple (y, x, confidence) of the estimated position.
+        """
+        return self.updateParticles()
+
+    def predict(self, heading, timing, speed):
+        """
+        Propagate the particles with the commanded motion so the next update starts from an informed prior.
+        Args:
+            heading: Commanded heading in image degrees (0 is up, 90 is right).
+            timing: Commanded roll duration in seconds.
+            speed: Estimated roll speed in pixels per second.
+        """
+        try:
+            if self.positions is None:
+                return  # Not initialized from a measurement yet
+
+            distance = speed * timing
+            delta = np.array([distance * np.sin(np.radians(heading)), -distance * np.cos(np.radians(heading))])
+            spread = self.motion_noise * distance + 1.0
+
+            self.positions += delta + np.random.normal(0, spread, self.positions.shape)
+            self.predicted = True
+        except Exception as e:
+            print(f"Error predicting particles: {e}")
+
+    def _predictedWindow(self):
+        """
+        Compute the search window implied by the predicted particle cloud.
+        Returns:
+            Tuple (center, radius) where center is the (y, x) weighted particle mean.
+        """
+        mean_x, mean_y = np.average(self.positions, axis=0, weights=self.weights)
+        radius = 3 * np.max(np.std(self.positions, axis=0)) + 2 * self.robot_size
+        return (mean_y, mean_x), radius
+
     def updateParticles(self):
         """
         Update particle positions and weights based on the detected target color region.
@@ -32,218 +95,182 @@ class Localizer:
             Tuple (gmm_y, gmm_x): Coordinates of the Gaussian Mixture Model (GMM) mean.
         """
         try:
-            # Capture the current frame
-            image = self.camera.capture_image()
-            height, width = image.shape[:2]  # Extract height and width from the image
+            # Capture the current frame and extract the target color region,
+            # searching only around the predicted position when a motion prior is available
+            center, radius = self._predictedWindow() if self.predicted else (None, None)
+            points, height, width = self._measure(center, radius)
 
-            # Extract the region of interest (mask) based on the target color
-            mask = self._getColorMask(image, self.color)
-            points = np.column_stack(np.where(mask > 0))  # Extract pixel coordinates
-
-            confidence = 0 
+            confidence = 0
 
             # Fit a Gaussian Mixture Model to the color region
             if len(points) > 0:
                 # Calculate the geometric center of the points (unweighted mean)
                 geometric_center = np.mean(points, axis=0)  # Average of all points
-                robot_size = 50.0 
 
                 # Fit a Gaussian Mixture Model initialized at the geometric center
-                gmm = GaussianMixture(
-                    n_components=1,
-                    means_init=[geometric_center]  # Initialize mean to the geometric center
-                ).fit(points)
+                with Instrumentation.timer("gmm"):
+                    gmm = GaussianMixture(
+                        n_components=1,
+                        means_init=[geometric_center]  # Initialize mean to the geometric center
+                    ).fit(points)
 
                 # Retrieve GMM mean and covariance
                 gmm_y, gmm_x = gmm.means_[0]
-                cov = gmm.covariances_[0] / (robot_size * 2)
+                cov = gmm.covariances_[0] / (self.robot_size * 2)
                 cov += np.eye(2) * 1e-6  # Ensure covariance matrix is not singular
 
                 confidence = np.exp(-np.linalg.det(cov))
 
-                for particle in self.particles:
-                    if particle.x == 0 and particle.y == 0:
-                        particle.x = np.random.normal(gmm_x, np.sqrt(cov[0, 0]))
-                        particle.y = np.random.normal(gmm_y, np.sqrt(cov[1, 1]))
-                        particle.weight = 1.0 / len(self.particles)
+                if self.positions is None:
+                    # Initialize the particles around the first detection
+                    self._initializeParticles(gmm_y, gmm_x, cov, self.num_particles)
+            elif self.predicted:
+                # Keep the motion prior as the estimate while the Sphero is not visible
+                self.predicted = False
+                return center[0], center[1], 0
             else:
-                # Handle case when no points are detected
-                gmm_y, gmm_x = height // 2, width // 2   # Default to image center
-                cov = np.eye(2)  # Default covariance
-                confidence = 0 
+                # The Sphero is lost: spread the particles over the whole frame
+                self._scatterParticles(width, height)
+                self._recordMetrics(resampled=True)
+                return height // 2, width // 2, 0  # Default to image center
+
+            # Update particle weights based on the GMM (covariance reordered from (y, x) to (x, y))
+            self.weights = self.weights * self._calculateWeights((gmm_x, gmm_y), cov[::-1, ::-1])
 
-            # Update particle weights based on the GMM
-            for particle in self.particles:
-                gmm_weight = self._calculateWeight(particle.x, particle.y, (gmm_x, gmm_y), cov)
-                particle.weight = gmm_weight
+            if not np.any(self.weights > 0):
+                # No particle explains the detection, so restart the filter around it
+                self._initializeParticles(gmm_y, gmm_x, cov, self.num_particles)
 
             # Normalize weights
             self._normalizeWeights()
 
-            # Check if all weights are zero after normalization
-            total_weight = sum(p.weight for p in self.particles)
-            if total_weight == 0:
-                for particle in self.particles:
-                    particle.weight = 1.0 / len(self.particles)
-
-            # Resample and move particles
-            self._resampleAndMoveParticles(gmm_y, gmm_x)
+            # Only resample once the weights have degenerated
+            ess = 1.0 / np.sum(self.weights ** 2)
+            resampled = ess < self.resample_threshold * len(self.weights)
+            if resampled:
+                # Resample and move particles, only pulling them towards the mean without a motion prior
+                with Instrumentation.timer("resample"):
+                    self._resampleAndMoveParticles(gmm_y, gmm_x, 0 if self.predicted else 0.2)
+            self.predicted = False
 
+            self._recordMetrics(resampled, ess)
             return gmm_y, gmm_x, confidence
         except Exception as e:
             print(f"Error updating particles: {e}")
-            return None, None
+            return None, None, None
 
-    def _calculateWeight(self, x, y, mean, cov):
+    def _calculateWeights(self, mean, cov):
         """
-        Calculate particle weight using a Gaussian likelihood function.
+        Calculate particle weights using a Gaussian likelihood function.
         Args:
-            x, y: Particle coordinates.
             mean: Mean position as a tuple (x, y).
-            cov: Covariance matrix.
+            cov: Covariance matrix in (x, y) order.
         Returns:
-            Weight as a float.
+            Array of weights, one per particle.
         """
         try:
-            if mean is None:
-                return 0
-            mean = np.array(mean)
-            pos = np.array([x, y])
-            cov += np.eye(2) * 1e-6  # Add small value to diagonal for stability
+            cov = cov + np.eye(2) * 1e-6  # Add small value to diagonal for stability
             inv_cov = np.linalg.inv(cov)
-            diff = pos - mean
-            weight = np.exp(-0.5 * diff @ inv_cov @ diff.T) / (2 * np.pi * np.sqrt(np.linalg.det(cov)))
-            return weight
+            diff = self.positions - np.array(mean)
+            mahalanobis = np.einsum("ij,jk,ik->i", diff, inv_cov, diff)
+            return np.exp(-0.5 * mahalanobis) / (2 * np.pi * np.sqrt(np.linalg.det(cov)))
         except Exception as e:
-            return 0
+            return np.zeros(len(self.positions))
 
-    def _resampleAndMoveParticles(self, mean_y, mean_x):
+    def _adaptiveParticleCount(self):
+        """
+        Choose the number of particles with KLD sampling, based on how many histogram bins the posterior occupies.
+        Returns:
+            Number of particles to draw in the next resampling step.
         """
-        Resample particles based on their weights and move them closer to the detected mean.
+        bins = np.floor(self.positions[self.weights > 1e-12] / self.bin_size)
+        k = len(np.unique(bins, axis=0)) if len(bins) > 0 else 1
+        if k <= 1:
+            return self.min_particles
+
+        a = 2.0 / (9 * (k - 1))
+        n = (k - 1) / (2 * self.kld_error) * (1 - a + np.sqrt(a) * self.kld_quantile) ** 3
+        return int(np.clip(np.ceil(n), self.min_particles, self.max_particles))
+
+    def _resampleAndMoveParticles(self, mean_y, mean_x, pull=0.2):
+        """
+        Resample particles with low-variance (systematic) resampling and move them closer to the detected mean.
         Args:
             mean_x: X-coordinate of the detected mean.
             mean_y: Y-coordinate of the detected mean.
+            pull: Fraction of the distance to the mean each particle moves.
         """
         try:
-            weights = [p.weight for p in self.particles]
-
-            # Handle case where all weights are zero
-            if sum(weights) == 0:
-                for particle in self.particles:
-                    particle.move(np.random.uniform(0, self.display.width),
-                                  np.random.uniform(0, self.display.height),
-                                  1 / self.num_particles)
-                return
-
-            # Resample indices based on weights
-            resampled_indices = np.random.choice(
-                len(self.particles), size=self.num_particles, p=weights
-            )
-
-            # Move particles to the positions of the resampled ones, biased towards the mean
-            for i, particle in enumerate(self.particles):
-                resampled_particle = self.particles[resampled_indices[i]]
-
-                # Move towards the mean with some Gaussian noise
-                noise_x = np.random.normal(0, 1)  
-                noise_y = np.random.normal(0, 1)
-
-                new_x = 0.8 * resampled_particle.x + 0.2 * mean_x + noise_x  # Weighted towards mean
-                new_y = 0.8 * resampled_particle.y + 0.2 * mean_y + noise_y
-
-                particle.move(new_y, new_x, resampled_particle.weight / 4)
+            count = self._adaptiveParticleCount()
+
+            # One random offset, then evenly spaced pointers into the cumulative weights
+            pointers = (np.random.uniform() + np.arange(count)) / count
+            cumulative = np.cumsum(self.weights)
+            cumulative[-1] = 1.0  # Guard against rounding
+            resampled_indices = np.searchsorted(cumulative, pointers)
+
+            # Move towards the mean with some Gaussian noise
+            resampled = self.positions[resampled_indices]
+            noise = np.random.normal(0, 1, resampled.shape)
+            self.positions = (1 - pull) * resampled + pull * np.array([mean_x, mean_y]) + noise
+            self.weights = np.full(count, 1.0 / count)
+            self.num_particles = count
         except Exception as e:
             print(f"Error in resampling and moving particles: {e}")
 
-    def _getColorMask(self, image, color):
+    def _initializeParticles(self, mean_y, mean_x, cov, count):
         """
-        Generate a binary mask isolating the target color.
+        Draw a fresh, uniformly weighted particle set around a detection.
         Args:
-            image: Input image in BGR format.
-            color: Target color in hex format.
-        Returns:
-            Binary mask isolating the target color.
+            mean_y, mean_x: Detected position.
+            cov: Detection covariance in (y, x) order.
+            count: Number of particles to draw.
         """
-        try:
-            hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)  # Convert image to HSV color space
-            lower_bound, upper_bound = self._getColorBounds(color)  # Get color bounds
-            mask = cv2.inRange(hsv_image, lower_bound, upper_bound)  # Generate mask
-
-            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-
-            # Debug coordinates:
-            #moments = cv2.moments(mask)
-            #if moments["m00"] > 0:
-            #    center_x = int(moments["m10"] / moments["m00"])
-            #    center_y = int(moments["m01"] / moments["m00"])
-            #else:
-            #    center_x, center_y = -1, -1
-
-            # Create a black background and overlay the mask
-            #screen_width = 1920
-            #screen_height = 1080
-            #quarter_width = screen_width // 4
-            #quarter_height = screen_height // 4
-
-            #black_background = np.zeros((quarter_height, quarter_width), dtype=np.uint8)
-            #mask_resized = cv2.resize(mask, (quarter_width, quarter_height))
-            #overlay_image = cv2.merge((black_background, mask_resized, black_background))  # Optional: convert to 3 channels if needed
-
-            #if center_x >= 0 and center_y >= 0:
-            #    scaled_center_x = int(center_x * (quarter_width / mask.shape[1]))
-            #    scaled_center_y = int(center_y * (quarter_height / mask.shape[0]))
-
-                # Add a label with coordinates to the overlay image
-            #    cv2.circle(overlay_image, (scaled_center_x, scaled_center_y), 5, (0, 255, 0), -1)  # Green dot
-            #    label = f"({center_y}, {center_x})"
-            #    cv2.putText(
-            #        overlay_image,
-            #        label,
-            #        (scaled_center_x + 10, scaled_center_y - 10),  # Offset for readability
-            #        cv2.FONT_HERSHEY_SIMPLEX,
-            #        0.5,  # Font scale
-            #        (0, 255, 0),  # Green color
-            #        1,  # Thickness
-            #        cv2.LINE_AA
-            #    )
-
-            # Display the mask non-blocking
-            #cv2.imshow(f"Mask {color} for {lower_bound} - {upper_bound}", overlay_image)
-            #cv2.waitKey(1)  # Non-blocking, updates the display without halting execution
-
-            return mask
-        except Exception as e:
-            print(f"Error generating color mask: {e}")
-            return None
-
-    def _getColorBounds(self, color):
+        self.positions = np.column_stack((
+            np.random.normal(mean_x, np.sqrt(cov[1, 1]), count),
+            np.random.normal(mean_y, np.sqrt(cov[0, 0]), count),
+        ))
+        self.weights = np.full(count, 1.0 / count)
+        self.num_particles = count
+
+    def _scatterParticles(self, width, height):
         """
-        Return the lower and upper HSV bounds for the target color.
+        Spread the maximum number of particles uniformly over the frame while the Sphero is lost.
         Args:
-            color: Target color in hex format.
-        Returns:
-            Tuple (lower_bound, upper_bound) for the color in HSV.
+            width: Width of the frame.
+            height: Height of the frame.
         """
-        try:
-            if color in color_ranges:
-                lower, upper = color_ranges[color]
-                return np.array(lower, dtype=np.uint8), np.array(upper, dtype=np.uint8)
-            else:
-                raise ValueError(f"Color '{color}' is not defined in color ranges.")
-        except Exception as e:
-            print(f"Error getting color bounds: {e}")
-            return None, None
+        count = self.max_particles
+        self.positions = np.column_stack((
+            np.random.uniform(0, width, count),
+            np.random.uniform(0, height, count),
+        ))
+        self.weights = np.full(count, 1.0 / count)
+        self.num_particles = count
 
     def _normalizeWeights(self):
         """
-        Normalize particle weights to sum to 1.
+        Normalize particle weights to sum to 1, falling back to uniform weights if they all vanished.
         """
         try:
-            total_weight = sum(p.weight for p in self.particles)
+            total_weight = np.sum(self.weights)
             if total_weight > 0:
-                for particle in self.particles:
-                    particle.weight /= total_weight
+                self.weights = self.weights / total_weight
+            else:
+                self.weights = np.full(len(self.weights), 1.0 / len(self.weights))
         except Exception as e:
             print(f"Error normalizing weights: {e}")
+
+    def _recordMetrics(self, resampled, ess=None):
+        """
+        Record the particle count and resampling frequency of the last update.
+        Args:
+            resampled: Whether the last update resampled the particles.
+            ess: Effective sample size of the last update, if computed.
+        """
+        self.metrics["particles"] = self.num_particles
+        self.metrics["updates"] += 1
+        if resampled:
+            self.metrics["resamples"] += 1
+        self.metrics["resample_rate"] = self.metrics["resamples"] / self.metrics["updates"]
+        self.metrics["ess"] = float(ess if ess is not None else self.num_particles)
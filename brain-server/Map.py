@@ -16,6 +16,8 @@ class Map:
         self.goal = None  # Variable to store the goal region
         self.nodes = []  # List of PRM nodes
         self.edges = []  # List of PRM edges
+        self.node_index = {}  # PRM node to its index in self.nodes
+        self.adjacency = {}  # Node index to the indices of its neighbors
         self.kdtree = None
 
     def calculate_obstacle_weight(self, area):
@@ -100,7 +102,7 @@ class Map:
                                 # Store and visualize the split rectangle
                                 self.obstacles.append(split_rect)
                                 self.obstacle_weights[split_rect] = split_weight
-                                self.display.draw_rectangle(f"obstacle_{split_rect}", split_x, split_y, actual_width, actual_height, weight=2, color="#FFA500")
+                                self.display.draw_rectangle(f"obstacle_{split_rect}", split_x, split_y, actual_width, actual_height, weight=2, color="#FFA500", layer="obstacles")
                 else:
                     # Process rectangles within size limits
                     mask_region = contour_mask[y:y + h, x:x + w]
@@ -109,7 +111,7 @@ class Map:
                         weight = self.calculate_obstacle_weight(area)
                         self.obstacles.append(filled_rect)
                         self.obstacle_weights[filled_rect] = weight
-                        self.display.draw_rectangle(f"obstacle_{filled_rect}", x, y, w, h, weight=2, color="#FFA500")
+                        self.display.draw_rectangle(f"obstacle_{filled_rect}", x, y, w, h, weight=2, color="#FFA500", layer="obstacles")
 
         # Detect the goal region
         goal_mask = cv2.inRange(hsv_image, goal_range["lower"], goal_range["upper"])
@@ -120,7 +122,7 @@ class Map:
             largest_contour = max(contours, key=cv2.contourArea)
             x, y, w, h = cv2.boundingRect(largest_contour)
             self.goal = (x, y, w, h)
-            self.display.draw_rectangle("goal", x, y, w, h, weight=2, color="#0000FF")
+            self.display.draw_rectangle("goal", x, y, w, h, weight=2, color="#0000FF", layer="obstacles")
 
     def generate_prm(self, num_nodes=100, initial_radius=100, max_radius=500):
         """
@@ -136,6 +138,8 @@ class Map:
         # Initialize nodes and edges for the PRM
         self.nodes = []
         self.edges = []
+        self._index_roadmap()
+        edge_set = set()  # Membership test for self.edges
 
         height, width = self.display.height, self.display.width
 
@@ -144,7 +148,7 @@ class Map:
             gx, gy, gw, gh = self.goal
             goal_center = (gx + gw // 2, gy + gh // 2)
             self.nodes.append(goal_center)
-            self.display.draw_point("goal_node", goal_center[1], goal_center[0], weight=0.2, color="#0000FF")
+            self.display.draw_point("goal_node", goal_center[1], goal_center[0], weight=0.2, color="#0000FF", layer="roadmap")
             # Debug Nodes
             #self.display.draw_label(f"goal_label", goal_center[1], goal_center[0], f"y:{goal_center[1]},x:{goal_center[0]}", color="#0000FF")
         else:
@@ -174,7 +178,8 @@ class Map:
                         distance = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
                         if distance <= current_radius and not self.check_collision_with_rects((x1, y1), (x2, y2)):
                             edge = ((x1, y1), (x2, y2))
-                            if edge not in self.edges:
+                            if edge not in edge_set:
+                                edge_set.add(edge)
                                 self.edges.append(edge)
                                 connections += 1
                 if connections < 3:
@@ -182,23 +187,46 @@ class Map:
 
         # Prune nodes and edges not connected to the goal
         self._prune_unconnected_nodes()
+        self._index_roadmap()
 
         # Draw the remaining nodes and edges
         for x, y in self.nodes:
-            self.display.draw_point(f"node_{x}_{y}", y, x, weight=0.1, color="#00FF00")
+            self.display.draw_point(f"node_{x}_{y}", y, x, weight=0.1, color="#00FF00", layer="roadmap")
             # Debug Nodes
             #self.display.draw_label(f"node_{x}_{y}_label", y, x, f"y:{y},x:{x}", color="#00FF00")
 
 
         for (x1, y1), (x2, y2) in self.edges:
-            self.display.draw_line(f"edge_{x1}_{y1}_{x2}_{y2}", (y1, x1), (y2, x2), weight=1, color="#000000")
-
-            if self.nodes:
-                self.kdtree = KDTree(self.nodes)
-            else:
-                print("No PRM nodes available to build KDTree.")
+            self.display.draw_line(f"edge_{x1}_{y1}_{x2}_{y2}", (y1, x1), (y2, x2), weight=1, color="#000000", layer="roadmap")
 
+    def _index_roadmap(self):
+        """
+        Rebuild the node index, the adjacency lists and the KDTree after the roadmap changes.
+        """
+        # The first occurrence wins for duplicate nodes, as with list.index
+        self.node_index = {node: index for index, node in reversed(list(enumerate(self.nodes)))}
+        self.adjacency = {index: [] for index in self.node_index.values()}
+        for node1, node2 in self.edges:
+            index1, index2 = self.node_index[node1], self.node_index[node2]
+            self.adjacency[index1].append(index2)
+            if index2 != index1:
+                self.adjacency[index2].append(index1)
+
+        if self.nodes:
+            self.kdtree = KDTree(self.nodes)
+        else:
+            self.kdtree = None
+            print("No PRM nodes available to build KDTree.")
 
+    def neighbors(self, index):
+        """
+        Get the neighbors of a PRM node.
+        Args:
+            index: Index of the node in self.nodes.
+        Returns:
+            List of neighbor indices.
+        """
+        return self.adjacency.get(self.node_index[self.nodes[index]], [])
 
     def find_closest_node(self, position):
         """
@@ -1,6 +1,8 @@
 import threading
 import Camera
 import Display
+import HeadlessDisplay
+import Instrumentation
 import Drone
 import Map
 import queue
@@ -8,8 +10,9 @@ import numpy as np
 import asyncio
 import json
 import math
+import time
 
-def send_message(ws, id, message_type, message_content):
+def send_message(ws, id, message_type, message_content, wire_format=None, loop=None):
     """
     Sends a message to the WebSocket server in a non-async way.
     Args:
@@ -17,6 +20,9 @@ def send_message(ws, id, message_type, message_content):
         id: Unique identifier for the message sender.
         message_type: Type of message (e.g., "BrainControl").
         message_content: Content of the message to be sent.
+        wire_format: WireFormat used to encode the message, or None for JSON.
+        loop: Event loop that owns the connection. The send is scheduled on it from the calling thread,
+            or run in a temporary event loop if None.
     """
     try:
         message = {
@@ -25,9 +31,14 @@ def send_message(ws, id, message_type, message_content):
             "messageType": message_type,
             "message": message_content,
         }
-        message = json.dumps(message)
+        with Instrumentation.timer("send"):
+            message = wire_format.encode(message) if wire_format is not None else json.dumps(message)
 
-        asyncio.run(_send_message_async(ws, message))
+            if loop is not None:
+                # Sends from planner threads are queued on the connection's loop in call order
+                asyncio.run_coroutine_threadsafe(_send_message_async(ws, message), loop)
+            else:
+                asyncio.run(_send_message_async(ws, message))
         #print(f"WebSocket: Sent message: {message}")
     except Exception as e:
         print(f"WebSocket: Error sending message: {e}")
@@ -46,14 +57,39 @@ async def _send_message_async(ws, message):
 
 
 class Planner:
-    def __init__(self, spheros):
+    def __init__(self, spheros, max_segments=1, estimator="particle", camera_every=1, wire_format=None, swarm_tick=False,
+                 clock=None, execute_lead=0, headless=False, display_port=8081, display_fps=None, tracer=None):
         """
         Initialize the Planner class to manage the overall system.
         Args:
             spheros: List of dictionaries, where each dictionary contains the "id" and "color" of a Sphero.
+            max_segments: Maximum number of roadmap hops batched into a single movement command.
+            estimator: Position estimator used by every Drone, either "particle" or "kalman".
+            camera_every: Run the camera pipeline every k-th step per Drone once onboard odometry is calibrated.
+            wire_format: WireFormat used to encode outgoing messages, or None for JSON.
+            swarm_tick: Send the commands of each planning tick for every Sphero in one BrainTick message.
+            clock: ClockSync with the offset of the Controller Server clock.
+            execute_lead: Seconds after sending at which commands are scheduled to start, or 0 to start them on arrival.
+            headless: Stream the display as MJPEG over HTTP instead of showing an OpenCV window.
+            display_port: Port of the headless display stream.
+            display_fps: Maximum display frame rate, or None for the backend's default.
+            tracer: Tracer adding a correlation ID and hop timestamps to every command, or None.
         """
         self.ws = None
-        self.display = Display.Display()  # Initialize the display instance
+        self.loop = None  # Event loop of the WebSocket connection, set by start
+        self.wire_format = wire_format
+        self.swarm_tick = swarm_tick
+        self.tick_commands = None  # Commands collected during the current planning tick, when batching
+        self.clock = clock
+        self.execute_lead = execute_lead
+        self.tracer = tracer
+        self.max_segments = max(1, max_segments)
+        # Initialize the display instance
+        display_options = {} if display_fps is None else {"max_fps": display_fps}
+        if headless:
+            self.display = HeadlessDisplay.HeadlessDisplay(port=display_port, **display_options)
+        else:
+            self.display = Display.Display(**display_options)
         self.camera = Camera.Camera(self.display)  # Initialize the camera instance with the display
         self.camera.capture_image()  # Capture an initial image from the camera
 
@@ -67,24 +103,29 @@ class Planner:
 
         # Initialize the list of Spheros (Drones)
         self.spheros = [
-            Drone.Drone(self, self.camera, self.display, sphero["id"], sphero["color"], self.map)
+            Drone.Drone(self, self.camera, self.display, sphero["id"], sphero["color"], self.map, estimator, camera_every)
             for sphero in spheros
         ]
+        self.drones = {sphero.sphero_id: sphero for sphero in self.spheros}  # Sphero ID to Drone
 
         self.trajectory_queue = queue.Queue()
         self.queue_condition = threading.Condition()  # Create a condition variable
 
-    def start(self, ws):
+    def start(self, ws, loop=None, trigger=True):
         """
         Start the system by iterating over all Spheros and triggering their next moves.
         Args:
             ws: WebSocket connection to send updates.
+            loop: Event loop that owns the connection, when the Planner runs on other threads.
+            trigger: Trigger the first move of every Sphero, or leave it to the caller (e.g., to run them in parallel).
         """
         print("System started.")
         threading.Thread(target=self.process_trajectories, daemon=True).start()
         self.ws = ws
-        for sphero in self.spheros:
-            sphero.execute_state()  # Trigger the state execution for each Sphero
+        self.loop = loop
+        if trigger:
+            for sphero in self.spheros:
+                sphero.execute_state()  # Trigger the state execution for each Sphero
 
     def _start_event_loop(self):
         """
@@ -100,9 +141,52 @@ class Planner:
         Args:
             id: The unique ID of the Sphero to control.
         """
-        for sphero in self.spheros:
-            if sphero.sphero_id == id:  # Match the Sphero by ID
-                sphero.execute_state()  # Trigger its state execution
+        sphero = self.drones.get(id)  # Match the Sphero by ID
+        if sphero is not None:
+            sphero.execute_state()  # Trigger its state execution
+
+    def add_telemetry(self, telemetry):
+        """
+        Forward a batch of onboard telemetry frames to the matching Drones.
+        Args:
+            telemetry: SpheroTelemetry message with the "fields" of each frame and the "frames" themselves.
+        """
+        try:
+            fields = {field: index for index, field in enumerate(telemetry["fields"])}
+            for frame in telemetry["frames"]:
+                drone = self.drones.get(frame[fields["id"]])
+                if drone is not None:
+                    drone.add_telemetry(frame[fields["t"]], frame[fields["x"]], frame[fields["y"]])
+        except Exception as e:
+            print(f"Error adding telemetry: {e}")
+
+    def send_matrix_frame(self, frame, sphero_id=None):
+        """
+        Show an 8x8 frame on the LED matrix of one Sphero, or of every Sphero at once.
+        Args:
+            frame: 8 rows of 8 hex colors (None for an unlit pixel), indexed as frame[y][x].
+            sphero_id: ID of the target Sphero, or None to broadcast to the whole swarm.
+        """
+        message = {"frame": frame}
+        if sphero_id is not None:
+            message["id"] = sphero_id
+        send_message(self.ws, "SpheroBrain", "BrainMatrixFrame", message, self.wire_format, self.loop)
+
+    def get_estimator_metrics(self):
+        """
+        Get the position estimator metrics of every Sphero.
+        Returns:
+            Dictionary mapping each Sphero ID to its estimator metrics.
+        """
+        return {sphero.sphero_id: sphero.get_estimator_metrics() for sphero in self.spheros}
+
+    def get_stage_timings(self):
+        """
+        Get the latency summary of each perception-planning stage (see Instrumentation).
+        Returns:
+            Dictionary mapping each stage to its count, mean, percentiles and extremes in seconds.
+        """
+        return Instrumentation.summary()
 
     def add_trajectory(self, trajectory):
         """Add a trajectory to the queue and process if the queue is full."""
@@ -127,11 +211,16 @@ class Planner:
                 trajectories = []
                 while not self.trajectory_queue.empty():
                     trajectories.append(self.trajectory_queue.get())
+                tick_start = time.perf_counter()
 
                 # Evaluate CVaR risk for collision
-                collision_pairs = self._evaluate_collision_risk(trajectories)
+                with Instrumentation.timer("collision"):
+                    collision_pairs = self._evaluate_collision_risk(trajectories)
                 collision_ids = set()
 
+                if self.swarm_tick:
+                    self.tick_commands = []  # Collect this tick's commands instead of sending them one by one
+
                 # Handle drones with potential collision risks
                 for drone1, drone2 in collision_pairs:
                     print(f"Collision risk detected between Drone {drone1.sphero_id} and Drone {drone2.sphero_id}")
@@ -143,11 +232,17 @@ class Planner:
                 for trajectory, drone in trajectories:
                     if drone.sphero_id not in collision_ids:
                         print(f"No collision detected for Drone {drone.sphero_id}. Moving to next point.")
-                        if len(trajectory) > 1:
+                        if len(trajectory) > 2:
+                            self._notify_and_move_drone_sequence(drone, trajectory[1:])
+                        elif len(trajectory) > 1:
                             self._notify_and_move_drone(drone, trajectory[1])
                         else:
                             print(f"Drone {drone.sphero_id} has reached its final destination.")
 
+                if self.swarm_tick:
+                    self._send_tick()
+                Instrumentation.record("tick", time.perf_counter() - tick_start)
+
                 # Print completion message
                 #print("All trajectories processed. Queue cleared.")
 
@@ -267,7 +362,7 @@ class Planner:
                 adjusted_path.append(node)
             else:
                 # Attempt to find an alternate neighboring node
-                neighbors = drone._get_neighbors(self.map.nodes.index(node))
+                neighbors = [self.map.nodes[index] for index in drone._get_neighbors(self.map.node_index[node])]
                 for neighbor in neighbors:
                     if neighbor not in collision_nodes and neighbor not in adjusted_path:
                         adjusted_path.append(neighbor)
@@ -298,7 +393,97 @@ class Planner:
             }
 
             drone.move(current_x, current_y, target_x, target_y)
-            send_message(self.ws, drone.sphero_id, "BrainControl", message_content)
+            drone.predict_motion(angle_deg, timing)
+            self._send_command(drone, "BrainControl", message_content)
+        except Exception as e:
+            print(f"Error notifying and moving Drone {drone.sphero_id}: {e}")
+
+    def _notify_and_move_drone_sequence(self, drone, waypoints):
+        """
+        Notify a drone of several upcoming waypoints and move it through all of them with a single command.
+        Args:
+            drone: The drone to notify and move.
+            waypoints: List of target points as tuples (x, y), in the order they should be visited.
+        """
+        try:
+            current_y = drone.current_y
+            current_x = drone.current_x
+            segments = drone.plan_segments(waypoints)
+
+            if not segments:
+                return
+
+            target_x, target_y = waypoints[len(segments) - 1]
+            print(f"Moving [{drone.sphero_id}] from Y: {current_y}, X: {current_x} to Y:{target_y}, X: {target_x} in {len(segments)} segment(s)")
+
+            if len(segments) == 1:
+                # Not enough movement history to time the follow-up hops yet, so send a plain command
+                angle_deg, timing = segments[0]
+                message_type = "BrainControl"
+                message_content = {
+                    "id": drone.sphero_id,
+                    "angle": int(round(angle_deg)),
+                    "timing": float(timing)
+                }
+            else:
+                message_type = "BrainControlSequence"
+                message_content = {
+                    "id": drone.sphero_id,
+                    "segments": [
+                        {"angle": int(round(angle_deg)), "timing": float(timing)}
+                        for angle_deg, timing in segments
+                    ]
+                }
+
+            drone.move(current_x, current_y, target_x, target_y)
+            for angle_deg, timing in segments:
+                drone.predict_motion(angle_deg, timing)
+            self._send_command(drone, message_type, message_content)
         except Exception as e:
             print(f"Error notifying and moving Drone {drone.sphero_id}: {e}")
 
+    def _send_command(self, drone, message_type, message_content):
+        """
+        Send a movement command, or add it to the current tick when batching.
+        Args:
+            drone: The drone the command is for.
+            message_type: "BrainControl" or "BrainControlSequence".
+            message_content: Command with the Sphero "id" and either "angle" and "timing", or "segments".
+        """
+        if self.tracer is not None:
+            self.tracer.start(message_content)
+
+        if self.tick_commands is not None:
+            self.tick_commands.append(message_content)
+        else:
+            execute_at = self._execute_at()
+            if execute_at is not None:
+                message_content["execute_at"] = execute_at
+            if self.tracer is not None:
+                self.tracer.mark_sent(message_content)
+            send_message(self.ws, drone.sphero_id, message_type, message_content, self.wire_format, self.loop)
+
+    def _send_tick(self):
+        """
+        Send every command collected during the current tick in a single BrainTick message.
+        """
+        commands, self.tick_commands = self.tick_commands, None
+        if commands:
+            message_content = {"commands": commands}
+            execute_at = self._execute_at()
+            if execute_at is not None:
+                message_content["execute_at"] = execute_at  # Every Sphero of the tick starts at the same time
+            if self.tracer is not None:
+                for command in commands:
+                    self.tracer.mark_sent(command)
+            send_message(self.ws, "SpheroBrain", "BrainTick", message_content, self.wire_format, self.loop)
+
+    def _execute_at(self):
+        """
+        Controller clock time at which a command sent now should start.
+        Returns:
+            The timestamp, or None if scheduling is disabled or the clocks are not synchronized yet.
+        """
+        if self.execute_lead <= 0 or self.clock is None or not self.clock.synchronized:
+            return None
+        return self.clock.controller_time(time.time() + self.execute_lead)
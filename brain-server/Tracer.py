@@ -0,0 +1,116 @@
+import collections
+import itertools
+import json
+import threading
+import time
+import Instrumentation
+
+# Hops of a traced command, as (start timestamp, end timestamp, name), in the order they happen
+HOPS = [
+    ("planned", "brain_send", "tick wait"),  # Batched into the planning tick
+    ("brain_send", "relay_in", "brain to relay"),
+    ("relay_in", "relay_out", "relay"),
+    ("relay_out", "controller_in", "relay to controller"),  # Includes the relay's outbound queue
+    ("controller_in", "dequeued", "controller queue"),  # Sphero command channel (asyncio or Manager queue)
+    ("dequeued", "ble_start", "setup and schedule"),  # LED and heading commands, execute_at wait
+    ("ble_start", "ble_end", "roll"),
+    ("ble_end", "feedback_send", "feedback queue"),
+    ("feedback_send", "feedback_relay", "controller to relay"),
+    ("feedback_relay", "brain_in", "relay to brain"),
+]
+CONTROLLER_KEYS = {"controller_in", "dequeued", "ble_start", "ble_end", "feedback_send"}  # On the controller clock
+
+class Tracer:
+    def __init__(self, path, clock=None, max_commands=10000):
+        """
+        Trace commands end to end with a correlation ID and a timestamp for each hop.
+
+        The Planner adds a "trace" dictionary to each command, every hop (relay, controller, BLE) adds its
+        timestamp to it, and the feedback message carries it back. Controller timestamps are converted to
+        the brain clock with the ClockSync offset. The relay is assumed to share the brain clock.
+
+        Args:
+            path: Chrome trace file (chrome://tracing or Perfetto) written by write().
+            clock: ClockSync with the offset of the Controller Server clock.
+            max_commands: Number of most recent commands kept for the trace file.
+        """
+        self.path = path
+        self.clock = clock
+        self.ids = itertools.count(1)  # Correlation IDs
+        self.commands = collections.deque(maxlen=max_commands)  # (Sphero ID, trace) of completed commands
+        self.lock = threading.Lock()
+
+    def start(self, message_content):
+        """
+        Add a new trace to a command.
+        Args:
+            message_content: Command sent to a Sphero, with its "id".
+        """
+        message_content["trace"] = {"id": next(self.ids), "planned": time.time()}
+
+    def mark_sent(self, message_content):
+        """
+        Record the send time of a traced command.
+        """
+        trace = message_content.get("trace")
+        if trace is not None:
+            trace["brain_send"] = time.time()
+
+    def finish(self, sphero_id, trace, received_at):
+        """
+        Complete the trace returned with the feedback of a command and record its hop latencies.
+        Args:
+            sphero_id: ID of the Sphero that ran the command.
+            trace: Trace dictionary carried back by the feedback.
+            received_at: Brain time the feedback was received.
+        """
+        offset = self.clock.offset if self.clock is not None else 0.0
+        trace = {key: value - offset if key in CONTROLLER_KEYS else value for key, value in trace.items()}
+        trace["brain_in"] = received_at
+
+        for start, end, name in HOPS:
+            if start in trace and end in trace:
+                Instrumentation.record(f"hop {name}", trace[end] - trace[start])
+        if "planned" in trace:
+            Instrumentation.record("round trip", received_at - trace["planned"])
+
+        with self.lock:
+            self.commands.append((sphero_id, trace))
+
+    def events(self):
+        """
+        Build Chrome trace events: one row per Sphero, with each command spanning its hops.
+        Returns:
+            List of trace events.
+        """
+        with self.lock:
+            commands = list(self.commands)
+
+        rows = {}  # Sphero ID to thread ID
+        events = []
+        for sphero_id, trace in commands:
+            if sphero_id not in rows:
+                rows[sphero_id] = len(rows) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": rows[sphero_id],
+                               "args": {"name": str(sphero_id)}})
+            tid = rows[sphero_id]
+            begin = trace.get("planned", trace.get("brain_send"))
+            if begin is not None:
+                events.append({"name": f"command {trace['id']}", "ph": "X", "pid": 1, "tid": tid,
+                               "ts": begin * 1e6, "dur": (trace["brain_in"] - begin) * 1e6, "args": {"id": trace["id"]}})
+            for start, end, name in HOPS:
+                if start in trace and end in trace:
+                    events.append({"name": name, "ph": "X", "pid": 1, "tid": tid, "ts": trace[start] * 1e6,
+                                   "dur": max(0.0, trace[end] - trace[start]) * 1e6, "args": {"id": trace["id"]}})
+        return events
+
+    def write(self):
+        """
+        Write the traced commands to the trace file.
+        """
+        try:
+            with open(self.path, "w") as trace_file:
+                json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, trace_file)
+            print(f"Trace of {len(self.commands)} command(s) written to {self.path}")
+        except Exception as e:
+            print(f"Error writing trace: {e}")
@@ -0,0 +1,129 @@
+import argparse
+import time
+import numpy as np
+import cv2
+import Instrumentation
+import KalmanTracker
+import Localizer
+from color_ranges import color_ranges
+
+class SyntheticDisplay:
+    def __init__(self, width, height):
+        """
+        Minimal stand-in for Display that only tracks the frame dimensions.
+        Args:
+            width: Width of the synthetic frames.
+            height: Height of the synthetic frames.
+        """
+        self.width = width
+        self.height = height
+
+    def set_image(self, image):
+        pass
+
+class SyntheticCamera:
+    def __init__(self, color, width=1280, height=720, radius=25, speed=120.0, dt=0.5, noise=8, seed=0):
+        """
+        Camera that renders a colored disk moving around an ellipse on a noisy background.
+        Args:
+            color: Hex color of the tracked Sphero (must exist in color_ranges).
+            width, height: Frame dimensions in pixels.
+            radius: Disk radius in pixels.
+            speed: Disk speed in pixels per second.
+            dt: Simulated seconds between captures.
+            noise: Standard deviation of the background noise.
+            seed: Random seed for the background.
+        """
+        self.width = width
+        self.height = height
+        self.radius = radius
+        self.speed = speed
+        self.dt = dt
+        rng = np.random.default_rng(seed)
+        self.background = rng.normal(60, noise, (height, width, 3)).clip(0, 255).astype(np.uint8)
+        self.t = 0.0
+        self.position = None  # Ground-truth (y, x) of the last rendered frame
+        self.bgr = self._bgr_for(color)
+
+    def _bgr_for(self, color):
+        """Pick a BGR value in the middle of the color's HSV range."""
+        lower, upper = color_ranges[color]
+        hsv = np.uint8([[[(lower[i] + upper[i]) // 2 for i in range(3)]]])
+        return tuple(int(c) for c in cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0, 0])
+
+    def _position_at(self, t):
+        """Ground-truth (y, x) position at time t."""
+        circumference = np.pi * (self.width + self.height) / 2
+        phase = 2 * np.pi * self.speed * t / circumference
+        return (self.height / 2 + self.height / 3 * np.sin(phase),
+                self.width / 2 + self.width / 3 * np.cos(phase))
+
+    def next_motion(self):
+        """
+        Describe the motion until the next capture the way the Planner would command it.
+        Returns:
+            Tuple (heading, timing, speed) in image degrees, seconds and pixels per second.
+        """
+        y0, x0 = self._position_at(self.t - self.dt)
+        y1, x1 = self._position_at(self.t)
+        heading = np.degrees(np.arctan2(x1 - x0, -(y1 - y0))) % 360
+        return heading, self.dt, np.hypot(x1 - x0, y1 - y0) / self.dt
+
+    def capture_image(self):
+        """
+        Render the next frame.
+        Returns:
+            frame (numpy.ndarray): Synthetic BGR frame.
+        """
+        y, x = self._position_at(self.t)
+        self.position = (y, x)
+        self.t += self.dt
+
+        frame = self.background.copy()
+        cv2.circle(frame, (int(x), int(y)), self.radius, self.bgr, -1)
+        return frame
+
+def benchmark(name, make_estimator, steps, color, motion_prior=False):
+    """
+    Run one estimator over a synthetic trajectory and report its cost and accuracy.
+    Args:
+        name: Label printed in the report.
+        make_estimator: Callable taking (camera, display) and returning an estimator.
+        steps: Number of frames to process.
+        color: Hex color of the tracked Sphero.
+        motion_prior: Whether to feed the commanded motion to the estimator before each update.
+    """
+    camera = SyntheticCamera(color)
+    display = SyntheticDisplay(camera.width, camera.height)
+    estimator = make_estimator(camera, display)
+
+    timings = []
+    errors = []
+    for step in range(steps):
+        if motion_prior and step > 0:
+            estimator.predict(*camera.next_motion())
+        start = time.perf_counter()
+        y, x, _ = estimator.update(camera.dt if step > 0 else None)
+        timings.append((time.perf_counter() - start) * 1000)
+        errors.append(np.hypot(y - camera.position[0], x - camera.position[1]))
+
+    # Skip the first frame, which includes one-off initialization
+    timings = np.array(timings[1:])
+    errors = np.array(errors[1:])
+    print(f"{name:>10}: {timings.mean():7.2f} ms/update (p95 {np.percentile(timings, 95):7.2f} ms), "
+          f"RMSE {np.sqrt(np.mean(errors ** 2)):6.2f} px, metrics {estimator.metrics}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the particle filter against the Kalman tracker.")
+    parser.add_argument("--steps", type=int, default=50, help="Number of frames per estimator.")
+    parser.add_argument("--color", default="#FF00FF", help="Hex color of the synthetic Sphero.")
+    parser.add_argument("--particles", type=int, default=500, help="Particle count for the particle filter.")
+    parser.add_argument("--motion-prior", action="store_true",
+                        help="Feed the commanded motion to the estimators before each update.")
+    args = parser.parse_args()
+
+    benchmark("particle", lambda camera, display: Localizer.Localizer(camera, display, args.color, args.particles),
+              args.steps, args.color, args.motion_prior)
+    benchmark("kalman", lambda camera, display: KalmanTracker.KalmanTracker(camera, display, args.color),
+              args.steps, args.color, args.motion_prior)
+    Instrumentation.print_summary()  # Stage breakdown across both estimators
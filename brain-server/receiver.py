@@ -1,58 +1,200 @@
+import argparse
 import asyncio
+import atexit
+import collections
+import concurrent.futures
 import json
+import os
+import sys
+import time
+import ClockSync
+import Instrumentation
 import Planner
+import Tracer
 from websockets import connect
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))  # Shared wire_format.py
+from wire_format import WireFormat
+
+DROPPED_RETRY = 0.5  # Seconds before planning again for a Sphero whose command the relay dropped
 
 class WebSocketHandler:
-    def __init__(self):
+    def __init__(self, planner_options=None, wire="json", clock_interval=2.0, workers=None, trace=None):
         """
         Initialize the WebSocketHandler class to manage WebSocket communication and Planner coordination.
+        Args:
+            planner_options: Keyword arguments forwarded to the Planner when it is created.
+            wire: Message encoding, "json" or "binary" (negotiated with the server in the connection message).
+            clock_interval: Seconds between clock sync pings to the Controller Server (0 disables them).
+            workers: Number of threads running Planner work, or None for the ThreadPoolExecutor default.
+            trace: Chrome trace file for end-to-end command tracing, or None to disable tracing.
         """
+        self.planner_options = planner_options or {}  # Per-run Planner settings (e.g., max_segments)
+        self.wire = wire
+        self.wire_format = WireFormat(wire)  # Encodes and decodes messages, shared with the Planner
+        self.clock = ClockSync.ClockSync()  # Offset of the Controller Server clock, used to schedule moves
+        self.clock_interval = clock_interval
+        self.tracer = Tracer.Tracer(trace, self.clock) if trace else None  # Per-hop timestamps of every command
         self.planner = None  # Instance of Planner, initialized when a "SpheroConnection" message is received
-        self.lock = asyncio.Lock()  # Lock to ensure thread-safe operations
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)  # Runs Planner work off the event loop
+        self.locks = collections.defaultdict(asyncio.Lock)  # One lock per Sphero ID (and "SpheroBrain" for the Planner itself)
+        self.tasks = set()  # Pending Planner work, referenced until it completes
+
+    def dispatch(self, key, function, *args, after=None):
+        """
+        Run Planner work on the worker pool without blocking the event loop.
+
+        Work with the same key runs one at a time in arrival order, so each Sphero's feedback is handled
+        in sequence while different Spheros are planned in parallel.
+        Args:
+            key: Serialization key, the Sphero ID or "SpheroBrain" for Planner setup.
+            function: Blocking function to run.
+            *args: Arguments of the function.
+            after: Key whose work queued so far must finish first (e.g., "SpheroBrain"), or None.
+        """
+        task = asyncio.create_task(self._run(key, function, *args, after=after))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, key, function, *args, after=None):
+        if after is not None:
+            async with self.locks[after]:
+                pass  # Wait for the work queued before this one (asyncio.Lock is first-in, first-out)
+        async with self.locks[key]:
+            try:
+                await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+            except Exception as e:
+                print(f"Error handling {key}: {e}")
 
-    async def handle_message(self, ws, id, message_type, message):
+    def create_planner(self, spheros):
+        """
+        Create the Planner for the connected Spheros (captures the map and generates the roadmap).
+        A controller re-sends its SpheroConnection after every reconnect. If it lists the Spheros of the running
+        Planner, the Planner is kept, instead of opening the camera again and restarting every Sphero.
+        """
+        if self.planner is not None and {drone.sphero_id for drone in self.planner.spheros} == {sphero["id"] for sphero in spheros}:
+            print("Spheros re-registered, keeping the running Planner.")
+            return
+        self.wire_format.set_ids([sphero["id"] for sphero in spheros])  # Interned IDs of binary frames
+        self.planner = Planner.Planner(spheros, wire_format=self.wire_format, clock=self.clock, tracer=self.tracer,
+                                       **self.planner_options)
+
+    def handle_message(self, ws, id, message_type, message, received_at=None):
         """
         Handles incoming messages and initializes Planner when a SpheroConnection is received.
+        Planner work is dispatched to the worker pool, so this returns without waiting for it.
         Args:
             ws: WebSocket connection instance.
             id: Unique identifier of the sender.
             message_type: Type of the message (e.g., "SpheroConnection").
             message: Content of the message.
+            received_at: Time the message was received, or None for now.
+        """
+        match message_type:
+            case "SpheroConnection":
+                print(f"Received SpheroConnection message: {message}")
+                spheros = message  # List of Spheros with "id" and "color"
+                self.dispatch("SpheroBrain", self.create_planner, spheros)
+            case "SpheroReady":
+                # Queued behind the Planner creation
+                self.dispatch("SpheroBrain", self.start_planner, ws, asyncio.get_running_loop())
+            case "SpheroTelemetry":
+                if self.planner is not None:
+                    self.planner.add_telemetry(message)  # Batched onboard odometry, cheap enough for the event loop
+            case "SpheroFeedback":
+                # Feedback is either a bare Sphero ID or a dictionary with completion details
+                if isinstance(message, dict):
+                    sphero_id = message["id"]
+                    if "status" in message:
+                        print(f"{sphero_id} movement {message['status']}")
+                        if message["status"] == "dropped":
+                            # The relay could not deliver the command, so plan again once the Sphero may be reachable
+                            asyncio.get_running_loop().call_later(
+                                DROPPED_RETRY, lambda: self.dispatch(sphero_id, self.next_move, sphero_id, after="SpheroBrain"))
+                        # Otherwise it was preempted or superseded by a newer one, which reports its own completion
+                        return
+                    if "completed" in message:
+                        print(f"{sphero_id} completed {len(message['completed'])} segment(s) at {message['completed']}")
+                    if "completed_at" in message:
+                        # Completion times are on the controller clock
+                        delay = self.clock.controller_time(time.time()) - message["completed_at"]
+                        Instrumentation.record("feedback", delay)
+                        print(f"{sphero_id} feedback arrived {delay:.3f}s after completion")
+                    if self.tracer is not None and "trace" in message:
+                        self.tracer.finish(sphero_id, message["trace"], received_at or time.time())
+                else:
+                    sphero_id = message
+                print(f"Next move for {sphero_id}")
+                self.dispatch(sphero_id, self.next_move, sphero_id, after="SpheroBrain")  # Process feedback and plan the next move
+
+    def next_move(self, sphero_id):
+        """
+        Plan the next move of a Sphero on the worker pool.
+        The Planner is looked up when the work runs, since it is created on the pool as well. Feedback that
+        arrives before the Planner is started is dropped: starting it plans the first move of every Sphero.
+        Args:
+            sphero_id: ID of the Sphero.
         """
-        async with self.lock:  # Acquire lock before modifying or accessing planner
-            match message_type:
-                case "SpheroConnection":
-                    print(f"Received SpheroConnection message: {message}")
-                    spheros = message  # List of Spheros with "id" and "color"
-                    self.planner = Planner.Planner(spheros)
-                case "SpheroReady":
-                    print("Starting planner...")
-                    self.planner.start(ws)  # Start the Planner when all Spheros are ready
-                case "SpheroFeedback":
-                    print(f"Next move for {id}")
-                    self.planner.next_move(message)  # Process feedback and plan the next move
+        planner = self.planner
+        if planner is None or planner.ws is None:
+            print(f"Planner not started, ignoring feedback from {sphero_id}")
+            return
+        planner.next_move(sphero_id)
+
+    def start_planner(self, ws, loop):
+        """
+        Start the Planner when all Spheros are ready, then plan the first move of every Sphero in parallel.
+        Args:
+            ws: WebSocket connection instance.
+            loop: Event loop that owns the connection.
+        """
+        if self.planner.ws is not None:
+            print("Spheros ready again, the Planner is already running.")  # Re-announced after a controller reconnect
+            return
+        print("Starting planner...")
+        self.planner.start(ws, loop, trigger=False)
+        for sphero in self.planner.spheros:
+            loop.call_soon_threadsafe(self.dispatch, sphero.sphero_id, self.planner.next_move, sphero.sphero_id)
+
+    async def ping_clock(self, ws):
+        """
+        Periodically ping the Controller Server to keep the clock offset estimate fresh.
+        Args:
+            ws: WebSocket connection instance.
+        """
+        while True:
+            await ws.send(self.wire_format.encode({
+                "clientType": "SpheroBrain",
+                "id": "SpheroBrain",
+                "messageType": "BrainClockPing",
+                "message": self.clock.ping_message(),
+            }))
+            await asyncio.sleep(self.clock_interval)
 
     async def websocket_receiver(self):
         """
         Connect to the WebSocket server and handle messages continuously.
         """
+        pinger = None
         try:
             async with connect("ws://localhost:8080") as ws:
                 print("WebSocket: Connected to the server.\n")
 
                 # Send initialization message to identify the client
-                await ws.send(json.dumps({"clientType": "SpheroBrain", "messageType": "BrainConnection"}))
+                await ws.send(json.dumps({"clientType": "SpheroBrain", "messageType": "BrainConnection", "encoding": self.wire}))
                 print("WebSocket: Sent connection initialization.\n")
 
+                if self.clock_interval > 0:
+                    pinger = asyncio.create_task(self.ping_clock(ws))
+
                 while True:
                     try:
                         # Receive and process messages in real-time
                         message = await ws.recv()
+                        received_at = time.time()
                         #print(f"WebSocket: Received message: {message} \n")
 
                         try:
-                            parsed_message = json.loads(message)
+                            parsed_message = self.wire_format.decode(message)  # JSON text or a binary frame
 
                             # Ensure parsed_message is a dictionary
                             if not isinstance(parsed_message, dict):
@@ -63,12 +205,22 @@ class WebSocketHandler:
                             if not all(key in parsed_message for key in required_keys):
                                 raise KeyError(f"Message missing required keys. Received: {parsed_message}")
 
+                            if parsed_message["messageType"] == "SpheroClockPong":
+                                # Handled here, with its receive time, rather than behind Planner work
+                                synchronized = self.clock.synchronized
+                                self.clock.add_pong(parsed_message["message"], received_at)
+                                if not synchronized:
+                                    print(f"Clock synchronized: controller offset {self.clock.offset * 1000:.1f} ms, "
+                                          f"round trip {self.clock.round_trip * 1000:.1f} ms")
+                                continue
+
                             # Handle the message
-                            await self.handle_message(
+                            self.handle_message(
                                 ws,
                                 parsed_message["id"],
                                 parsed_message["messageType"],
                                 parsed_message["message"],
+                                received_at,
                             )
                         except (json.JSONDecodeError, KeyError, ValueError) as e:
                             print(f"WebSocket: Malformed message: {e}")
@@ -77,15 +229,58 @@ class WebSocketHandler:
         except Exception as e:
             print(f"WebSocket: Connection error: {e}\n")
         finally:
+            if pinger is not None:
+                pinger.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
             print("WebSocket: Closing connection.\n")
 
 # Main function
-async def main():
+async def main(planner_options=None, wire="json", clock_interval=2.0, workers=None, trace=None):
     """
     Main entry point to start the WebSocket receiver.
+    Args:
+        planner_options: Keyword arguments forwarded to the Planner when it is created.
+        wire: Message encoding, "json" or "binary".
+        clock_interval: Seconds between clock sync pings to the Controller Server.
+        workers: Number of threads running Planner work.
+        trace: Chrome trace file for end-to-end command tracing, or None.
     """
-    handler = WebSocketHandler()
+    handler = WebSocketHandler(planner_options, wire, clock_interval, workers, trace)
+    if handler.tracer is not None:
+        atexit.register(handler.tracer.write)
     await handler.websocket_receiver()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Sphero Brain Server")
+    parser.add_argument("--max-segments", type=int, default=1,
+                        help="Maximum number of roadmap hops batched into a single movement command.")
+    parser.add_argument("--estimator", choices=["particle", "kalman"], default="particle",
+                        help="Position estimator used to track each Sphero.")
+    parser.add_argument("--camera-every", type=int, default=1,
+                        help="Run the camera pipeline every k-th step per Sphero, dead-reckoning with onboard telemetry in between.")
+    parser.add_argument("--swarm-tick", action="store_true",
+                        help="Send the commands of each planning tick for every Sphero in one BrainTick message.")
+    parser.add_argument("--execute-lead", type=float, default=0,
+                        help="Schedule each command (or tick) to start this many seconds after it is sent, on the synchronized controller clock (0 runs commands on arrival).")
+    parser.add_argument("--clock-interval", type=float, default=2.0,
+                        help="Seconds between clock sync pings to the Controller Server (0 disables clock sync).")
+    parser.add_argument("--headless", action="store_true",
+                        help="Serve the display as an MJPEG stream over HTTP instead of opening a window.")
+    parser.add_argument("--display-port", type=int, default=8081,
+                        help="Port of the headless display stream (http://localhost:PORT/).")
+    parser.add_argument("--display-fps", type=float, default=None,
+                        help="Maximum display frame rate (default: 30 for the window, 5 for the headless stream).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Threads planning Spheros in parallel (default: the ThreadPoolExecutor default).")
+    parser.add_argument("--trace", metavar="FILE", default=None,
+                        help="Trace every command end to end (relay, controller, BLE, feedback) and write a Chrome trace file on exit.")
+    parser.add_argument("--wire", choices=["json", "binary"], default="json",
+                        help="Message encoding: readable JSON, or compact binary frames with JSON kept for other messages.")
+    args = parser.parse_args()
+
+    atexit.register(Instrumentation.print_summary)  # Where each tick's milliseconds went
+
+    asyncio.run(main({"max_segments": args.max_segments, "estimator": args.estimator, "camera_every": args.camera_every,
+                      "swarm_tick": args.swarm_tick, "execute_lead": args.execute_lead,
+                      "headless": args.headless, "display_port": args.display_port, "display_fps": args.display_fps},
+                     args.wire, args.clock_interval, args.workers, args.trace))
@@ -0,0 +1,16 @@
+// Node side of check_wire_format.py: reads {ids, messages, frames} as JSON on stdin, decodes every
+// frame encoded by wire_format.py and encodes every message, then writes {decoded, encoded} to stdout.
+const wire = require("./wire_format");
+
+let input = "";
+process.stdin.on("data", (chunk) => (input += chunk));
+process.stdin.on("end", () => {
+  const cases = JSON.parse(input);
+  wire.setIds(cases.ids);
+  const decoded = cases.frames.map((frame) => wire.decode(Buffer.from(frame, "hex")));
+  const encoded = cases.messages.map((message) => {
+    const frame = wire.encode(message);
+    return frame ? frame.toString("hex") : null;
+  });
+  process.stdout.write(JSON.stringify({ decoded: decoded, encoded: encoded }));
+});
@@ -0,0 +1,78 @@
+import json
+import os
+import subprocess
+import sys
+from wire_format import EXECUTE_AT, HEADER, JSON_PAYLOAD, WireFormat
+
+IDS = ["SB-1", "SB-2", "SB-3"]
+
+def _messages():
+    """
+    One message per struct layout, the scheduled variant of every command, and a JSON-bodied message.
+    """
+    telemetry = {"fields": ["id", "t", "x", "y", "vx", "vy", "heading"],
+                 "frames": [["SB-1", 1730000000.25, 12.5, -3.0, 0.1, -40.7, 359.9], ["SB-3", 1730000000.5, 0, 0, 0, 0, 0]]}
+    commands = {
+        "SpheroMovement": {"angle": -90, "timing": 0.75},
+        "BrainControl": {"id": "SB-2", "angle": 180, "timing": 1.5},
+        "SpheroMovementSequence": {"segments": [{"angle": 0, "timing": 0.5}, {"angle": 270, "timing": 0.125}]},
+        "BrainControlSequence": {"id": "SB-3", "segments": [{"angle": 45, "timing": 2.0}]},
+        "SpheroTick": {"commands": [{"id": "SB-1", "angle": 10, "timing": 0.2}, {"id": "SB-2", "angle": -10, "timing": 0.3}]},
+        "BrainTick": {"commands": [{"id": "SB-3", "angle": 359, "timing": 0.4}]},
+    }
+    messages = []
+    for message_type, body in commands.items():
+        messages.append((message_type, body))
+        messages.append((message_type, {**body, "execute_at": 1730000001.125}))
+    messages.append(("SpheroFeedback", {"id": "SB-1", "completed_at": 1730000002.5}))
+    messages.append(("SpheroTelemetry", telemetry))
+    messages.append(("SpheroFeedback", {"id": "SB-2", "status": "dropped", "dropped_at": 1730000003.0}))  # JSON body
+
+    targets = {"SpheroMovement": "SB-1", "SpheroMovementSequence": "SB-2", "SpheroFeedback": "SB-1"}
+    framed = []
+    for message_type, body in messages:
+        client_type = "SpheroBrain" if message_type.startswith("Brain") else "SpheroController"
+        message = {"clientType": client_type, "messageType": message_type, "message": body}
+        message["id"] = targets.get(message_type, "SpheroBrain" if client_type == "SpheroController" else "*")
+        framed.append(message)
+    return framed
+
+def check():
+    """
+    Encode every message with wire_format.py and decode it with wire_format.js, and the reverse.
+    Both sides must produce identical struct frames and decode every frame to the original message.
+
+    Returns:
+        Number of mismatches.
+    """
+    wire_format = WireFormat("binary")
+    wire_format.set_ids(IDS)
+    messages = _messages()
+    frames = [wire_format.encode(message) for message in messages]
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "check_wire_format.js")
+    cases = {"ids": IDS, "messages": messages, "frames": [frame.hex() for frame in frames]}
+    result = json.loads(subprocess.run(["node", script], input=json.dumps(cases), capture_output=True, text=True,
+                                       check=True).stdout)
+
+    errors = 0
+    for message, frame, js_decoded, js_encoded in zip(messages, frames, result["decoded"], result["encoded"]):
+        tag = HEADER.unpack_from(frame)[1]
+        layout = "json" if tag & JSON_PAYLOAD else "struct+execute_at" if tag & EXECUTE_AT else "struct"
+        problems = []
+        if wire_format.decode(frame) != message:
+            problems.append("Python round trip")
+        if js_decoded != message:
+            problems.append("decoded by JS")
+        if js_encoded is None or layout != "json" and bytes.fromhex(js_encoded) != frame:
+            problems.append("encoded by JS")  # JSON bodies may format numbers differently, e.g. 3.0 as 3
+        elif wire_format.decode(bytes.fromhex(js_encoded)) != message:
+            problems.append("JS frame decoded by Python")
+        errors += bool(problems)
+        print(f"{message['messageType']:<24}{layout:<19}{'ok' if not problems else 'MISMATCH: ' + ', '.join(problems)}")
+    return errors
+
+if __name__ == "__main__":
+    errors = check()
+    print(f"{errors} mismatch(es)" if errors else "wire_format.py and wire_format.js agree")
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,293 @@
+// Binary message framing shared with the Python services (wire_format.py / WireFormat.py).
+// Binary frames start with a header (magic byte, message type tag, interned ID), followed by either
+// a fixed-layout struct or a JSON-encoded message body. Keep in sync with the Python copies.
+const MAGIC = 0xb5;
+const HEADER_SIZE = 4;
+const JSON_PAYLOAD = 0x80; // Tag flag marking a JSON-encoded message body
+const EXECUTE_AT = 0x40; // Tag flag marking a struct followed by the "execute_at" timestamp
+const NO_ID = 0xffff; // Interned ID of a message without an "id"
+
+const MESSAGE_TYPES = [
+  "BrainConnection", "BrainControl", "BrainControlSequence", "BrainMatrixFrame",
+  "SpheroConnection", "SpheroReady", "SpheroFeedback", "SpheroTelemetry",
+  "SpheroMovement", "SpheroMovementSequence", "SpheroMatrix", "SpheroMatrixFrame",
+  "MoveNorth", "MoveSouth", "MoveWest", "MoveEast",
+  "BrainTick", "SpheroTick",
+  "BrainClockPing", "SpheroClockPing", "SpheroClockPong",
+];
+const TAGS = new Map(MESSAGE_TYPES.map((messageType, tag) => [messageType, tag]));
+const RESERVED_IDS = ["*", "SpheroBrain", "SpheroController"]; // Interned before the Sphero IDs
+const TELEMETRY_FIELDS = ["id", "t", "x", "y", "vx", "vy", "heading"];
+
+const SEGMENT_SIZE = 10; // int16 angle, float64 timing
+const TELEMETRY_FRAME_SIZE = 30; // uint16 Sphero ID, float64 time, 5 x int32 values in tenths
+
+let ids = RESERVED_IDS.slice();
+let index = new Map(ids.map((id, i) => [id, i]));
+
+/**
+ * Interns the Sphero IDs. Every side derives the same table from the SpheroConnection list.
+ * @param {Array} spheroIds - Sphero IDs, in the order of the SpheroConnection list.
+ */
+function setIds(spheroIds) {
+  ids = RESERVED_IDS.concat(spheroIds.filter((id) => !RESERVED_IDS.includes(id)));
+  index = new Map(ids.map((id, i) => [id, i]));
+}
+
+function isPlainObject(value) {
+  return value !== null && typeof value === "object" && !Array.isArray(value);
+}
+
+function hasExactKeys(value, keys) {
+  return isPlainObject(value) && Object.keys(value).length === keys.length && keys.every((key) => key in value);
+}
+
+function isSegment(segment, keys = ["angle", "timing"]) {
+  return (
+    hasExactKeys(segment, keys) &&
+    Number.isInteger(segment.angle) && segment.angle >= -32768 && segment.angle < 32768 &&
+    typeof segment.timing === "number"
+  );
+}
+
+function tenths(value) {
+  if (typeof value !== "number" || Math.abs(value) >= 2 ** 31 / 10) {
+    return null;
+  }
+  const scaled = Math.round(value * 10);
+  return scaled / 10 === value ? scaled : null;
+}
+
+function writeSegments(buffer, offset, segments) {
+  buffer.writeUInt16LE(segments.length, offset);
+  offset += 2;
+  segments.forEach((segment) => {
+    buffer.writeInt16LE(segment.angle, offset);
+    buffer.writeDoubleLE(segment.timing, offset + 2);
+    offset += SEGMENT_SIZE;
+  });
+}
+
+function readSegments(buffer, offset) {
+  const count = buffer.readUInt16LE(offset);
+  const segments = [];
+  for (let i = 0; i < count; i++) {
+    const position = offset + 2 + i * SEGMENT_SIZE;
+    segments.push({ angle: buffer.readInt16LE(position), timing: buffer.readDoubleLE(position + 2) });
+  }
+  return segments;
+}
+
+/**
+ * Packs the body of a high-rate message into its fixed-layout struct.
+ * @returns {Buffer|null} The struct, or null if the body has another shape.
+ */
+function pack(messageType, body) {
+  let buffer;
+  switch (messageType) {
+    case "SpheroMovement":
+      if (!isSegment(body)) return null;
+      buffer = Buffer.alloc(SEGMENT_SIZE);
+      buffer.writeInt16LE(body.angle, 0);
+      buffer.writeDoubleLE(body.timing, 2);
+      return buffer;
+
+    case "BrainControl":
+      if (!isSegment(body, ["id", "angle", "timing"]) || !index.has(body.id)) return null;
+      buffer = Buffer.alloc(2 + SEGMENT_SIZE);
+      buffer.writeUInt16LE(index.get(body.id), 0);
+      buffer.writeInt16LE(body.angle, 2);
+      buffer.writeDoubleLE(body.timing, 4);
+      return buffer;
+
+    case "SpheroMovementSequence":
+    case "BrainControlSequence": {
+      const targeted = messageType === "BrainControlSequence";
+      const keys = targeted ? ["id", "segments"] : ["segments"];
+      if (!hasExactKeys(body, keys) || !Array.isArray(body.segments) || body.segments.length >= 2 ** 16) return null;
+      if (!body.segments.every((segment) => isSegment(segment))) return null;
+      if (targeted && !index.has(body.id)) return null;
+      const offset = targeted ? 2 : 0;
+      buffer = Buffer.alloc(offset + 2 + body.segments.length * SEGMENT_SIZE);
+      if (targeted) buffer.writeUInt16LE(index.get(body.id), 0);
+      writeSegments(buffer, offset, body.segments);
+      return buffer;
+    }
+
+    case "BrainTick":
+    case "SpheroTick": {
+      if (!hasExactKeys(body, ["commands"]) || !Array.isArray(body.commands) || body.commands.length >= 2 ** 16) return null;
+      // Ticks with movement sequences are sent as JSON
+      if (!body.commands.every((command) => isSegment(command, ["id", "angle", "timing"]) && index.has(command.id))) return null;
+      buffer = Buffer.alloc(2 + body.commands.length * (2 + SEGMENT_SIZE));
+      buffer.writeUInt16LE(body.commands.length, 0);
+      body.commands.forEach((command, i) => {
+        const position = 2 + i * (2 + SEGMENT_SIZE);
+        buffer.writeUInt16LE(index.get(command.id), position);
+        buffer.writeInt16LE(command.angle, position + 2);
+        buffer.writeDoubleLE(command.timing, position + 4);
+      });
+      return buffer;
+    }
+
+    case "SpheroFeedback":
+      if (!hasExactKeys(body, ["id", "completed_at"]) || !index.has(body.id) || typeof body.completed_at !== "number") return null;
+      buffer = Buffer.alloc(10);
+      buffer.writeUInt16LE(index.get(body.id), 0);
+      buffer.writeDoubleLE(body.completed_at, 2);
+      return buffer;
+
+    case "SpheroTelemetry": {
+      if (!hasExactKeys(body, ["fields", "frames"]) || JSON.stringify(body.fields) !== JSON.stringify(TELEMETRY_FIELDS)) return null;
+      if (!Array.isArray(body.frames) || body.frames.length >= 2 ** 16) return null;
+      buffer = Buffer.alloc(2 + body.frames.length * TELEMETRY_FRAME_SIZE);
+      buffer.writeUInt16LE(body.frames.length, 0);
+      for (let i = 0; i < body.frames.length; i++) {
+        const frame = body.frames[i];
+        if (frame.length !== TELEMETRY_FIELDS.length || !index.has(frame[0]) || typeof frame[1] !== "number") return null;
+        const values = frame.slice(2).map(tenths);
+        if (values.includes(null)) return null;
+        const position = 2 + i * TELEMETRY_FRAME_SIZE;
+        buffer.writeUInt16LE(index.get(frame[0]), position);
+        buffer.writeDoubleLE(frame[1], position + 2);
+        values.forEach((value, j) => buffer.writeInt32LE(value, position + 10 + j * 4));
+      }
+      return buffer;
+    }
+  }
+  return null;
+}
+
+/**
+ * Unpacks the body of a high-rate message from its fixed-layout struct.
+ */
+function unpack(messageType, payload) {
+  switch (messageType) {
+    case "SpheroMovement":
+      return { angle: payload.readInt16LE(0), timing: payload.readDoubleLE(2) };
+
+    case "BrainControl":
+      return { id: ids[payload.readUInt16LE(0)], angle: payload.readInt16LE(2), timing: payload.readDoubleLE(4) };
+
+    case "SpheroMovementSequence":
+      return { segments: readSegments(payload, 0) };
+
+    case "BrainControlSequence":
+      return { id: ids[payload.readUInt16LE(0)], segments: readSegments(payload, 2) };
+
+    case "BrainTick":
+    case "SpheroTick": {
+      const count = payload.readUInt16LE(0);
+      const commands = [];
+      for (let i = 0; i < count; i++) {
+        const position = 2 + i * (2 + SEGMENT_SIZE);
+        commands.push({
+          id: ids[payload.readUInt16LE(position)],
+          angle: payload.readInt16LE(position + 2),
+          timing: payload.readDoubleLE(position + 4),
+        });
+      }
+      return { commands: commands };
+    }
+
+    case "SpheroFeedback":
+      return { id: ids[payload.readUInt16LE(0)], completed_at: payload.readDoubleLE(2) };
+
+    case "SpheroTelemetry": {
+      const count = payload.readUInt16LE(0);
+      const frames = [];
+      for (let i = 0; i < count; i++) {
+        const position = 2 + i * TELEMETRY_FRAME_SIZE;
+        const frame = [ids[payload.readUInt16LE(position)], payload.readDoubleLE(position + 2)];
+        for (let j = 0; j < 5; j++) {
+          frame.push(payload.readInt32LE(position + 10 + j * 4) / 10);
+        }
+        frames.push(frame);
+      }
+      return { fields: TELEMETRY_FIELDS, frames: frames };
+    }
+  }
+  throw new Error(`No struct layout for ${messageType}`);
+}
+
+/**
+ * Serializes a message as a binary frame.
+ * @param {Object} message - Object with the messageType, message and optional id and clientType keys.
+ * @returns {Buffer|null} The frame, or null if the message cannot be framed and must be sent as JSON.
+ */
+function encode(message) {
+  const allowed = ["clientType", "id", "messageType", "message"];
+  if (!TAGS.has(message.messageType) || !("message" in message) || !Object.keys(message).every((key) => allowed.includes(key))) {
+    return null;
+  }
+
+  let idIndex = NO_ID;
+  if ("id" in message) {
+    if (!index.has(message.id)) return null;
+    idIndex = index.get(message.id);
+  }
+
+  const body = message.message;
+  let tag = TAGS.get(message.messageType);
+  let payload;
+  if (isPlainObject(body) && typeof body.execute_at === "number") {
+    // Scheduled commands keep their struct layout, with the timestamp appended
+    const { execute_at: executeAt, ...command } = body;
+    payload = pack(message.messageType, command);
+    if (payload !== null) {
+      const timestamp = Buffer.alloc(8);
+      timestamp.writeDoubleLE(executeAt, 0);
+      payload = Buffer.concat([payload, timestamp]);
+      tag |= EXECUTE_AT;
+    }
+  } else {
+    payload = pack(message.messageType, body);
+  }
+  if (payload === null) {
+    payload = Buffer.from(JSON.stringify(message.message));
+    tag |= JSON_PAYLOAD;
+  }
+
+  const header = Buffer.alloc(HEADER_SIZE);
+  header.writeUInt8(MAGIC, 0);
+  header.writeUInt8(tag, 1);
+  header.writeUInt16LE(idIndex, 2);
+  return Buffer.concat([header, payload]);
+}
+
+/**
+ * Parses a message received as JSON text or as a binary frame.
+ * The clientType of a binary frame is implied by its message type.
+ * @param {Buffer|string} data - Data received from the WebSocket.
+ * @returns {Object} The parsed message.
+ */
+function decode(data) {
+  if (typeof data === "string" || data.length === 0 || data[0] !== MAGIC) {
+    return JSON.parse(data.toString());
+  }
+
+  const tag = data.readUInt8(1);
+  const idIndex = data.readUInt16LE(2);
+  const messageType = MESSAGE_TYPES[tag & ~(JSON_PAYLOAD | EXECUTE_AT)];
+  const payload = data.subarray(HEADER_SIZE);
+  let body;
+  if (tag & JSON_PAYLOAD) {
+    body = JSON.parse(payload.toString());
+  } else if (tag & EXECUTE_AT) {
+    body = unpack(messageType, payload.subarray(0, payload.length - 8));
+    body.execute_at = payload.readDoubleLE(payload.length - 8);
+  } else {
+    body = unpack(messageType, payload);
+  }
+  const message = {
+    clientType: messageType.startsWith("Brain") ? "SpheroBrain" : "SpheroController",
+    messageType: messageType,
+    message: body,
+  };
+  if (idIndex !== NO_ID) {
+    message.id = ids[idIndex];
+  }
+  return message;
+}
+
+module.exports = { setIds, encode, decode };
@@ -0,0 +1,260 @@
+import json
+import struct
+
+# Binary frames start with a header, followed by either a fixed-layout struct or a JSON-encoded message body.
+# Imported by all three services. wire_format.js is the Node port, checked against it by check_wire_format.py.
+MAGIC = 0xB5
+HEADER = struct.Struct("<BBH")  # Magic byte, message type tag, interned ID
+JSON_PAYLOAD = 0x80  # Tag flag marking a JSON-encoded message body
+EXECUTE_AT = 0x40  # Tag flag marking a struct followed by the "execute_at" timestamp
+NO_ID = 0xFFFF  # Interned ID of a message without an "id"
+
+MESSAGE_TYPES = [
+    "BrainConnection", "BrainControl", "BrainControlSequence", "BrainMatrixFrame",
+    "SpheroConnection", "SpheroReady", "SpheroFeedback", "SpheroTelemetry",
+    "SpheroMovement", "SpheroMovementSequence", "SpheroMatrix", "SpheroMatrixFrame",
+    "MoveNorth", "MoveSouth", "MoveWest", "MoveEast",
+    "BrainTick", "SpheroTick",
+    "BrainClockPing", "SpheroClockPing", "SpheroClockPong",
+]
+TAGS = {message_type: tag for tag, message_type in enumerate(MESSAGE_TYPES)}
+RESERVED_IDS = ["*", "SpheroBrain", "SpheroController"]  # Interned before the Sphero IDs
+TELEMETRY_FIELDS = ["id", "t", "x", "y", "vx", "vy", "heading"]
+
+SEGMENT = struct.Struct("<hd")  # Angle in degrees, timing in seconds
+TARGETED_SEGMENT = struct.Struct("<Hhd")  # Sphero ID, angle, timing
+COUNT = struct.Struct("<H")
+TARGET = struct.Struct("<H")
+FEEDBACK = struct.Struct("<Hd")  # Sphero ID, completion time
+TELEMETRY_FRAME = struct.Struct("<Hd5i")  # Sphero ID, time, then x, y, vx, vy and heading in tenths
+TIMESTAMP = struct.Struct("<d")
+
+def _is_number(value):
+    return type(value) in (int, float)
+
+def _tenths(value):
+    """
+    Fixed-point value in tenths, or None if the value has more precision than that.
+    """
+    if not _is_number(value) or abs(value) >= 2 ** 31 / 10:
+        return None
+    scaled = round(value * 10)
+    return scaled if scaled / 10 == value else None
+
+class WireFormat:
+    def __init__(self, encoding="json"):
+        """
+        Encoder and decoder for the messages exchanged through the WebSocket server.
+
+        The "binary" encoding replaces the message type with a small tag and the Sphero IDs with their
+        index in the Sphero list, and packs movement commands, feedback and telemetry into fixed-layout
+        structs (as are swarm ticks made of single movement commands). Any other message is sent as JSON
+        inside the binary frame, and messages that cannot be framed at all (such as the connection messages)
+        fall back to plain JSON text.
+        Incoming messages are decoded in either encoding.
+
+        Args:
+            encoding: "json" or "binary", the encoding of outgoing messages.
+        """
+        self.encoding = encoding
+        self.set_ids([])
+
+    def set_ids(self, sphero_ids):
+        """
+        Intern the Sphero IDs. Every side derives the same table from the SpheroConnection list.
+
+        Args:
+            sphero_ids: Sphero IDs, in the order of the SpheroConnection list.
+        """
+        self.ids = RESERVED_IDS + [sphero_id for sphero_id in sphero_ids if sphero_id not in RESERVED_IDS]
+        self.index = {sphero_id: index for index, sphero_id in enumerate(self.ids)}
+
+    def encode(self, message):
+        """
+        Serialize a message in the configured encoding.
+
+        Args:
+            message: Dictionary with the "messageType", "message" and optional "id" and "clientType" keys.
+
+        Returns:
+            bytes for a binary frame, or str for JSON text.
+        """
+        if self.encoding == "binary":
+            frame = self._encode_binary(message)
+            if frame is not None:
+                return frame
+        return json.dumps(message)
+
+    def decode(self, data):
+        """
+        Parse a message received as JSON text or as a binary frame.
+
+        The "clientType" of a binary frame is implied by its message type.
+
+        Args:
+            data: str or bytes received from the WebSocket.
+
+        Returns:
+            Dictionary with the "clientType", "messageType", "message" and, if set, "id" keys.
+        """
+        if isinstance(data, str) or not data or data[0] != MAGIC:
+            return json.loads(data)
+
+        _, tag, id_index = HEADER.unpack_from(data)
+        message_type = MESSAGE_TYPES[tag & ~(JSON_PAYLOAD | EXECUTE_AT)]
+        payload = memoryview(data)[HEADER.size:]
+        if tag & JSON_PAYLOAD:
+            body = json.loads(bytes(payload))
+        elif tag & EXECUTE_AT:
+            body = self._unpack(message_type, payload[:-TIMESTAMP.size])
+            body["execute_at"] = TIMESTAMP.unpack(payload[-TIMESTAMP.size:])[0]
+        else:
+            body = self._unpack(message_type, payload)
+
+        message = {
+            "clientType": "SpheroBrain" if message_type.startswith("Brain") else "SpheroController",
+            "messageType": message_type,
+            "message": body,
+        }
+        if id_index != NO_ID:
+            message["id"] = self.ids[id_index]
+        return message
+
+    def _encode_binary(self, message):
+        """
+        Binary frame for a message, or None if it cannot be framed.
+        """
+        message_type = message.get("messageType")
+        if message_type not in TAGS or "message" not in message or not set(message) <= {"clientType", "id", "messageType", "message"}:
+            return None
+
+        id_index = NO_ID
+        if "id" in message:
+            id_index = self.index.get(message["id"])
+            if id_index is None:
+                return None
+
+        body = message["message"]
+        tag = TAGS[message_type]
+        if isinstance(body, dict) and _is_number(body.get("execute_at")):
+            # Scheduled commands keep their struct layout, with the timestamp appended
+            payload = self._pack(message_type, {key: value for key, value in body.items() if key != "execute_at"})
+            if payload is not None:
+                payload += TIMESTAMP.pack(body["execute_at"])
+                tag |= EXECUTE_AT
+        else:
+            payload = self._pack(message_type, body)
+        if payload is None:
+            payload = json.dumps(body, separators=(",", ":")).encode()
+            tag |= JSON_PAYLOAD
+        return HEADER.pack(MAGIC, tag, id_index) + payload
+
+    def _segment(self, segment, keys=("angle", "timing")):
+        if not isinstance(segment, dict) or set(segment) != set(keys):
+            return None
+        angle, timing = segment["angle"], segment["timing"]
+        if type(angle) is not int or not -32768 <= angle < 32768 or not _is_number(timing):
+            return None
+        return angle, timing
+
+    def _pack(self, message_type, body):
+        """
+        Fixed-layout struct for the body of a high-rate message, or None if it has another shape.
+        """
+        if message_type == "SpheroMovement":
+            segment = self._segment(body)
+            return SEGMENT.pack(*segment) if segment else None
+
+        if message_type == "BrainControl":
+            segment = self._segment(body, ("id", "angle", "timing"))
+            if segment is None or body["id"] not in self.index:
+                return None
+            return TARGETED_SEGMENT.pack(self.index[body["id"]], *segment)
+
+        if message_type in ("SpheroMovementSequence", "BrainControlSequence"):
+            keys = {"segments"} if message_type == "SpheroMovementSequence" else {"id", "segments"}
+            if not isinstance(body, dict) or set(body) != keys or not isinstance(body["segments"], list):
+                return None
+            segments = [self._segment(segment) for segment in body["segments"]]
+            if None in segments or len(segments) >= 2 ** 16:
+                return None
+            payload = COUNT.pack(len(segments)) + b"".join(SEGMENT.pack(*segment) for segment in segments)
+            if "id" in keys:
+                if body["id"] not in self.index:
+                    return None
+                payload = TARGET.pack(self.index[body["id"]]) + payload
+            return payload
+
+        if message_type in ("BrainTick", "SpheroTick"):
+            if not isinstance(body, dict) or set(body) != {"commands"} or not isinstance(body["commands"], list) \
+                    or len(body["commands"]) >= 2 ** 16:
+                return None
+            commands = []
+            for command in body["commands"]:
+                segment = self._segment(command, ("id", "angle", "timing"))
+                if segment is None or command["id"] not in self.index:
+                    return None  # Ticks with movement sequences are sent as JSON
+                commands.append(TARGETED_SEGMENT.pack(self.index[command["id"]], *segment))
+            return COUNT.pack(len(commands)) + b"".join(commands)
+
+        if message_type == "SpheroFeedback":
+            if not isinstance(body, dict) or set(body) != {"id", "completed_at"} or body["id"] not in self.index \
+                    or not _is_number(body["completed_at"]):
+                return None
+            return FEEDBACK.pack(self.index[body["id"]], body["completed_at"])
+
+        if message_type == "SpheroTelemetry":
+            if not isinstance(body, dict) or set(body) != {"fields", "frames"} or body["fields"] != TELEMETRY_FIELDS \
+                    or len(body["frames"]) >= 2 ** 16:
+                return None
+            frames = []
+            for frame in body["frames"]:
+                if len(frame) != len(TELEMETRY_FIELDS) or frame[0] not in self.index or not _is_number(frame[1]):
+                    return None
+                values = [_tenths(value) for value in frame[2:]]
+                if None in values:
+                    return None
+                frames.append(TELEMETRY_FRAME.pack(self.index[frame[0]], frame[1], *values))
+            return COUNT.pack(len(frames)) + b"".join(frames)
+
+        return None
+
+    def _unpack(self, message_type, payload):
+        """
+        Message body from a fixed-layout struct.
+        """
+        if message_type == "SpheroMovement":
+            angle, timing = SEGMENT.unpack(payload)
+            return {"angle": angle, "timing": timing}
+
+        if message_type == "BrainControl":
+            id_index, angle, timing = TARGETED_SEGMENT.unpack(payload)
+            return {"id": self.ids[id_index], "angle": angle, "timing": timing}
+
+        if message_type in ("SpheroMovementSequence", "BrainControlSequence"):
+            body = {}
+            if message_type == "BrainControlSequence":
+                body["id"] = self.ids[TARGET.unpack_from(payload)[0]]
+                payload = payload[TARGET.size:]
+            (count,) = COUNT.unpack_from(payload)
+            body["segments"] = [{"angle": angle, "timing": timing}
+                                for angle, timing in SEGMENT.iter_unpack(payload[COUNT.size:COUNT.size + count * SEGMENT.size])]
+            return body
+
+        if message_type in ("BrainTick", "SpheroTick"):
+            (count,) = COUNT.unpack_from(payload)
+            commands = TARGETED_SEGMENT.iter_unpack(payload[COUNT.size:COUNT.size + count * TARGETED_SEGMENT.size])
+            return {"commands": [{"id": self.ids[id_index], "angle": angle, "timing": timing}
+                                 for id_index, angle, timing in commands]}
+
+        if message_type == "SpheroFeedback":
+            id_index, completed_at = FEEDBACK.unpack(payload)
+            return {"id": self.ids[id_index], "completed_at": completed_at}
+
+        if message_type == "SpheroTelemetry":
+            (count,) = COUNT.unpack_from(payload)
+            frames = [[self.ids[id_index], t] + [value / 10 for value in values]
+                      for id_index, t, *values in TELEMETRY_FRAME.iter_unpack(payload[COUNT.size:COUNT.size + count * TELEMETRY_FRAME.size])]
+            return {"fields": TELEMETRY_FIELDS, "frames": frames}
+
+        raise ValueError(f"No struct layout for {message_type}")
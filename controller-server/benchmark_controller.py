@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+from websockets import connect
+import receiver
+from simulated_sphero import SimulatedBackend, simulated_sphero_list
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))  # Shared wire_format.py
+from wire_format import WireFormat
+
+def count_commands(backend):
+    """
+    Total number of commands received by the simulated Spheros so far.
+    """
+    return sum(droid.commands for droid in backend.droids)
+
+async def drive_robot(sphero_id, send_command, feedback, timing, deadline, latencies):
+    """
+    Send movement commands to one Sphero back-to-back and record the command-to-feedback latency.
+
+    Args:
+        sphero_id: Sphero ID.
+        send_command: Coroutine function taking (sphero_id, angle, timing) that sends one movement command.
+        feedback: asyncio.Queue receiving this Sphero's feedback messages.
+        timing: Roll duration of each command in seconds.
+        deadline: Monotonic time after which no new command is sent.
+        latencies: List the latencies in seconds are appended to.
+    """
+    angle = 0
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        await send_command(sphero_id, angle, timing)
+        await feedback.get()
+        latencies.append(time.monotonic() - start)
+        angle = (angle + 90) % 360
+
+async def drive_swarm(sphero_ids, send_tick, feedback, timing, deadline, latencies):
+    """
+    Send one swarm tick with a movement command for every Sphero, wait for all of them to complete, and repeat.
+
+    Args:
+        sphero_ids: IDs of the Spheros.
+        send_tick: Coroutine function taking a list of {id, angle, timing} commands that sends one tick.
+        feedback: Dictionary mapping each Sphero ID to the asyncio.Queue receiving its feedback messages.
+        timing: Roll duration of each command in seconds.
+        deadline: Monotonic time after which no new tick is sent.
+        latencies: List the per-Sphero command latencies in seconds are appended to.
+    """
+    angle = 0
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        await send_tick([{"id": sphero_id, "angle": angle, "timing": timing} for sphero_id in sphero_ids])
+
+        async def wait_for(sphero_id):
+            await feedback[sphero_id].get()
+            latencies.append(time.monotonic() - start)
+
+        await asyncio.gather(*(wait_for(sphero_id) for sphero_id in sphero_ids))
+        angle = (angle + 90) % 360
+
+async def benchmark_local(spheros, backend, max_ble, timing, duration, preempt=False):
+    """
+    Drive the simulated Spheros through the controller tasks directly, without the relay.
+
+    Returns:
+        Tuple (latencies, bring_up, commands) with the command latencies, the seconds until every Sphero was ready
+        and the number of BLE commands sent while driving.
+    """
+    loop = asyncio.get_running_loop()
+    ble_limit = threading.BoundedSemaphore(max_ble)
+    channels = {sphero["id"]: asyncio.Queue() for sphero in spheros}
+    feedback = {sphero["id"]: asyncio.Queue() for sphero in spheros}
+    outgoing_queue = queue.Queue()
+    ready = set()
+    all_ready = asyncio.Event()
+
+    def on_outgoing(message):
+        if message["messageType"] == "SpheroFeedback":
+            feedback[message["id"]].put_nowait(message)
+        elif message["messageType"] == "SpheroReady":
+            ready.add(message["id"])
+            if len(ready) == len(spheros):
+                all_ready.set()
+
+    receiver.start_queue_pump(outgoing_queue, loop, on_outgoing)
+
+    async def send_command(sphero_id, angle, timing):
+        channels[sphero_id].put_nowait({"id": sphero_id, "messageType": "SpheroMovement",
+                                        "message": {"angle": angle, "timing": timing}})
+
+    start = time.monotonic()
+    toys = await receiver.discover_spheros(spheros, backend)
+    tasks = [asyncio.create_task(receiver.run_sphero(sphero["id"], sphero["color"], channels[sphero["id"]],
+                                                     outgoing_queue, backend, ble_limit, toy=toys.get(sphero["id"]),
+                                                     preempt=preempt))
+             for sphero in spheros]
+    await all_ready.wait()
+    bring_up = time.monotonic() - start
+    commands = count_commands(backend)
+
+    latencies = []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(drive_robot(sphero["id"], send_command, feedback[sphero["id"]], timing, deadline, latencies)
+                           for sphero in spheros))
+
+    logging.disable(logging.WARNING)  # Cancelling the tasks below looks like lost connections
+    for task in tasks:
+        task.cancel()
+    return latencies, bring_up, count_commands(backend) - commands
+
+async def benchmark_relay(spheros, backend, max_ble, timing, duration, url, preempt=False, wire="json", tick=False):
+    """
+    Run the controller in-process and drive it through a running relay, acting as the Brain Server.
+    With tick, the commands for every Sphero are sent together as one BrainTick per round.
+
+    Returns:
+        Tuple (latencies, bring_up, commands) with the command latencies, the seconds until every Sphero was ready
+        and the number of BLE commands sent while driving.
+    """
+    controller = asyncio.create_task(receiver.run_controller(spheros, backend, max_ble, preempt, wire=wire))
+    wire_format = WireFormat(wire)
+    wire_format.set_ids([sphero["id"] for sphero in spheros])
+    feedback = {sphero["id"]: asyncio.Queue() for sphero in spheros}
+    all_ready = asyncio.Event()
+
+    start = time.monotonic()
+    async with connect(url) as ws:
+        await ws.send(json.dumps({"clientType": "SpheroBrain", "messageType": "BrainConnection", "encoding": wire}))
+
+        async def route_messages():
+            async for message in ws:
+                parsed_message = wire_format.decode(message)
+                if parsed_message["messageType"] == "SpheroFeedback":
+                    sphero_id = parsed_message["message"]["id"]
+                    feedback[sphero_id].put_nowait(parsed_message)
+                elif parsed_message["messageType"] == "SpheroReady":
+                    all_ready.set()
+
+        router = asyncio.create_task(route_messages())
+
+        async def send_command(sphero_id, angle, timing):
+            await ws.send(wire_format.encode({"clientType": "SpheroBrain", "id": sphero_id, "messageType": "BrainControl",
+                                              "message": {"id": sphero_id, "angle": angle, "timing": timing}}))
+
+        async def send_tick(commands):
+            await ws.send(wire_format.encode({"clientType": "SpheroBrain", "id": "SpheroBrain", "messageType": "BrainTick",
+                                              "message": {"commands": commands}}))
+
+        await all_ready.wait()
+        bring_up = time.monotonic() - start
+        commands = count_commands(backend)
+
+        latencies = []
+        deadline = time.monotonic() + duration
+        if tick:
+            await drive_swarm([sphero["id"] for sphero in spheros], send_tick, feedback, timing, deadline, latencies)
+        else:
+            await asyncio.gather(*(drive_robot(sphero["id"], send_command, feedback[sphero["id"]], timing, deadline, latencies)
+                                   for sphero in spheros))
+        router.cancel()
+
+    logging.disable(logging.WARNING)  # Cancelling the controller below looks like lost connections
+    controller.cancel()
+    return latencies, bring_up, count_commands(backend) - commands
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the controller against simulated Spheros.")
+    parser.add_argument("--robots", type=int, default=100, help="Number of simulated Spheros.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to keep sending commands.")
+    parser.add_argument("--timing", type=float, default=0.1, help="Roll duration of each command in seconds.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mean simulated command latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.005, help="Simulated command latency jitter in seconds.")
+    parser.add_argument("--max-ble", type=int, default=4, help="Maximum number of concurrent BLE operations.")
+    parser.add_argument("--preempt", action="store_true", help="Run the controller with preemptible movements.")
+    parser.add_argument("--relay", default=None,
+                        help="URL of a running relay (e.g. ws://localhost:8080) to measure the full loop through it.")
+    parser.add_argument("--wire", choices=["json", "binary"], default="json", help="Message encoding used with --relay.")
+    parser.add_argument("--tick", action="store_true",
+                        help="With --relay, send the commands for all Spheros as one BrainTick per round.")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)  # Per-message logging would dominate the measurement
+    spheros = simulated_sphero_list(args.robots)
+    backend = SimulatedBackend(args.latency, args.jitter, seed=0)
+
+    with contextlib.redirect_stdout(io.StringIO()):  # Silence the per-command prints
+        if args.relay:
+            latencies, bring_up, commands = asyncio.run(
+                benchmark_relay(spheros, backend, args.max_ble, args.timing, args.duration, args.relay, args.preempt,
+                                args.wire, args.tick))
+        else:
+            latencies, bring_up, commands = asyncio.run(
+                benchmark_local(spheros, backend, args.max_ble, args.timing, args.duration, args.preempt))
+
+    latencies = np.array(latencies) * 1000
+    print(f"{args.robots} robots, {'relay' if args.relay else 'local'}: bring-up {bring_up:.2f} s, "
+          f"{len(latencies) / args.duration:.1f} commands/s, "
+          f"loop latency mean {latencies.mean():.1f} ms (p50 {np.percentile(latencies, 50):.1f}, "
+          f"p95 {np.percentile(latencies, 95):.1f}, p99 {np.percentile(latencies, 99):.1f}), "
+          f"roll time {args.timing * 1000:.0f} ms, {commands / max(len(latencies), 1):.2f} BLE commands per move")
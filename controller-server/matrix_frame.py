@@ -0,0 +1,112 @@
+from collections import Counter
+
+SIZE = 8  # The Sphero BOLT LED matrix is 8x8
+OFF = (0, 0, 0)  # Color key of an unlit pixel
+PIXELS = [(x, y) for y in range(SIZE) for x in range(SIZE)]
+
+def frame_to_keys(frame, color_key):
+    """
+    Convert an 8x8 frame into a dictionary of pixel color keys.
+
+    Args:
+        frame: 8 rows of 8 colors, indexed as frame[y][x]. None marks an unlit pixel.
+        color_key: Function converting a color into a comparable key.
+
+    Returns:
+        Dictionary mapping every (x, y) pixel to its color key.
+    """
+    if len(frame) != SIZE or any(len(row) != SIZE for row in frame):
+        raise ValueError("Matrix frames must be 8x8")
+    return {(x, y): OFF if frame[y][x] is None else color_key(frame[y][x]) for x, y in PIXELS}
+
+def plan_matrix_commands(current, target):
+    """
+    Find a short list of matrix commands that turns the current LED state into the target frame.
+
+    Args:
+        current: Dictionary mapping lit (x, y) pixels to color keys, or None if the state is unknown.
+        target: Dictionary mapping every (x, y) pixel to its color key.
+
+    Returns:
+        List of commands, each one of ("clear",), ("fill", x1, y1, x2, y2, key),
+        ("line", x1, y1, x2, y2, key) or ("pixel", x, y, key).
+    """
+    plans = []
+    if current is not None:
+        # Draw only what changed
+        plans.append(_cover({pixel: current.get(pixel, OFF) for pixel in PIXELS}, target, []))
+
+    # Clear the matrix, or fill it with the most common color, first and then draw the rest
+    plans.append(_cover({pixel: OFF for pixel in PIXELS}, target, [("clear",)]))
+    base = Counter(target.values()).most_common(1)[0][0]
+    if base != OFF:
+        plans.append(_cover({pixel: base for pixel in PIXELS}, target, [("fill", 0, 0, SIZE - 1, SIZE - 1, base)]))
+
+    return min(plans, key=len)
+
+def _cover(state, target, commands):
+    """
+    Greedily add the command that fixes the most wrong pixels until the state matches the target.
+
+    Args:
+        state: Dictionary mapping every (x, y) pixel to its color key after the commands so far.
+        target: Dictionary mapping every (x, y) pixel to its target color key.
+        commands: Commands issued so far.
+
+    Returns:
+        The completed list of commands.
+    """
+    while True:
+        pending = {pixel for pixel in PIXELS if state[pixel] != target[pixel]}
+        if not pending:
+            return commands
+
+        best, best_pixels, best_count = None, None, 0
+        for anchor in pending:
+            for command, pixels in _shapes(anchor, target):
+                count = sum(1 for pixel in pixels if pixel in pending)
+                if count > best_count:
+                    best, best_pixels, best_count = command, pixels, count
+
+        commands.append(best)
+        for pixel in best_pixels:
+            state[pixel] = target[pixel]
+
+def _shapes(anchor, target):
+    """
+    Yield the pixels, lines and rectangles starting at an anchor that only cover pixels of the anchor's target color.
+
+    Args:
+        anchor: (x, y) pixel the shapes start from.
+        target: Dictionary mapping every (x, y) pixel to its target color key.
+
+    Yields:
+        Tuples (command, pixels) with the command drawing the shape and the pixels it covers.
+    """
+    x, y = anchor
+    key = target[anchor]
+    yield ("pixel", x, y, key), [anchor]
+
+    # Lines to the right, down, and along both diagonals
+    for step_x, step_y in ((1, 0), (0, 1), (1, 1), (-1, 1)):
+        pixels = [anchor]
+        while True:
+            next_x, next_y = x + step_x * len(pixels), y + step_y * len(pixels)
+            if not (0 <= next_x < SIZE and 0 <= next_y < SIZE) or target[(next_x, next_y)] != key:
+                break
+            pixels.append((next_x, next_y))
+        if len(pixels) > 1:
+            end_x, end_y = pixels[-1]
+            yield ("line", x, y, end_x, end_y, key), pixels
+
+    # Rectangles with the anchor as their top-left corner
+    width = 1
+    while x + width < SIZE and target[(x + width, y)] == key:
+        width += 1
+    for rectangle_width in range(2, width + 1):
+        height = 1
+        while y + height < SIZE and all(target[(x + i, y + height)] == key for i in range(rectangle_width)):
+            height += 1
+        if height > 1:
+            pixels = [(x + i, y + j) for j in range(height) for i in range(rectangle_width)]
+            yield ("fill", x, y, x + rectangle_width - 1, y + height - 1, key), pixels
@@ -1,14 +1,24 @@
+import argparse
 import asyncio
+import collections
 import json
 import multiprocessing
+import os
+import queue
+import socket
+import sys
+import threading
 from websockets import connect
 from spherov2 import scanner
-from sphero_subclass import MySpheroEduAPI
+from sphero_session import BleBackend, SpheroSession, run_limited
+from simulated_sphero import SimulatedBackend, simulated_sphero_list
 from spherov2.types import Color
 from PIL import ImageColor
 import time
 import logging
 from sphero_movement import SpheroMovement  # Import the movement class
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))  # Shared wire_format.py
+from wire_format import WireFormat
 from spheros import sphero_list
 
 # Set up logging
@@ -21,63 +31,180 @@ logging.basicConfig(
     ]
 )
 
-# This function handles incoming messages from the WebSocket server
-async def websocket_receiver(message_bus, spheros):
+# Forward items from a blocking queue to the event loop
+def start_queue_pump(source, loop, callback):
+    """
+    Block on a thread- or process-safe queue in a daemon thread and hand each item to the event loop.
+
+    Args:
+        source: Queue with a blocking get (queue.Queue or multiprocessing.Queue).
+        loop: Event loop to deliver items on.
+        callback: Function called on the event loop with each item.
+    """
+    def pump():
+        while True:
+            item = source.get()
+            loop.call_soon_threadsafe(callback, item)
+
+    threading.Thread(target=pump, daemon=True).start()
+
+# This function keeps a single full-duplex connection to the WebSocket server alive
+async def websocket_connection(channels, outgoing_queue, spheros, wire="json"):
     """
-    Connect to the WebSocket server and listen for incoming messages.
+    Connect to the WebSocket server, then receive commands and send outgoing messages over the same socket.
+    Reconnects with exponential backoff whenever the connection drops.
 
     Args:
-        message_bus: Dictionary for storing messages for each Sphero.
+        channels: Dictionary mapping each Sphero ID to its command queue.
+        outgoing_queue: Queue of messages to send.
         spheros: List of Sphero devices with their IDs and colors.
+        wire: Message encoding, "json" or "binary" (negotiated with the server in the connection message).
     """
-    try:
-        async with connect("ws://localhost:8080") as ws:
-            logging.info("WebSocket: Connected to the server.")
-            await ws.send(json.dumps({"clientType": "SpheroController", "messageType": "SpheroConnection", "spheros": spheros}))
-            logging.info("WebSocket: Sent connection initialization.")
+    loop = asyncio.get_running_loop()
+    wire_format = WireFormat(wire)
+    wire_format.set_ids([sphero["id"] for sphero in spheros])
+    pending = collections.deque()  # Messages waiting to be sent, kept across reconnects
+    wakeup = asyncio.Event()  # Set whenever a new outgoing message is pending
+    ready_ids = set()  # Spheros that already reported ready, re-announced after a reconnect
 
-            while True:
-                try:
-                    message = await ws.recv()
-                    logging.info(f"WebSocket: Received message: {message}")
-                    parsed_message = json.loads(message)
-                    target_id = parsed_message["id"]
+    def _queue_outgoing(message):
+        pending.append(message)
+        wakeup.set()
 
-                    if target_id in message_bus:
-                        message_bus[target_id].append(message)
-                except Exception as e:
-                    logging.error(f"WebSocket: Error receiving message: {e}")
-                    break
-    except Exception as e:
-        logging.error(f"WebSocket: Connection error: {e}")
-    finally:
-        logging.warning("WebSocket: Closing connection.")
+    start_queue_pump(outgoing_queue, loop, _queue_outgoing)
+
+    backoff = 0.5
+    while True:
+        try:
+            async with connect("ws://localhost:8080") as ws:
+                logging.info("WebSocket: Connected to the server.")
+                await ws.send(json.dumps({"clientType": "SpheroController", "messageType": "SpheroConnection", "spheros": spheros,
+                                          "encoding": wire}))
+                logging.info("WebSocket: Sent connection initialization.")
+                for sphero_id in ready_ids:
+                    await ws.send(wire_format.encode({"clientType": "SpheroController", "id": sphero_id, "messageType": "SpheroReady", "message": "Ready"}))
+                backoff = 0.5
+
+                tasks = {
+                    asyncio.create_task(websocket_receiver(ws, channels, wire_format)),
+                    asyncio.create_task(websocket_sender(ws, pending, wakeup, ready_ids, wire_format)),
+                }
+                done, unfinished = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in unfinished:
+                    task.cancel()
+                for task in done:
+                    task.result()  # Surface the error that ended the connection
+        except Exception as e:
+            logging.error(f"WebSocket: Connection error: {e}")
+
+        logging.warning(f"WebSocket: Connection closed. Reconnecting in {backoff:.1f}s...")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 10)
+
+# This function handles incoming messages from the WebSocket server
+async def websocket_receiver(ws, channels, wire_format):
+    """
+    Listen for incoming messages and route them to the Sphero command channels.
+
+    Args:
+        ws: Open WebSocket connection.
+        channels: Dictionary mapping each Sphero ID to its command queue.
+        wire_format: WireFormat decoding JSON and binary messages.
+    """
+    while True:
+        message = await ws.recv()
+        received_at = time.time()
+        try:
+            parsed_message = wire_format.decode(message)
+            logging.info(f"WebSocket: Received message: {parsed_message}")
+            target_id = parsed_message["id"]
+
+            if parsed_message["messageType"] == "SpheroClockPing":
+                # Answer clock sync pings right away, with the receive and reply times on this machine's clock
+                ping = parsed_message["message"]
+                await ws.send(wire_format.encode({
+                    "clientType": "SpheroController",
+                    "id": "SpheroController",
+                    "messageType": "SpheroClockPong",
+                    "message": {"t0": ping["t0"], "t1": received_at, "t2": time.time(), "host": socket.gethostname()},
+                }))
+
+            # Route the command straight to the Sphero's channel, waking its subscriber
+            elif parsed_message["messageType"] == "SpheroTick":
+                # Demultiplex a swarm tick, waking every subscriber in the same loop iteration so the moves start together
+                tick = parsed_message["message"]
+                for command in tick["commands"]:
+                    stamp(command, "controller_in", received_at)
+                    if command["id"] in channels:
+                        channels[command["id"]].put_nowait(tick_command(command, tick.get("execute_at")))
+            elif target_id == "*":
+                # Broadcast to every Sphero, which all run it concurrently
+                for channel in channels.values():
+                    channel.put_nowait(parsed_message)
+            elif target_id in channels:
+                stamp(parsed_message["message"], "controller_in", received_at)
+                channels[target_id].put_nowait(parsed_message)
+        except Exception as e:
+            logging.error(f"WebSocket: Error receiving message: {e}")
+
+def stamp(message, key, timestamp=None):
+    """
+    Add a timestamp to the end-to-end trace of a command or feedback, if it carries one.
+
+    Args:
+        message: Message content, with a "trace" dictionary when the Brain Server traces commands.
+        key: Name of the hop (e.g., "controller_in").
+        timestamp: Time on this machine's clock, or None for now.
+    """
+    if isinstance(message, dict) and isinstance(message.get("trace"), dict):
+        message["trace"][key] = time.time() if timestamp is None else timestamp
+
+# Commands carried by a swarm tick, which the relay would otherwise send as separate messages
+def tick_command(command, execute_at=None):
+    """
+    Turn one command of a SpheroTick into the movement message the Sphero's subscriber expects.
+
+    Args:
+        command: Dictionary with the Sphero "id" and either "angle" and "timing", or "segments".
+        execute_at: Scheduled start time of the tick, or None.
+
+    Returns:
+        SpheroMovement or SpheroMovementSequence message for the Sphero.
+    """
+    if "segments" in command:
+        message = {"id": command["id"], "messageType": "SpheroMovementSequence", "message": {"segments": command["segments"]}}
+    else:
+        message = {"id": command["id"], "messageType": "SpheroMovement", "message": {"angle": command["angle"], "timing": command["timing"]}}
+    if execute_at is not None:
+        message["message"]["execute_at"] = execute_at
+    if "trace" in command:
+        message["message"]["trace"] = command["trace"]
+    return message
 
 # This function handles sending messages from the outgoing queue back to the WebSocket server
-async def websocket_sender(outgoing_queue):
+async def websocket_sender(ws, pending, wakeup, ready_ids, wire_format):
     """
-    Continuously send messages from the outgoing queue to the WebSocket server.
+    Send pending outgoing messages as soon as they are queued.
 
     Args:
-        outgoing_queue: Queue of messages to send.
+        ws: Open WebSocket connection.
+        pending: Deque of messages waiting to be sent.
+        wakeup: Event set whenever a message is queued.
+        ready_ids: Set of Sphero IDs that have reported ready.
+        wire_format: WireFormat encoding the outgoing messages.
     """
-    try:
-        async with connect("ws://localhost:8080") as ws:
-            logging.info("WebSocket Sender: Connected to the server.")
-            while True:
-                try:
-                    while not outgoing_queue.empty():
-                        message = outgoing_queue.get_nowait()
-                        await ws.send(json.dumps(message))
-                        logging.info(f"WebSocket Sender: Sent message: {message}")
-                except Exception as e:
-                    logging.error(f"WebSocket Sender: Error sending message: {e}")
-                    break
-                await asyncio.sleep(0.1)
-    except Exception as e:
-        logging.error(f"WebSocket Sender: Connection error: {e}")
-    finally:
-        logging.warning("WebSocket Sender: Closing connection.")
+    while True:
+        while pending:
+            message = pending[0]
+            if message.get("messageType") == "SpheroFeedback":
+                stamp(message["message"], "feedback_send")
+            await ws.send(wire_format.encode(message))
+            pending.popleft()  # Only drop the message once it is on the wire
+            if message.get("messageType") == "SpheroReady":
+                ready_ids.add(message["id"])
+            logging.info(f"WebSocket Sender: Sent message: {message}")
+        wakeup.clear()
+        await wakeup.wait()
 
 # Add a message to the outgoing queue
 def send_message_to_server(outgoing_queue, id, messageType, message):
@@ -101,32 +228,129 @@ def send_message_to_server(outgoing_queue, id, messageType, message):
     except Exception as e:
         logging.error(f"Error adding message to outgoing queue: {e}")
 
+# Commands that move the Sphero, which a newer movement command can preempt
+MOVEMENT_TYPES = {"SpheroMovement", "SpheroMovementSequence", "MoveNorth", "MoveSouth", "MoveWest", "MoveEast"}
+
+def rolls_immediately(message_type, message):
+    """
+    Check whether a movement command starts rolling right away, rather than after an execute_at wait.
+    """
+    if message_type == "SpheroMovement":
+        return message.get("execute_at") is None
+    if message_type == "SpheroMovementSequence":
+        return message.get("execute_at") is None and bool(message.get("segments"))
+    return False
+
 # This function processes incoming messages for a specific Sphero
-def process_subscriber(sphero_id, sphero_color, message_bus, outgoing_queue, sphero):
+async def process_subscriber(sphero_id, sphero_color, channel, outgoing_queue, sphero, preempt=False):
     """
-    Process messages from the message bus for a specific Sphero.
+    Process messages from the command channel of a specific Sphero.
 
     Args:
         sphero_id: Sphero ID.
         sphero_color: Color of the Sphero.
-        message_bus: Dictionary containing message lists for each Sphero.
+        channel: asyncio.Queue of parsed commands for this Sphero.
         outgoing_queue: Queue for sending outgoing messages.
         sphero: SpheroMovement instance for controlling the Sphero.
+        preempt: Whether a newer movement command interrupts the current one and supersedes queued ones.
     """
-    logging.info(f"{sphero_id}: Subscribed to message bus.")
+    logging.info(f"{sphero_id}: Subscribed to command channel.")
+    if preempt:
+        await process_subscriber_preemptive(sphero_id, sphero_color, channel, outgoing_queue, sphero)
+        return
+
     while True:
         try:
-            if message_bus[sphero_id]:
-                parsed_message = json.loads(message_bus[sphero_id].pop(0))
-                message_type = parsed_message["messageType"]
-                message_content = parsed_message["message"]
-                print(f"Message received: {parsed_message}")
-                handle_message(sphero_id, sphero_color, message_type, message_content, outgoing_queue, sphero)
+            parsed_message = await channel.get()  # Waits until a command arrives
+            message_type = parsed_message["messageType"]
+            message_content = parsed_message["message"]
+            print(f"Message received: {parsed_message}")
+            await handle_message(sphero_id, sphero_color, message_type, message_content, outgoing_queue, sphero)
         except Exception as e:
             logging.error(f"{sphero_id}: Error in subscriber: {e}")
 
+# This function processes incoming messages, letting the latest movement command win
+async def process_subscriber_preemptive(sphero_id, sphero_color, channel, outgoing_queue, sphero):
+    """
+    Process messages so that a newer movement command preempts the one in progress
+    and supersedes any older ones still queued. Other commands run in order.
+
+    Args:
+        sphero_id: Sphero ID.
+        sphero_color: Color of the Sphero.
+        channel: asyncio.Queue of parsed commands for this Sphero.
+        outgoing_queue: Queue for sending outgoing messages.
+        sphero: SpheroMovement instance for controlling the Sphero.
+    """
+    running = None  # Task of the movement in progress
+    next_command = asyncio.create_task(channel.get())
+    try:
+        while True:
+            waiting = {next_command} if running is None else {next_command, running}
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if running in done:
+                running = None
+            if next_command not in done:
+                continue
+
+            commands = coalesce_commands(next_command.result(), channel, sphero)
+            next_command = asyncio.create_task(channel.get())
+
+            for parsed_message in commands:
+                try:
+                    message_type = parsed_message["messageType"]
+                    message_content = parsed_message["message"]
+                    print(f"Message received: {parsed_message}")
+
+                    if message_type not in MOVEMENT_TYPES:
+                        await handle_message(sphero_id, sphero_color, message_type, message_content, outgoing_queue, sphero)
+                        continue
+
+                    if running is not None:
+                        if rolls_immediately(message_type, message_content):
+                            sphero.session.hand_over()  # The new movement takes over without stopping first
+                        running.cancel()  # Otherwise the cancelled roll stops the Sphero
+                        await asyncio.wait({running})
+                        running = None
+                        sphero.report_dropped("preempted")
+                        logging.info(f"{sphero_id}: Movement preempted by {message_type}.")
+
+                    running = asyncio.create_task(
+                        handle_message(sphero_id, sphero_color, message_type, message_content, outgoing_queue, sphero))
+                except Exception as e:
+                    logging.error(f"{sphero_id}: Error in subscriber: {e}")
+    finally:
+        next_command.cancel()
+        if running is not None:
+            running.cancel()
+
+def coalesce_commands(first, channel, sphero):
+    """
+    Drain the commands already queued behind the first one and keep only the latest movement command.
+
+    Args:
+        first: Parsed command that was just received.
+        channel: asyncio.Queue of parsed commands for this Sphero.
+        sphero: SpheroMovement instance, used to report superseded commands.
+
+    Returns:
+        List of commands to run in order, with at most one movement command.
+    """
+    commands = [first]
+    while not channel.empty():
+        commands.append(channel.get_nowait())
+
+    movements = [command for command in commands if command.get("messageType") in MOVEMENT_TYPES]
+    for _ in movements[:-1]:
+        sphero.report_dropped("superseded")
+    if len(movements) > 1:
+        logging.info(f"{sphero.sphero_id}: Dropped {len(movements) - 1} superseded movement command(s).")
+
+    latest = movements[-1] if movements else None
+    return [command for command in commands if command.get("messageType") not in MOVEMENT_TYPES or command is latest]
+
 # This function handles specific messages for the Sphero
-def handle_message(id, sphero_color, message_type, message, outgoing_queue, sphero):
+async def handle_message(id, sphero_color, message_type, message, outgoing_queue, sphero):
     """
     Handle specific commands for the Sphero.
 
@@ -139,135 +363,310 @@ def handle_message(id, sphero_color, message_type, message, outgoing_queue, sphe
         sphero: SpheroMovement instance for controlling the Sphero.
     """
     if message_type == "SpheroMovement":
+        stamp(message, "dequeued")
         angle = message["angle"]
         timing = message["timing"]
-        sphero.move(angle, timing)
+        await sphero.move(angle, timing, message.get("execute_at"), message.get("trace"))
+
+    elif message_type == "SpheroMovementSequence":
+        stamp(message, "dequeued")
+        await sphero.move_sequence(message["segments"], message.get("execute_at"), message.get("trace"))
 
     elif message_type == "MoveNorth":
-        sphero.move_direction("north", message)
+        await sphero.move_direction("north", message)
 
     elif message_type == "MoveSouth":
-        sphero.move_direction("south", message)
+        await sphero.move_direction("south", message)
 
     elif message_type == "MoveWest":
-        sphero.move_direction("west", message)
+        await sphero.move_direction("west", message)
 
     elif message_type == "MoveEast":
-        sphero.move_direction("east", message)
+        await sphero.move_direction("east", message)
 
     elif message_type == "SpheroMatrix":
-        sphero.set_matrix(message)
+        await sphero.set_matrix(message)
+
+    elif message_type == "SpheroMatrixFrame":
+        await sphero.set_matrix_frame(message)
 
     else:
         logging.warning(f"Sphero {id}: Unhandled message type: {message_type}")
 
 # This function runs the Sphero connection and processes messages
-def run_sphero(sphero_id, sphero_color, message_bus, outgoing_queue):
+async def run_sphero(sphero_id, sphero_color, channel, outgoing_queue, backend, ble_limit, toy=None, on_ready=None,
+                     preempt=False, telemetry=None, telemetry_rate=0):
     """
     Initialize and manage the connection to a specific Sphero.
 
     Args:
         sphero_id: Sphero ID.
         sphero_color: Color of the Sphero.
-        message_bus: Dictionary containing message lists for each Sphero.
+        channel: asyncio.Queue of parsed commands for this Sphero.
         outgoing_queue: Queue for sending outgoing messages.
-        first_run: Boolean indicating if this is the first connection attempt.
+        backend: Backend used to find and open the Sphero (e.g. BleBackend).
+        ble_limit: threading.BoundedSemaphore bounding concurrent BLE operations.
+        toy: Toy found by a shared discovery scan, if any. Otherwise the Sphero is scanned for on its own.
+        on_ready: Optional callback taking the Sphero ID, called each time the Sphero becomes ready.
+        preempt: Whether a newer movement command interrupts the current one.
+        telemetry: Dictionary of connected sessions sampled by stream_telemetry, if telemetry is enabled.
+        telemetry_rate: Samples per second, used to set the Sphero's sensor streaming interval.
     """
     logging.info(f"{sphero_id}: Attempting to connect.")
     rgb = ImageColor.getrgb(sphero_color)
     sphero_color = Color(r=rgb[0], g=rgb[1], b=rgb[2])
 
     while True:  # Retry loop
-        toy = None
-
         # Attempt to find and connect to the Sphero
         while toy is None:
             try:
-                toy = scanner.find_toy(toy_name=sphero_id)
+                toy = await asyncio.to_thread(run_limited, ble_limit, backend.find_toy, sphero_id)
                 logging.info(f"{sphero_id}: Connected to Sphero.")
             except scanner.ToyNotFoundError:
                 logging.warning(f"{sphero_id}: Sphero not found. Ensure it is powered on and in range. Retrying...")
-                time.sleep(4)
+                await asyncio.sleep(4)
             except Exception as e:
                 logging.error(f"{sphero_id}: Unexpected error: {e}")
-                time.sleep(4)
+                await asyncio.sleep(4)
 
         try:
-            with MySpheroEduAPI(toy) as droid:
+            async with SpheroSession(backend.create_api(toy), sphero_id, ble_limit) as session:
                 logging.info(f"{sphero_id}: Calibrating compass.")
-                droid.calibrate_compass()
-                droid.set_compass_direction(0)
-                droid.set_main_led(sphero_color)
-                time.sleep(1)
+                await session.calibrate_compass()
+                await session.set_compass_direction(0)
+                await session.set_main_led(sphero_color)
+                if telemetry is not None:
+                    await session.set_sensor_interval(max(1, int(1000 / telemetry_rate)))
+                await asyncio.sleep(1)
                 send_message_to_server(outgoing_queue, sphero_id, "SpheroReady", "Ready")
                 logging.info(f"{sphero_id}: Initialization complete.")
-                sphero = SpheroMovement(droid, sphero_id, sphero_color, outgoing_queue)
-                process_subscriber(sphero_id, sphero_color, message_bus, outgoing_queue, sphero)
+                if on_ready is not None:
+                    on_ready(sphero_id)
+                sphero = SpheroMovement(session, sphero_id, sphero_color, outgoing_queue)
+                if telemetry is not None:
+                    telemetry[sphero_id] = session
+                try:
+                    await process_subscriber(sphero_id, sphero_color, channel, outgoing_queue, sphero, preempt)
+                finally:
+                    if telemetry is not None:
+                        telemetry.pop(sphero_id, None)
 
         except Exception as e:
             logging.error(f"{sphero_id}: Failed to initialize or maintain connection to Sphero: {e}")
 
         finally:
-            # Clean up and prepare for retry
+            # Clean up and prepare for retry, scanning for the Sphero again
+            toy = None
             logging.warning(f"{sphero_id}: Sphero connection closed. Retrying...")
-            time.sleep(5)  # Retry delay before attempting to reconnect
+            await asyncio.sleep(5)  # Retry delay before attempting to reconnect
+
+# Fields of each frame in a SpheroTelemetry batch
+TELEMETRY_FIELDS = ["id", "t", "x", "y", "vx", "vy", "heading"]
 
-# WebSocket processes
-def run_websocket(message_bus, spheros):
+# This function streams onboard sensor telemetry of every connected Sphero to the brain
+async def stream_telemetry(sessions, outgoing_queue, rate, batch_interval):
+    """
+    Sample the streamed sensor values of every connected Sphero and send them in timestamped batches.
+
+    Args:
+        sessions: Dictionary mapping each connected Sphero ID to its SpheroSession.
+        outgoing_queue: Queue for sending outgoing messages.
+        rate: Samples per second for each Sphero.
+        batch_interval: Seconds between SpheroTelemetry messages.
     """
-    Start the WebSocket receiver process.
+    frames = []
+    next_flush = time.monotonic() + batch_interval
+    while True:
+        now = time.time()
+        for sphero_id, session in list(sessions.items()):
+            try:
+                sample = session.read_telemetry()
+                if sample is not None:
+                    frames.append([sphero_id, round(now, 3)] + [round(value, 1) for value in sample])
+            except Exception as e:
+                logging.error(f"{sphero_id}: Error reading telemetry: {e}")
+
+        if time.monotonic() >= next_flush:
+            if frames:
+                send_message_to_server(outgoing_queue, "SpheroController", "SpheroTelemetry",
+                                       {"fields": TELEMETRY_FIELDS, "frames": frames})
+                frames = []
+            next_flush += batch_interval
+        await asyncio.sleep(1 / rate)
+
+# Discover all Spheros with a single scan
+async def discover_spheros(spheros, backend, timeout=5.0):
+    """
+    Scan once for every Sphero instead of scanning for each one separately.
 
     Args:
-        message_bus: Dictionary for storing messages for each Sphero.
         spheros: List of Sphero devices with their IDs and colors.
+        backend: Backend used to find the Spheros.
+        timeout: Scan duration in seconds.
+
+    Returns:
+        Dictionary mapping each found Sphero ID to its toy. Spheros that were not found are left out.
     """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    sphero_ids = [sphero["id"] for sphero in spheros]
+    started_at = time.monotonic()
     try:
-        loop.run_until_complete(websocket_receiver(message_bus, spheros))
-    finally:
-        loop.close()
+        toys = await asyncio.to_thread(backend.find_toys, sphero_ids, timeout)
+    except Exception as e:
+        logging.error(f"Main: Discovery scan failed: {e}")
+        toys = {}
 
-def run_websocket_sender(outgoing_queue):
+    missing = [sphero_id for sphero_id in sphero_ids if sphero_id not in toys]
+    logging.info(f"Main: Found {len(toys)}/{len(sphero_ids)} Spheros in {time.monotonic() - started_at:.2f}s.")
+    if missing:
+        logging.warning(f"Main: Not found in the discovery scan, scanning individually: {', '.join(missing)}")
+    return toys
+
+# Single-process controller driving every Sphero from one event loop
+async def run_controller(spheros, backend, max_ble, preempt=False, telemetry_rate=0, telemetry_batch=0.2, wire="json"):
     """
-    Start the WebSocket sender process.
+    Run the WebSocket connection and one task per Sphero in the current process.
 
     Args:
+        spheros: List of Sphero devices with their IDs and colors.
+        backend: Backend used to find and open the Spheros.
+        max_ble: Maximum number of concurrent BLE operations.
+        preempt: Whether a newer movement command interrupts the current one.
+        telemetry_rate: Telemetry samples per second for each Sphero, or 0 to disable telemetry.
+        telemetry_batch: Seconds between SpheroTelemetry messages.
+        wire: Message encoding, "json" or "binary".
+    """
+    ble_limit = threading.BoundedSemaphore(max_ble)
+    channels = {sphero["id"]: asyncio.Queue() for sphero in spheros}  # One command channel per Sphero
+    outgoing_queue = queue.Queue()  # Robot tasks put feedback here directly
+
+    # One shared discovery scan, then every Sphero connects and calibrates concurrently
+    started_at = time.monotonic()
+    toys = await discover_spheros(spheros, backend)
+    ready_times = {}
+
+    def on_ready(sphero_id):
+        if sphero_id in ready_times:
+            return  # Only report the initial bring-up, not reconnects
+        ready_times[sphero_id] = time.monotonic() - started_at
+        logging.info(f"{sphero_id}: Ready after {ready_times[sphero_id]:.2f}s.")
+        if len(ready_times) == len(spheros):
+            slowest = max(ready_times, key=ready_times.get)
+            logging.info(f"Main: All {len(spheros)} Spheros ready after {ready_times[slowest]:.2f}s (slowest: {slowest}).")
+
+    tasks = [websocket_connection(channels, outgoing_queue, spheros, wire)]
+    telemetry = None
+    if telemetry_rate > 0:
+        telemetry = {}
+        tasks.append(stream_telemetry(telemetry, outgoing_queue, telemetry_rate, telemetry_batch))
+    for sphero in spheros:
+        tasks.append(run_sphero(sphero["id"], sphero["color"], channels[sphero["id"]], outgoing_queue, backend, ble_limit,
+                                toy=toys.get(sphero["id"]), on_ready=on_ready, preempt=preempt,
+                                telemetry=telemetry, telemetry_rate=telemetry_rate))
+
+    logging.info(f"Main: Driving {len(spheros)} Spheros from a single process.")
+    await asyncio.gather(*tasks)
+
+# Sphero process, used by the multiprocessing mode
+def run_sphero_process(sphero_id, sphero_color, channel, outgoing_queue, backend, max_ble, preempt=False,
+                       telemetry_rate=0, telemetry_batch=0.2):
+    """
+    Run a single Sphero in its own process, feeding it from a cross-process command queue.
+
+    Args:
+        sphero_id: Sphero ID.
+        sphero_color: Color of the Sphero.
+        channel: multiprocessing.Queue of parsed commands for this Sphero.
+        outgoing_queue: Queue for sending outgoing messages.
+        backend: Backend used to find and open the Sphero.
+        max_ble: Maximum number of concurrent BLE operations.
+        preempt: Whether a newer movement command interrupts the current one.
+        telemetry_rate: Telemetry samples per second, or 0 to disable telemetry.
+        telemetry_batch: Seconds between SpheroTelemetry messages.
+    """
+    async def worker():
+        commands = asyncio.Queue()
+        start_queue_pump(channel, asyncio.get_running_loop(), commands.put_nowait)
+        tasks = []
+        telemetry = None
+        if telemetry_rate > 0:
+            telemetry = {}
+            tasks.append(stream_telemetry(telemetry, outgoing_queue, telemetry_rate, telemetry_batch))
+        tasks.append(run_sphero(sphero_id, sphero_color, commands, outgoing_queue, backend, threading.BoundedSemaphore(max_ble),
+                                preempt=preempt, telemetry=telemetry, telemetry_rate=telemetry_rate))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(worker())
+
+# WebSocket process
+def run_websocket(channels, outgoing_queue, spheros, wire="json"):
+    """
+    Start the WebSocket connection process.
+
+    Args:
+        channels: Dictionary mapping each Sphero ID to its command queue.
         outgoing_queue: Queue of messages to send.
+        spheros: List of Sphero devices with their IDs and colors.
+        wire: Message encoding, "json" or "binary".
     """
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     try:
-        loop.run_until_complete(websocket_sender(outgoing_queue))
+        loop.run_until_complete(websocket_connection(channels, outgoing_queue, spheros, wire))
     finally:
         loop.close()
 
 if __name__ == "__main__":
-    multiprocessing.set_start_method("spawn")
-
-    with multiprocessing.Manager() as manager:
-        spheros = sphero_list
-        message_bus = manager.dict({sphero["id"]: manager.list() for sphero in spheros})
-        outgoing_queue = manager.Queue()
+    parser = argparse.ArgumentParser(description="Sphero swarm controller server.")
+    parser.add_argument("--mode", choices=["async", "process"], default="async",
+                        help="Drive all Spheros from one event loop, or run one process per Sphero.")
+    parser.add_argument("--max-ble", type=int, default=4,
+                        help="Maximum number of concurrent BLE operations.")
+    parser.add_argument("--preempt", action="store_true",
+                        help="Let a newer movement command interrupt the current roll and supersede queued ones.")
+    parser.add_argument("--telemetry-rate", type=float, default=0,
+                        help="Onboard telemetry samples per second for each Sphero (0 disables telemetry).")
+    parser.add_argument("--telemetry-batch", type=float, default=0.2,
+                        help="Seconds between batched SpheroTelemetry messages.")
+    parser.add_argument("--wire", choices=["json", "binary"], default="json",
+                        help="Message encoding: readable JSON, or compact binary frames with JSON kept for other messages.")
+    parser.add_argument("--backend", choices=["ble", "sim"], default="ble",
+                        help="Drive real Spheros over BLE, or simulated Spheros.")
+    parser.add_argument("--sim-count", type=int, default=None,
+                        help="Number of virtual Spheros for the sim backend (defaults to the Spheros in spheros.py).")
+    parser.add_argument("--sim-latency", type=float, default=0.02, help="Mean simulated command latency in seconds.")
+    parser.add_argument("--sim-jitter", type=float, default=0.005, help="Simulated command latency jitter in seconds.")
+    args = parser.parse_args()
+
+    spheros = sphero_list
+    backend = BleBackend()
+    if args.backend == "sim":
+        backend = SimulatedBackend(args.sim_latency, args.sim_jitter)
+        if args.sim_count is not None:
+            spheros = simulated_sphero_list(args.sim_count)
+
+    if args.mode == "async":
+        asyncio.run(run_controller(spheros, backend, args.max_ble, args.preempt, args.telemetry_rate, args.telemetry_batch,
+                                   args.wire))
+    else:
+        multiprocessing.set_start_method("spawn")
 
-        websocket_process = multiprocessing.Process(target=run_websocket, args=(message_bus, spheros))
-        websocket_sender_process = multiprocessing.Process(target=run_websocket_sender, args=(outgoing_queue,))
+        channels = {sphero["id"]: multiprocessing.Queue() for sphero in spheros}  # One command channel per Sphero
+        outgoing_queue = multiprocessing.Queue()  # Robot workers put feedback here directly
 
+        websocket_process = multiprocessing.Process(target=run_websocket, args=(channels, outgoing_queue, spheros, args.wire))
         websocket_process.start()
-        websocket_sender_process.start()
 
         subscriber_processes = []
 
         for sphero in spheros:
-            process = multiprocessing.Process(target=run_sphero, args=(sphero["id"], sphero["color"], message_bus, outgoing_queue))
+            process = multiprocessing.Process(target=run_sphero_process, args=(sphero["id"], sphero["color"], channels[sphero["id"]], outgoing_queue, backend, args.max_ble, args.preempt, args.telemetry_rate, args.telemetry_batch))
             process.start()
             subscriber_processes.append(process)
-            time.sleep(4) 
+            time.sleep(4)
 
         logging.info("Main: All processes started.")
 
         websocket_process.join()
-        websocket_sender_process.join()
 
         for process in subscriber_processes:
             process.join()
@@ -0,0 +1,206 @@
+import math
+import random
+import threading
+import time
+from spheros import sphero_list
+
+class SimulatedToy:
+    def __init__(self, name):
+        """
+        Stand-in for a discovered BLE toy.
+
+        Args:
+            name: Name advertised by the simulated Sphero.
+        """
+        self.name = name
+
+class SimulatedSphero:
+    def __init__(self, toy, latency=0.02, jitter=0.005, max_speed=200.0, rng=None):
+        """
+        Simulated Sphero implementing the subset of the SpheroEduAPI surface used by the controller.
+
+        Every command blocks for a randomized latency, like a BLE write waiting for its response,
+        and rolling is integrated into a position in centimeters.
+
+        Args:
+            toy: SimulatedToy returned by SimulatedBackend.find_toy.
+            latency: Mean command latency in seconds.
+            jitter: Standard deviation of the command latency in seconds.
+            max_speed: Speed in cm/s at a roll speed of 255.
+            rng: Random number generator used for the latency jitter.
+        """
+        self.toy = toy
+        self.latency = latency
+        self.jitter = jitter
+        self.max_speed = max_speed
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()  # Guards the state, which may be read from other threads
+
+        self.connected = False
+        self.calibrated = False
+        self.commands = 0  # Number of commands sent to the simulated Sphero
+        self.heading = 0  # Roll heading in degrees
+        self.speed = 0  # Roll speed from -255 to 255
+        self.compass_direction = None
+        self.main_led = None
+        self.matrix = {}  # LED matrix as {"x:y": color}
+        self.sensor_interval = 150  # Sensor streaming interval in milliseconds
+        self.x = 0.0  # Position in cm
+        self.y = 0.0
+        self.last_update = time.monotonic()
+
+    def __enter__(self):
+        self._command()
+        self.connected = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop_roll()
+        self.connected = False
+
+    def _command(self):
+        """
+        Block for one command round trip and count the command.
+        """
+        delay = self.rng.gauss(self.latency, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        with self.lock:
+            self.commands += 1
+
+    def _advance(self):
+        """
+        Integrate the position up to now. Must be called with the lock held.
+        """
+        now = time.monotonic()
+        distance = self.speed / 255 * self.max_speed * (now - self.last_update)
+        self.x += distance * math.sin(math.radians(self.heading))
+        self.y += distance * math.cos(math.radians(self.heading))
+        self.last_update = now
+
+    def calibrate_compass(self):
+        self._command()
+        self.calibrated = True
+
+    def set_compass_direction(self, direction):
+        if not self.calibrated:
+            raise Exception("Compass is not calibrated")
+        self._command()
+        self.compass_direction = direction % 360
+
+    def set_main_led(self, color):
+        self._command()
+        self.main_led = color
+
+    def clear_matrix(self):
+        self._command()
+        self.matrix = {}
+
+    def set_matrix_pixel(self, x, y, color):
+        self._command()
+        self.matrix[f"{x}:{y}"] = color
+
+    def set_matrix_fill(self, x1, y1, x2, y2, color):
+        self._command()
+        for x in range(min(x1, x2), max(x1, x2) + 1):
+            for y in range(min(y1, y2), max(y1, y2) + 1):
+                self.matrix[f"{x}:{y}"] = color
+
+    def set_matrix_line(self, x1, y1, x2, y2, color):
+        dx = abs(x2 - x1)
+        dy = abs(y2 - y1)
+        if (dx != 0 and dy != 0 and dx != dy) or (dx == 0 and dy == 0):
+            raise Exception("Can only draw straight lines and diagonals")
+        self._command()
+        step_x = (x2 > x1) - (x2 < x1)
+        step_y = (y2 > y1) - (y2 < y1)
+        for line_increment in range(max(dx, dy) + 1):
+            self.matrix[f"{x1 + step_x * line_increment}:{y1 + step_y * line_increment}"] = color
+
+    def start_roll(self, heading, speed):
+        self._command()
+        with self.lock:
+            self._advance()
+            self.heading = heading % 360
+            self.speed = max(-255, min(speed, 255))
+
+    def stop_roll(self, heading=None):
+        self._command()
+        with self.lock:
+            self._advance()
+            if heading is not None:
+                self.heading = heading % 360
+            self.speed = 0
+
+    def roll(self, heading, speed, duration):
+        self.start_roll(heading, speed)
+        time.sleep(duration)
+        self.stop_roll()
+
+    def set_sensor_interval(self, interval):
+        self._command()
+        self.sensor_interval = interval
+
+    def get_location(self):
+        """
+        Returns:
+            Dictionary with the "x" and "y" position in cm.
+        """
+        with self.lock:
+            self._advance()
+            return {"x": self.x, "y": self.y}
+
+    def get_velocity(self):
+        """
+        Returns:
+            Dictionary with the "x" and "y" velocity in cm/s.
+        """
+        with self.lock:
+            velocity = self.speed / 255 * self.max_speed
+            return {"x": velocity * math.sin(math.radians(self.heading)),
+                    "y": velocity * math.cos(math.radians(self.heading))}
+
+    def get_heading(self):
+        with self.lock:
+            return self.heading
+
+class SimulatedBackend:
+    def __init__(self, latency=0.02, jitter=0.005, seed=None):
+        """
+        Backend that creates simulated Spheros instead of scanning for real ones.
+
+        Args:
+            latency: Mean command latency in seconds.
+            jitter: Standard deviation of the command latency in seconds.
+            seed: Random seed for the latency jitter.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.droids = []  # Every simulated Sphero created, to read their command counts
+
+    def find_toy(self, sphero_id):
+        return SimulatedToy(sphero_id)
+
+    def find_toys(self, sphero_ids, timeout=5.0):
+        return {sphero_id: SimulatedToy(sphero_id) for sphero_id in sphero_ids}
+
+    def create_api(self, toy):
+        droid = SimulatedSphero(toy, self.latency, self.jitter, rng=random.Random(self.rng.random()))
+        self.droids.append(droid)
+        return droid
+
+def simulated_sphero_list(count):
+    """
+    Build a list of virtual Spheros, reusing the colors of the real swarm.
+
+    Args:
+        count: Number of virtual Spheros.
+
+    Returns:
+        List of Sphero dictionaries in the format of sphero_list.
+    """
+    return [
+        {"id": f"SIM-{index:03d}", "color": sphero_list[index % len(sphero_list)]["color"], "ready": False}
+        for index in range(count)
+    ]
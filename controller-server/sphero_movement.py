@@ -1,18 +1,20 @@
-from multiprocessing import Process
+import asyncio
+import time
 from spherov2.types import Color
+from PIL import ImageColor
 
 class SpheroMovement:
-    def __init__(self, droid, sphero_id, sphero_color, outgoing_queue):
+    def __init__(self, session, sphero_id, sphero_color, outgoing_queue):
         """
         Initialize the SpheroMovement class to manage Sphero movements and feedback.
 
         Args:
-            droid: Persistent SpheroEduAPI instance to control the Sphero.
+            session: SpheroSession used to send commands to the Sphero.
             sphero_id: Unique identifier for the Sphero client.
             sphero_color: Color for the Sphero's main LED.
             outgoing_queue: Queue for sending feedback messages.
         """
-        self.droid = droid
+        self.session = session
         self.sphero_id = sphero_id
         self.sphero_color = sphero_color
         self.outgoing_queue = outgoing_queue
@@ -31,35 +33,106 @@ class SpheroMovement:
                 "messageType": "SpheroFeedback",
                 "message": message
             }
-            process = Process(target=self.outgoing_queue.put, args=(message_json,))
-            process.start()
-            process.join()
+            self.outgoing_queue.put(message_json)
         except Exception as e:
             print(f"Error sending feedback: {e}")
 
-    def move(self, angle, timing):
+    def report_dropped(self, status):
+        """
+        Tell the brain that a movement command will not complete.
+
+        Args:
+            status: "preempted" if the command was interrupted by a newer one,
+                    "superseded" if it was dropped before it started.
+        """
+        self.send_feedback({"id": self.sphero_id, "status": status, "dropped_at": time.time()})
+
+    async def wait_until(self, execute_at):
+        """
+        Send the queued setup commands, then wait for the scheduled start time of a command.
+
+        Args:
+            execute_at: Time (time.time() on this machine) to start at, or None to start immediately.
+        """
+        if execute_at is None:
+            return
+        await self.session.flush()
+        delay = execute_at - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif delay < -0.01:
+            print(f"[{self.sphero_id}] Started {-delay * 1000:.0f} ms after its scheduled time.")
+
+    async def move(self, angle, timing, execute_at=None, trace=None):
         """
         Move the Sphero from the current position to the target position.
 
         Args:
             current: Tuple (x, y) representing the current position.
             target: Tuple (x, y) representing the target position.
+            execute_at: Scheduled start time on this machine's clock, or None to start immediately.
+            trace: End-to-end trace of the command, returned with the feedback, or None.
         """
         try:
-            self.droid.set_main_led(self.sphero_color)  # Set the main LED to the client color
+            await self.session.set_main_led(self.sphero_color)  # Set the main LED to the client color
 
-            self.droid.set_compass_direction(round(angle))
+            await self.session.set_compass_direction(round(angle))
+            await self.wait_until(execute_at)
 
             # Use the provided timing for movement
-            self.droid.roll(angle, 20, timing)
+            ble_start = time.time()
+            await self.session.roll(angle, 20, timing)
+            completed_at = time.time()
             print(f"[{self.sphero_id}] Movement complete.")
-            self.send_feedback(self.sphero_id)
+            feedback = {"id": self.sphero_id, "completed_at": completed_at}
+            if trace is not None:
+                feedback["trace"] = {**trace, "ble_start": ble_start, "ble_end": completed_at}
+            self.send_feedback(feedback)
         except Exception as e:
             print(f"Error in move: {e}")
+            await self.stop()
 
+    async def move_sequence(self, segments, execute_at=None, trace=None):
+        """
+        Execute a sequence of timed heading segments back-to-back and send a single feedback message.
 
+        Args:
+            segments: List of dictionaries with the "angle" and "timing" of each segment.
+            execute_at: Scheduled start time on this machine's clock, or None to start immediately.
+            trace: End-to-end trace of the command, returned with the feedback, or None.
+        """
+        try:
+            await self.session.set_main_led(self.sphero_color)  # Set the main LED to the client color
+            await self.wait_until(execute_at)
+
+            ble_start = time.time()
+            completed = []
+            for segment in segments:
+                angle = segment["angle"]
+                await self.session.set_compass_direction(round(angle))
+                await self.session.roll(angle, 20, segment["timing"])
+                completed.append(time.time())  # Completion timestamp of this segment
+
+            print(f"[{self.sphero_id}] Movement sequence of {len(segments)} segments complete.")
+            completed_at = completed[-1] if completed else time.time()  # An empty sequence completes right away
+            feedback = {"id": self.sphero_id, "completed": completed, "completed_at": completed_at}
+            if trace is not None:
+                feedback["trace"] = {**trace, "ble_start": ble_start, "ble_end": completed_at}
+            self.send_feedback(feedback)
+        except Exception as e:
+            print(f"Error in move_sequence: {e}")
+            await self.stop()
 
-    def move_direction(self, direction, duration):
+    async def stop(self):
+        """
+        Stop the Sphero after a failed movement, which may have been handed a roll that is still going.
+        """
+        try:
+            await self.session.stop_roll()
+        except Exception as e:
+            print(f"Error stopping the roll: {e}")
+
+    async def move_direction(self, direction, duration):
         """
         Move the Sphero in a specific direction for a given duration.
 
@@ -76,13 +149,13 @@ class SpheroMovement:
         angle = directions.get(direction.lower(), 0)  # Default to 0 degrees if direction is invalid
 
         try:
-            self.droid.set_main_led(self.sphero_color)  # Set the main LED to the client color
-            self.droid.set_compass_direction(angle)  # Set the compass direction
-            self.droid.roll(0, 40, duration)  # Move the Sphero
+            await self.session.set_main_led(self.sphero_color)  # Set the main LED to the client color
+            await self.session.set_compass_direction(angle)  # Set the compass direction
+            await self.session.roll(0, 40, duration)  # Move the Sphero
         except Exception as e:
             print(f"Error in move_direction: {e}")
 
-    def set_matrix(self, pattern):
+    async def set_matrix(self, pattern):
         """
         Set the LED matrix to display a specific pattern.
 
@@ -90,28 +163,47 @@ class SpheroMovement:
             pattern: Pattern to display (e.g., "X").
         """
         try:
-            self.droid.clear_matrix()  # Clear the existing LED matrix
-
             if pattern == "X":
-                self.droid.set_compass_direction(0)  # Reset compass direction
+                await self.session.set_compass_direction(0)  # Reset compass direction
 
                 # Define patterns for specific Spheros
                 if self.sphero_id == "SB-2E86" or self.sphero_id == "SB-D8B2":
-                    self.droid.set_matrix_line(0, 0, 7, 7, Color(r=255, g=0, b=0))
-                    self.droid.set_matrix_line(1, 0, 7, 6, Color(r=255, g=0, b=0))
-                    self.droid.set_matrix_line(0, 1, 6, 7, Color(r=255, g=0, b=0))
+                    lines = [(0, 0, 7, 7), (1, 0, 7, 6), (0, 1, 6, 7)]
                 elif self.sphero_id == "SB-4844" or self.sphero_id == "SB-7104":
-                    self.droid.set_matrix_line(0, 7, 7, 0, Color(r=255, g=0, b=0))
-                    self.droid.set_matrix_line(0, 6, 6, 0, Color(r=255, g=0, b=0))
-                    self.droid.set_matrix_line(1, 7, 7, 1, Color(r=255, g=0, b=0))
+                    lines = [(0, 7, 7, 0), (0, 6, 6, 0), (1, 7, 7, 1)]
                 elif self.sphero_id == "SB-E12C":
-                    self.droid.set_matrix_line(0, 0, 7, 7, Color(r=255, g=0, b=0))
-                    self.droid.set_matrix_line(1, 0, 7, 6, Color(r=255, g=0, b=0))
-                    self.droid.set_matrix_line(0, 1, 6, 7, Color(r=255, g=0, b=0))
-                    self.droid.set_matrix_line(0, 7, 7, 0, Color(r=255, g=0, b=0))
-                    self.droid.set_matrix_line(0, 6, 6, 0, Color(r=255, g=0, b=0))
-                    self.droid.set_matrix_line(1, 7, 7, 1, Color(r=255, g=0, b=0))
+                    lines = [(0, 0, 7, 7), (1, 0, 7, 6), (0, 1, 6, 7), (0, 7, 7, 0), (0, 6, 6, 0), (1, 7, 7, 1)]
                 else:
                     print("Droid not found")
+                    lines = []
+
+                # Draw the lines into a frame and send only the commands needed to show it
+                frame = [[None] * 8 for _ in range(8)]
+                for x1, y1, x2, y2 in lines:
+                    step_x = (x2 > x1) - (x2 < x1)
+                    step_y = (y2 > y1) - (y2 < y1)
+                    for i in range(max(abs(x2 - x1), abs(y2 - y1)) + 1):
+                        frame[y1 + step_y * i][x1 + step_x * i] = Color(r=255, g=0, b=0)
+                await self.session.set_matrix_frame(frame)
+            else:
+                await self.session.clear_matrix()  # Clear the existing LED matrix
+
+            await self.session.flush()  # Surface errors from the queued matrix commands
         except Exception as e:
             print(f"Error in set_matrix: {e}")
+
+    async def set_matrix_frame(self, frame):
+        """
+        Show a whole 8x8 frame on the LED matrix.
+
+        Args:
+            frame: 8 rows of 8 hex color strings, indexed as frame[y][x]. None marks an unlit pixel.
+        """
+        try:
+            colors = []
+            for row in frame:
+                colors.append([None if color is None else Color(*ImageColor.getrgb(color)) for color in row])
+            await self.session.set_matrix_frame(colors)
+            await self.session.flush()  # Surface errors from the queued matrix commands
+        except Exception as e:
+            print(f"Error in set_matrix_frame: {e}")
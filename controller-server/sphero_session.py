@@ -0,0 +1,289 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from spherov2 import scanner
+from spherov2.types import Color
+from matrix_frame import OFF, frame_to_keys, plan_matrix_commands
+from sphero_subclass import MySpheroEduAPI
+
+class BleBackend:
+    """
+    Backend that discovers and drives real Sphero robots over BLE.
+    """
+    def find_toy(self, sphero_id):
+        """
+        Scan for a Sphero by name.
+
+        Args:
+            sphero_id: Name advertised by the Sphero.
+
+        Returns:
+            The discovered toy.
+
+        Raises:
+            scanner.ToyNotFoundError: If the Sphero is not in range.
+        """
+        return scanner.find_toy(toy_name=sphero_id)
+
+    def find_toys(self, sphero_ids, timeout=5.0):
+        """
+        Scan once for several Spheros.
+
+        Args:
+            sphero_ids: Names of the Spheros to look for.
+            timeout: Scan duration in seconds.
+
+        Returns:
+            Dictionary mapping each found Sphero ID to its toy.
+        """
+        toys = scanner.find_toys(timeout=timeout, toy_names=sphero_ids)
+        return {toy.name: toy for toy in toys}
+
+    def create_api(self, toy):
+        """
+        Wrap a discovered toy in the blocking Sphero EDU API.
+
+        Args:
+            toy: Toy returned by find_toy.
+
+        Returns:
+            MySpheroEduAPI instance for the toy (not yet connected).
+        """
+        return MySpheroEduAPI(toy)
+
+def run_limited(ble_limit, function, *args):
+    """
+    Run a blocking BLE operation while holding a slot of the shared BLE limit.
+
+    Args:
+        ble_limit: threading.BoundedSemaphore shared by everything using the same adapter.
+        function: Blocking function to call.
+        *args: Arguments for the call.
+
+    Returns:
+        The result of the call.
+    """
+    with ble_limit:
+        return function(*args)
+
+def color_key(color):
+    """
+    Comparable key for a spherov2 Color.
+    """
+    return (color.r, color.g, color.b)
+
+class SpheroSession:
+    def __init__(self, droid, sphero_id, ble_limit):
+        """
+        Async session over a blocking Sphero EDU API instance.
+
+        Commands for one Sphero run in order on a dedicated worker thread, while a semaphore shared by all
+        sessions bounds how many BLE operations are in flight at once. The session caches the LED, heading
+        and matrix state it last set, so commands that would not change it are not sent, and queues the
+        remaining state changes without waiting for each one to complete.
+
+        Args:
+            droid: Blocking SpheroEduAPI instance (not yet connected).
+            sphero_id: Unique identifier of the Sphero.
+            ble_limit: threading.BoundedSemaphore shared by all sessions on the same adapter.
+        """
+        self.droid = droid
+        self.sphero_id = sphero_id
+        self.ble_limit = ble_limit
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=sphero_id)
+        self.pending = None  # Future of the last queued command
+        self.handover = False  # Whether a cancelled roll is followed right away by another roll
+
+        # Last known device state, None when unknown
+        self.main_led = None
+        self.compass_direction = None
+        self.matrix = None  # Dictionary of lit (x, y) pixels to color keys
+
+        self.stats = {"sent": 0, "suppressed": 0}  # BLE commands sent and suppressed by the state cache
+
+    async def __aenter__(self):
+        await self.call(self.droid.__enter__)  # Connect to the Sphero
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.call(self.droid.stop_roll)  # A cancelled roll leaves the Sphero rolling
+            await self.call(self.droid.__exit__, exc_type, exc, tb)  # Disconnect from the Sphero
+        finally:
+            self.executor.shutdown(wait=False)
+            logging.info(f"{self.sphero_id}: Sent {self.stats['sent']} BLE commands, suppressed {self.stats['suppressed']}.")
+
+    def submit(self, function, *args):
+        """
+        Queue a blocking API call on this Sphero's worker thread without waiting for it.
+        Calls run in the order they are submitted.
+
+        Args:
+            function: Bound method of the droid to call.
+            *args: Arguments for the call.
+
+        Returns:
+            Future resolving to the result of the call.
+        """
+        loop = asyncio.get_running_loop()
+        self.stats["sent"] += 1
+        self.pending = loop.run_in_executor(self.executor, functools.partial(run_limited, self.ble_limit, function, *args))
+        return self.pending
+
+    async def call(self, function, *args):
+        """
+        Run a blocking API call on this Sphero's worker thread and wait for it.
+        Every previously queued call has completed when this returns.
+
+        Args:
+            function: Bound method of the droid to call.
+            *args: Arguments for the call.
+
+        Returns:
+            The result of the call.
+        """
+        return await self.submit(function, *args)
+
+    async def flush(self):
+        """
+        Wait until every queued command has completed.
+        """
+        if self.pending is not None:
+            await self.pending
+
+    def _queue_state(self, attribute, value, function, *args):
+        """
+        Queue a state-changing command, forgetting the cached state if it fails.
+
+        Args:
+            attribute: Name of the cached state attribute.
+            value: New value of the cached state.
+            function: Bound method of the droid to call.
+            *args: Arguments for the call.
+        """
+        setattr(self, attribute, value)
+        future = self.submit(function, *args)
+
+        def check(done):
+            if done.cancelled() or done.exception() is not None:
+                setattr(self, attribute, None)  # The device state is unknown now
+                if not done.cancelled():
+                    logging.error(f"{self.sphero_id}: Command {function.__name__} failed: {done.exception()}")
+
+        future.add_done_callback(check)
+
+    async def calibrate_compass(self):
+        await self.call(self.droid.calibrate_compass)
+        self.compass_direction = None
+
+    async def set_compass_direction(self, direction):
+        if direction == self.compass_direction:
+            self.stats["suppressed"] += 1
+            return
+        self._queue_state("compass_direction", direction, self.droid.set_compass_direction, direction)
+
+    async def set_main_led(self, color):
+        if color_key(color) == self.main_led:
+            self.stats["suppressed"] += 1
+            return
+        self._queue_state("main_led", color_key(color), self.droid.set_main_led, color)
+
+    async def clear_matrix(self):
+        if self.matrix == {}:
+            self.stats["suppressed"] += 1
+            return
+        self._queue_state("matrix", {}, self.droid.clear_matrix)
+
+    async def set_matrix_line(self, x1, y1, x2, y2, color):
+        length = max(abs(x2 - x1), abs(y2 - y1))
+        step_x = (x2 > x1) - (x2 < x1)
+        step_y = (y2 > y1) - (y2 < y1)
+        pixels = [(x1 + step_x * i, y1 + step_y * i) for i in range(length + 1)]
+
+        key = color_key(color)
+        if self.matrix is not None and all(self.matrix.get(pixel, OFF) == key for pixel in pixels):
+            self.stats["suppressed"] += 1
+            return
+
+        matrix = None
+        if self.matrix is not None:
+            matrix = dict(self.matrix)
+            matrix.update({pixel: key for pixel in pixels})
+            matrix = {pixel: value for pixel, value in matrix.items() if value != OFF}
+        self._queue_state("matrix", matrix, self.droid.set_matrix_line, x1, y1, x2, y2, color)
+
+    async def set_matrix_frame(self, frame):
+        """
+        Show a whole 8x8 frame, sending only the fill, line and pixel commands needed to get there
+        from the cached matrix state.
+
+        Args:
+            frame: 8 rows of 8 Colors, indexed as frame[y][x]. None marks an unlit pixel.
+        """
+        target = frame_to_keys(frame, color_key)
+        commands = plan_matrix_commands(self.matrix, target)
+        if not commands:
+            self.stats["suppressed"] += 1
+            return
+
+        matrix = {pixel: key for pixel, key in target.items() if key != OFF}
+        for command in commands:
+            if command[0] == "clear":
+                self._queue_state("matrix", matrix, self.droid.clear_matrix)
+            elif command[0] == "fill":
+                self._queue_state("matrix", matrix, self.droid.set_matrix_fill, *command[1:5], Color(*command[5]))
+            elif command[0] == "line":
+                self._queue_state("matrix", matrix, self.droid.set_matrix_line, *command[1:5], Color(*command[5]))
+            else:
+                self._queue_state("matrix", matrix, self.droid.set_matrix_pixel, *command[1:3], Color(*command[3]))
+
+    async def set_sensor_interval(self, interval):
+        await self.call(self.droid.set_sensor_interval, interval)
+
+    def read_telemetry(self):
+        """
+        Read the latest streamed sensor values. These are cached by the API, so no BLE command is sent.
+
+        Returns:
+            List [x, y, vx, vy, heading] with the location in cm, the velocity in cm/s and the heading in degrees,
+            or None if no sensor data has been streamed yet.
+        """
+        location = self.droid.get_location()
+        velocity = self.droid.get_velocity()
+        if not location or not velocity or location.get("x") is None or velocity.get("x") is None:
+            return None
+        return [location["x"], location["y"], velocity["x"], velocity["y"], self.droid.get_heading()]
+
+    async def roll(self, heading, speed, duration):
+        """
+        Roll for a duration without holding the worker thread or a BLE slot while the Sphero is moving.
+        Queued commands are sent before the roll starts.
+
+        If the roll is cancelled, the Sphero is stopped, unless the caller announced with hand_over that
+        another roll follows immediately, in which case the Sphero keeps rolling until that roll takes over.
+
+        Args:
+            heading: Heading in degrees.
+            speed: Speed from -255 to 255.
+            duration: Roll duration in seconds.
+        """
+        self.handover = False
+        try:
+            await self.call(self.droid.start_roll, heading, speed)
+            await asyncio.sleep(duration)
+        except asyncio.CancelledError:
+            if not self.handover:
+                await self.stop_roll()
+            raise
+        await self.call(self.droid.stop_roll)
+
+    def hand_over(self):
+        """
+        Keep the Sphero rolling when the current roll is cancelled, because the next command rolls right away.
+        """
+        self.handover = True
+
+    async def stop_roll(self):
+        self.handover = False
+        await self.call(self.droid.stop_roll)
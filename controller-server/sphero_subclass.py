@@ -1,11 +1,12 @@
 from spherov2.sphero_edu import SpheroEduAPI
 from spherov2.utils import ToyUtil
-from spherov2.helper import bound_color
+from spherov2.helper import bound_color, bound_value
 from spherov2.types import Color
 
 class MySpheroEduAPI(SpheroEduAPI):
     """
-    Subclass of SpheroEduAPI to fix a broken function for drawing lines on the Sphero matrix.
+    Subclass of SpheroEduAPI to fix a broken function for drawing lines on the Sphero matrix
+    and to start a roll without blocking for its duration.
     """
     def set_matrix_line(self, x1: int, y1: int, x2: int, y2: int, color: Color):
         """
@@ -30,6 +31,9 @@ class MySpheroEduAPI(SpheroEduAPI):
             raise Exception("Can only draw straight lines and diagonals")
 
         line_length = max(dx, dy)  # Determine the length of the line
+        # Signed steps, so lines drawn right-to-left or bottom-to-top (e.g. anti-diagonals) stay on the grid
+        step_x = (x2 > x1) - (x2 < x1)
+        step_y = (y2 > y1) - (y2 < y1)
 
         # Access private attributes __leds and __toy using name mangling
         leds = self._SpheroEduAPI__leds
@@ -37,8 +41,8 @@ class MySpheroEduAPI(SpheroEduAPI):
 
         # Iterate through each point on the line
         for line_increment in range(line_length + 1):
-            x_ = x1 + int((dx / line_length) * line_increment)  # Calculate the x-coordinate
-            y_ = y1 + int((dy / line_length) * line_increment)  # Calculate the y-coordinate
+            x_ = x1 + step_x * line_increment  # Calculate the x-coordinate
+            y_ = y1 + step_y * line_increment  # Calculate the y-coordinate
             strMapLoc = f"{x_}:{y_}"  # Create the LED map location key
 
             # Update the LED matrix with the new color, ensuring it is within bounds
@@ -46,3 +50,28 @@ class MySpheroEduAPI(SpheroEduAPI):
 
         # Use ToyUtil to send the line drawing command to the Sphero device
         ToyUtil.set_matrix_line(toy, x1, y1, x2, y2, color.r, color.g, color.b, is_user_color=False)
+
+    def start_roll(self, heading: int, speed: int):
+        """
+        Start rolling at a heading and speed without blocking for a duration.
+
+        Unlike roll, this returns as soon as the command is sent; call stop_roll to stop.
+
+        Args:
+            heading (int): Heading in degrees.
+            speed (int): Speed from -255 to 255.
+        """
+        # Access private attributes __heading and __speed using name mangling
+        self._SpheroEduAPI__heading = heading % 360
+        self._SpheroEduAPI__speed = bound_value(-255, speed, 255)
+        self._SpheroEduAPI__update_speed()
+
+    def set_sensor_interval(self, interval: int):
+        """
+        Set how often the Sphero streams its sensor data (location, velocity, orientation).
+
+        Args:
+            interval (int): Streaming interval in milliseconds.
+        """
+        # Access private attribute __toy using name mangling
+        self._SpheroEduAPI__toy.sensor_control.set_interval(interval)
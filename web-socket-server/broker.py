@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import sys
+import time
+from websockets import serve, ConnectionClosed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))  # Shared wire_format.py
+from wire_format import WireFormat
+
+# Movement commands only matter until a newer one for the same Sphero arrives, which replaces it in the queue
+COMMAND_TYPES = {"SpheroMovement", "SpheroMovementSequence"}
+# Telemetry only matters until a newer batch arrives, so the oldest is dropped when a client falls behind
+TELEMETRY_TYPES = {"SpheroTelemetry"}
+
+def stamp(message, key):
+    """
+    Add a relay timestamp to the end-to-end trace of a command or feedback, if it carries one.
+
+    Args:
+        message: Message content, with a "trace" dictionary when the Brain Server traces commands.
+        key: Name of the hop (e.g., "relay_in").
+    """
+    if isinstance(message, dict) and isinstance(message.get("trace"), dict):
+        message["trace"][key] = time.time()
+
+class Client:
+    def __init__(self, ws, client_type, max_queue, encoding="json"):
+        """
+        Connected WebSocket client with a bounded outbound queue drained by its own writer task.
+
+        Args:
+            ws: WebSocket connection of the client.
+            client_type: Type of the client (e.g., "SpheroController").
+            max_queue: Maximum number of queued telemetry messages before the oldest is dropped.
+            encoding: Encoding the client accepts, "json" or "binary".
+        """
+        self.ws = ws
+        self.client_type = client_type
+        self.encoding = encoding
+        self.max_queue = max_queue
+        self.queue = collections.deque()  # Serialized messages as [messageType, target ID, data]
+        self.commands = {}  # Sphero ID to its queued movement command, at most one per Sphero
+        self.sending = None  # Sphero ID of the movement command being written, if any
+        self.telemetry = 0  # Number of telemetry messages in the queue
+        self.superseded = 0  # Movement commands replaced by a newer one for the same Sphero
+        self.dropped = 0  # Telemetry messages dropped
+        self.wakeup = asyncio.Event()
+        self.writer = asyncio.create_task(self.write())
+
+    def undelivered(self):
+        """
+        Get the Spheros whose movement command was still queued or being written.
+        """
+        return list(self.commands) + [self.sending] if self.sending is not None else list(self.commands)
+
+    def send(self, message_type, id, data):
+        """
+        Queue a serialized message without waiting for the client.
+
+        Movement commands are latest-wins per Sphero: a new command replaces the one still queued for the
+        same Sphero, in its place, and never evicts another Sphero's command. The replacement reports its
+        own completion, so the Brain Server still gets one feedback per Sphero.
+        Telemetry has its own bound: once max_queue messages are queued, the oldest one is dropped.
+        Other messages (connection, readiness, feedback, ticks) are always delivered.
+
+        Args:
+            message_type: Type of the message.
+            id: ID of the target client.
+            data: Serialized message.
+        """
+        if message_type in COMMAND_TYPES:
+            queued = self.commands.get(id)
+            if queued is not None:
+                queued[0], queued[2] = message_type, data
+                self.superseded += 1
+                return
+            entry = self.commands[id] = [message_type, id, data]
+        else:
+            if message_type in TELEMETRY_TYPES:
+                if self.telemetry >= self.max_queue:
+                    oldest = next(index for index, (queued_type, _, _) in enumerate(self.queue) if queued_type in TELEMETRY_TYPES)
+                    del self.queue[oldest]
+                    self.telemetry -= 1
+                    self.dropped += 1
+                self.telemetry += 1
+            entry = [message_type, id, data]
+        self.queue.append(entry)
+        self.wakeup.set()
+
+    async def write(self):
+        """
+        Send queued messages to the client in order until the connection closes.
+        """
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.queue:
+                    entry = self.queue.popleft()
+                    message_type, id, data = entry
+                    if message_type in TELEMETRY_TYPES:
+                        self.telemetry -= 1
+                    elif self.commands.get(id) is entry:
+                        del self.commands[id]  # On its way, so a newer command is queued behind it
+                        self.sending = id
+                    await self.ws.send(data)
+                    self.sending = None
+        except ConnectionClosed:
+            pass
+
+class Broker:
+    def __init__(self, max_queue=64, verbose=False):
+        """
+        Asyncio relay between the Brain Server and the Controller Servers, speaking the same
+        clientType/messageType protocol as server.js.
+
+        Args:
+            max_queue: Maximum number of telemetry messages queued per client.
+            verbose: Log every routed message.
+        """
+        self.max_queue = max_queue
+        self.verbose = verbose
+        self.routes = {}  # Client ID (Sphero ID, "SpheroBrain", ...) to Client
+        self.clients = {}  # WebSocket connection to Client
+        self.spheros = {}  # Sphero ID to Sphero dictionary with its "ready" flag
+        self.counts = collections.Counter()  # Routed messages per messageType
+        self.wire = WireFormat("binary")  # Decodes incoming messages, encodes for clients that negotiated binary
+
+    def register(self, ws, client_type, ids, encoding="json"):
+        """
+        Route the given IDs to a connection, creating its Client on first use.
+
+        Args:
+            ws: WebSocket connection.
+            client_type: Type of the client.
+            ids: Client IDs reachable through the connection.
+            encoding: Encoding the client accepts, "json" or "binary".
+        """
+        client = self.clients.get(ws)
+        if client is None:
+            client = self.clients[ws] = Client(ws, client_type, self.max_queue, encoding)
+        for client_id in ids:
+            self.routes[client_id] = client
+            logging.info(f"Client connected: [{client_type}]: {client_id}")
+
+    def unregister(self, ws):
+        """
+        Remove a closed connection and every route through it.
+        """
+        client = self.clients.pop(ws, None)
+        if client is None:
+            return
+        client.writer.cancel()
+        self.routes = {client_id: route for client_id, route in self.routes.items() if route is not client}
+        logging.info(f"A client has disconnected ({client.superseded} command(s) superseded, "
+                     f"{client.dropped} telemetry message(s) dropped).")
+        for sphero_id in client.undelivered():
+            self.report_dropped(sphero_id)  # Never delivered
+
+    def report_dropped(self, sphero_id):
+        """
+        Tell the Brain Server that a movement command was dropped before reaching its Sphero, so that it can
+        plan again instead of waiting for a feedback that will never come.
+
+        Args:
+            sphero_id: ID of the Sphero the command was for.
+        """
+        logging.warning(f"Movement command for {sphero_id} dropped.")
+        self.send_message_to_client("SpheroBrain", "SpheroFeedback",
+                                    {"id": sphero_id, "status": "dropped", "dropped_at": time.time()})
+
+    def send_message_to_client(self, id, message_type, message):
+        """
+        Send a message to a specific client.
+
+        Args:
+            id: ID of the target client.
+            message_type: Type of the message being sent.
+            message: Content of the message.
+        """
+        client = self.routes.get(id)
+        if client is None:
+            logging.warning(f"{id} not found or not connected.")
+            if message_type in COMMAND_TYPES:
+                self.report_dropped(id)
+            return
+        client.send(message_type, id, self.encode_for(client, {"id": id, "messageType": message_type, "message": message}))
+        self.counts[message_type] += 1
+        if self.verbose:
+            logging.debug(f"Message sent to {id}: {message_type}")
+
+    def encode_for(self, client, message):
+        """
+        Serialize a message in the encoding negotiated by a client.
+        """
+        if client.encoding == "binary":
+            return self.wire.encode(message)
+        return json.dumps(message)
+
+    def broadcast_to_controllers(self, message_type, message):
+        """
+        Send a message once per SpheroController connection with the broadcast ID "*".
+        """
+        message = {"id": "*", "messageType": message_type, "message": message}
+        encoded = {}  # Serialized once per encoding
+        for client in self.clients.values():
+            if client.client_type == "SpheroController":
+                if client.encoding not in encoded:
+                    encoded[client.encoding] = self.encode_for(client, message)
+                client.send(message_type, "*", encoded[client.encoding])
+        self.counts[message_type] += 1
+
+    def send_tick(self, commands, execute_at=None):
+        """
+        Send the commands of one planning tick as a single SpheroTick per SpheroController connection.
+
+        Args:
+            commands: List of {id, angle, timing} or {id, segments} commands.
+            execute_at: Scheduled start time of the tick on the controller clock, or None.
+        """
+        ticks = {}  # Client to the commands for its Spheros
+        for command in commands:
+            client = self.routes.get(command["id"])
+            if client is None:
+                logging.warning(f"{command['id']} not found or not connected.")
+                self.report_dropped(command["id"])
+                continue
+            ticks.setdefault(client, []).append(command)
+
+        for client, tick_commands in ticks.items():
+            for command in tick_commands:
+                stamp(command, "relay_out")
+            tick = {"commands": tick_commands}
+            if execute_at is not None:
+                tick["execute_at"] = execute_at
+            message = {"id": "*", "messageType": "SpheroTick", "message": tick}
+            client.send("SpheroTick", "*", self.encode_for(client, message))
+        self.counts["SpheroTick"] += 1
+
+    def initialize_spheros(self):
+        """
+        Notify the Brain Server of the connected Spheros.
+        """
+        if self.spheros:
+            self.send_message_to_client("SpheroBrain", "SpheroConnection", list(self.spheros.values()))
+
+    def handle_ready(self, sphero_id):
+        """
+        Mark a Sphero as ready.
+
+        Returns:
+            True if all Spheros are ready, otherwise False.
+        """
+        sphero = self.spheros.get(sphero_id)
+        if sphero is None:
+            logging.error(f"Sphero with id {sphero_id} not found.")
+            return False
+        logging.info(f"[Sphero {sphero_id}] Ready!")
+        sphero["ready"] = True
+        return all(s.get("ready") for s in self.spheros.values())
+
+    def handle_controller_message(self, ws, parsed_message):
+        match parsed_message["messageType"]:
+            case "SpheroConnection":
+                sphero_list = parsed_message["spheros"]
+                self.spheros = {sphero["id"]: sphero for sphero in sphero_list}
+                self.wire.set_ids(list(self.spheros))  # Interned IDs of binary frames
+                self.register(ws, "SpheroController", self.spheros, parsed_message.get("encoding", "json"))
+                self.initialize_spheros()
+            case "SpheroReady":
+                if self.handle_ready(parsed_message["id"]):
+                    self.send_message_to_client("SpheroBrain", "SpheroReady", {})
+            case "SpheroFeedback" | "SpheroTelemetry" | "SpheroClockPong":
+                stamp(parsed_message["message"], "feedback_relay")
+                self.send_message_to_client("SpheroBrain", parsed_message["messageType"], parsed_message["message"])
+
+    def forward_trace(self, message, command):
+        """
+        Carry the trace of a Brain Server command over to the command forwarded to its Sphero.
+        The enqueue time is recorded as "relay_out", so outbound queueing counts toward the next hop.
+        """
+        if "trace" in message:
+            stamp(message, "relay_in")
+            command["trace"] = message["trace"]
+            stamp(command, "relay_out")
+
+    def handle_brain_message(self, ws, parsed_message):
+        message = parsed_message.get("message")
+        match parsed_message["messageType"]:
+            case "BrainConnection":
+                self.register(ws, "SpheroBrain", ["SpheroBrain"], parsed_message.get("encoding", "json"))
+                self.initialize_spheros()
+            case "BrainControl":
+                command = {"angle": message["angle"], "timing": message["timing"]}
+                if "execute_at" in message:
+                    command["execute_at"] = message["execute_at"]  # Scheduled start on the controller clock
+                self.forward_trace(message, command)
+                self.send_message_to_client(message["id"], "SpheroMovement", command)
+            case "BrainControlSequence":
+                command = {"segments": message["segments"]}
+                if "execute_at" in message:
+                    command["execute_at"] = message["execute_at"]
+                self.forward_trace(message, command)
+                self.send_message_to_client(message["id"], "SpheroMovementSequence", command)
+            case "BrainTick":
+                for command in message["commands"]:
+                    stamp(command, "relay_in")
+                self.send_tick(message["commands"], message.get("execute_at"))
+            case "BrainClockPing":
+                self.broadcast_to_controllers("SpheroClockPing", message)
+            case "BrainMatrixFrame":
+                if message.get("id"):
+                    self.send_message_to_client(message["id"], "SpheroMatrixFrame", message["frame"])
+                else:
+                    self.broadcast_to_controllers("SpheroMatrixFrame", message["frame"])
+
+    def handle_client_message(self, ws, parsed_message):
+        """
+        Route an incoming message to the handler for its client type.
+        """
+        match parsed_message.get("clientType"):
+            case "SpheroController":
+                self.handle_controller_message(ws, parsed_message)
+            case "SpheroBrain":
+                self.handle_brain_message(ws, parsed_message)
+            case client_type:
+                self.register(ws, client_type, [client_type])
+
+    async def handle_connection(self, ws, path=None):
+        try:
+            async for message in ws:
+                try:
+                    self.handle_client_message(ws, self.wire.decode(message))
+                except Exception as e:
+                    logging.error(f"Error processing message: {e}")
+        except ConnectionClosed:
+            pass
+        finally:
+            self.unregister(ws)
+
+    async def report_stats(self, interval):
+        """
+        Periodically log the message rates and queue state, in place of per-message logging.
+
+        Args:
+            interval: Seconds between reports.
+        """
+        while True:
+            start = time.monotonic()
+            counts = self.counts.copy()
+            await asyncio.sleep(interval)
+            elapsed = time.monotonic() - start
+            rates = ", ".join(f"{message_type} {(self.counts[message_type] - counts[message_type]) / elapsed:.1f}/s"
+                              for message_type in sorted(self.counts) if self.counts[message_type] > counts[message_type])
+            queued = sum(len(client.queue) for client in self.clients.values())
+            superseded = sum(client.superseded for client in self.clients.values())
+            dropped = sum(client.dropped for client in self.clients.values())
+            logging.info(f"Stats: {rates or 'idle'}; {queued} queued, {superseded} superseded, {dropped} dropped")
+
+    async def run(self, host, port, stats_interval):
+        async with serve(self.handle_connection, host, port):
+            logging.info(f"WebSocket server is running on ws://{host}:{port}")
+            if stats_interval > 0:
+                await self.report_stats(stats_interval)
+            else:
+                await asyncio.Future()  # Run forever
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Asyncio message broker, a drop-in replacement for server.js.")
+    parser.add_argument("--host", default="localhost", help="Interface to listen on.")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on.")
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="Telemetry messages queued per client before the oldest is dropped.")
+    parser.add_argument("--stats-interval", type=float, default=10.0,
+                        help="Seconds between message rate reports (0 to disable).")
+    parser.add_argument("--verbose", action="store_true", help="Log every routed message.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(Broker(args.max_queue, args.verbose).run(args.host, args.port, args.stats_interval))
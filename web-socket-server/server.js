@@ -1,4 +1,5 @@
 const WebSocket = require("ws");
+const wire = require("../common/wire_format");
 
 // Create a WebSocket server on port 8080
 const wss = new WebSocket.Server({ port: 8080 });
@@ -16,7 +17,7 @@ let spheros = [];
  */
 function handleConnection(ws, clientType) {
   console.log("Client connected: " + clientType);
-  clients.push({ clientType: clientType, id: clientType, ws: ws });
+  clients.push({ clientType: clientType, id: clientType, ws: ws, encoding: "json" });
 }
 
 /**
@@ -24,12 +25,14 @@ function handleConnection(ws, clientType) {
  * Adds each Sphero to the `clients` list.
  * @param {WebSocket} ws - The WebSocket connection.
  * @param {Array} spheroList - List of Sphero objects being controlled.
+ * @param {string} encoding - Encoding the controller accepts, "json" or "binary".
  */
-function handleControllerConnection(ws, spheroList) {
+function handleControllerConnection(ws, spheroList, encoding) {
   spheros = spheroList;
+  wire.setIds(spheroList.map((sphero) => sphero.id)); // Interned IDs of binary frames
   spheroList.forEach((sphero) => {
     console.log(`Client connected: [SpheroController]: ${sphero.id}`);
-    clients.push({ clientType: "SpheroController", id: sphero.id, ws: ws });
+    clients.push({ clientType: "SpheroController", id: sphero.id, ws: ws, encoding: encoding || "json" });
   });
   intializeSpheros();
 }
@@ -38,13 +41,31 @@ function handleControllerConnection(ws, spheroList) {
  * Handles the connection of the Brain Server.
  * Adds the Brain Server to the `clients` list.
  * @param {WebSocket} ws - The WebSocket connection.
+ * @param {string} encoding - Encoding the Brain Server accepts, "json" or "binary".
  */
-function handleBrainConnection(ws) {
+function handleBrainConnection(ws, encoding) {
   console.log(`Client connected: [SpheroBrain]`);
-  clients.push({ clientType: "SpheroBrain", id: "SpheroBrain", ws: ws });
+  clients.push({ clientType: "SpheroBrain", id: "SpheroBrain", ws: ws, encoding: encoding || "json" });
   intializeSpheros();
 }
 
+/**
+ * Serializes a message in the encoding negotiated by a client.
+ * Messages that cannot be framed in binary fall back to JSON text.
+ * @param {Object} client - The target client.
+ * @param {Object} message - The message to serialize.
+ * @returns {Buffer|string} The serialized message.
+ */
+function encodeFor(client, message) {
+  if (client.encoding === "binary") {
+    const frame = wire.encode(message);
+    if (frame) {
+      return frame;
+    }
+  }
+  return JSON.stringify(message);
+}
+
 /**
  * Initializes the Spheros by notifying the Brain Server of their connection.
  */
@@ -73,11 +94,34 @@ function sendMessageToClient(id, messageType, message) {
   const client = clients.find((c) => c.id === id);
   if (client && client.ws.readyState === WebSocket.OPEN) {
     client.ws.send(
-      JSON.stringify({ id: id, messageType: messageType, message: message })
+      encodeFor(client, { id: id, messageType: messageType, message: message })
     );
     console.log(`Message sent to ${id}: ${JSON.stringify(message)}`);
   } else {
     console.log(`${id} not found or not connected.`);
+    if (messageType === "SpheroMovement" || messageType === "SpheroMovementSequence") {
+      reportDropped(id);
+    }
+  }
+}
+
+/**
+ * Tells the Brain Server that a movement command could not be delivered, so that it plans again
+ * instead of waiting for a feedback that will never come.
+ * @param {string} id - The ID of the Sphero the command was for.
+ */
+function reportDropped(id) {
+  sendMessageToClient("SpheroBrain", "SpheroFeedback", { id: id, status: "dropped", dropped_at: Date.now() / 1000 });
+}
+
+/**
+ * Adds a relay timestamp to the end-to-end trace of a command or feedback, if it carries one.
+ * @param {Object} message - Message content, with a "trace" object when the Brain Server traces commands.
+ * @param {string} key - Name of the hop (e.g., "relay_in").
+ */
+function stamp(message, key) {
+  if (message && message.trace && typeof message.trace === "object") {
+    message.trace[key] = Date.now() / 1000; // Seconds, like the Python services
   }
 }
 
@@ -91,11 +135,35 @@ function sendMessageToClient(id, messageType, message) {
  * @param {number} last_x - Last x-coordinate the Sphero moved to.
  * @param {number} last_y - Last y-coordinate the Sphero moved to.
  */
-function moveSphero(id, angle, timing) {
-  sendMessageToClient(id, "SpheroMovement", {
-    angle: angle,
-    timing: timing,
-  });
+function moveSphero(id, angle, timing, executeAt, trace) {
+  const message = { angle: angle, timing: timing };
+  if (executeAt !== undefined) {
+    message.execute_at = executeAt; // Scheduled start on the controller clock
+  }
+  if (trace !== undefined) {
+    message.trace = trace;
+    stamp(message, "relay_out");
+  }
+  sendMessageToClient(id, "SpheroMovement", message);
+}
+
+/**
+ * Sends a sequence of timed heading segments to a specific Sphero.
+ * @param {string} id - The ID of the Sphero to move.
+ * @param {Array} segments - List of { angle, timing } segments executed back-to-back.
+ * @param {number|undefined} executeAt - Scheduled start time on the controller clock, if any.
+ * @param {Object|undefined} trace - End-to-end trace of the command, if any.
+ */
+function moveSpheroSequence(id, segments, executeAt, trace) {
+  const message = { segments: segments };
+  if (executeAt !== undefined) {
+    message.execute_at = executeAt;
+  }
+  if (trace !== undefined) {
+    message.trace = trace;
+    stamp(message, "relay_out");
+  }
+  sendMessageToClient(id, "SpheroMovementSequence", message);
 }
 
 /**
@@ -113,6 +181,76 @@ function matrixCall() {
   });
 }
 
+/**
+ * Sends a message once per SpheroController connection with the broadcast ID "*".
+ * @param {string} messageType - The type of the message being sent.
+ * @param {any} message - The content of the message.
+ * @returns {number} The number of controller connections.
+ */
+function broadcastToControllers(messageType, message) {
+  const controllers = new Map(
+    clients
+      .filter((client) => client.clientType === "SpheroController")
+      .map((client) => [client.ws, client])
+  );
+  controllers.forEach((client, ws) => {
+    if (ws.readyState === WebSocket.OPEN) {
+      ws.send(encodeFor(client, { id: "*", messageType: messageType, message: message }));
+    }
+  });
+  return controllers.size;
+}
+
+/**
+ * Sends an 8x8 LED matrix frame to one Sphero, or to every Sphero at once.
+ * A broadcast is sent once per SpheroController connection, which fans it out to its Spheros.
+ * @param {string|undefined} id - The ID of the target Sphero, or undefined to broadcast.
+ * @param {Array} frame - 8 rows of 8 hex colors (null for an unlit pixel).
+ */
+function matrixFrameCall(id, frame) {
+  if (id) {
+    sendMessageToClient(id, "SpheroMatrixFrame", frame);
+    return;
+  }
+
+  const controllers = broadcastToControllers("SpheroMatrixFrame", frame);
+  console.log(`Matrix frame broadcast to ${controllers} controller(s)`);
+}
+
+/**
+ * Sends the commands of one planning tick to the SpheroControllers.
+ * Each controller connection receives a single SpheroTick with the commands for its own Spheros.
+ * @param {Array} commands - List of { id, angle, timing } or { id, segments } commands.
+ * @param {number|undefined} executeAt - Scheduled start time of the tick on the controller clock, if any.
+ */
+function tickCall(commands, executeAt) {
+  const ticks = new Map(); // Controller connection to its client entry and commands
+  commands.forEach((command) => {
+    const client = clients.find((c) => c.id === command.id);
+    if (!client) {
+      console.log(`${command.id} not found or not connected.`);
+      reportDropped(command.id);
+      return;
+    }
+    if (!ticks.has(client.ws)) {
+      ticks.set(client.ws, { client: client, commands: [] });
+    }
+    ticks.get(client.ws).commands.push(command);
+  });
+
+  ticks.forEach((tick, ws) => {
+    tick.commands.forEach((command) => stamp(command, "relay_out"));
+    const message = { commands: tick.commands };
+    if (executeAt !== undefined) {
+      message.execute_at = executeAt;
+    }
+    if (ws.readyState === WebSocket.OPEN) {
+      ws.send(encodeFor(tick.client, { id: "*", messageType: "SpheroTick", message: message }));
+    }
+  });
+  console.log(`Tick with ${commands.length} command(s) sent to ${ticks.size} controller(s)`);
+}
+
 /**
  * Marks a specific Sphero as ready and checks if all Spheros are ready.
  * @param {string} sphero_id - The ID of the Sphero.
@@ -146,7 +284,7 @@ function handleControllerMessage(ws, parsedMessage) {
   switch (messageType) {
     case "SpheroConnection":
       let spheroList = parsedMessage.spheros;
-      handleControllerConnection(ws, spheroList);
+      handleControllerConnection(ws, spheroList, parsedMessage.encoding);
       break;
 
     case "SpheroReady":
@@ -157,12 +295,25 @@ function handleControllerMessage(ws, parsedMessage) {
       break;
 
     case "SpheroFeedback":
+      stamp(parsedMessage.message, "feedback_relay");
       sendMessageToClient(
         "SpheroBrain",
         "SpheroFeedback",
         parsedMessage.message
       );
       break;
+
+    case "SpheroTelemetry":
+      sendMessageToClient(
+        "SpheroBrain",
+        "SpheroTelemetry",
+        parsedMessage.message
+      );
+      break;
+
+    case "SpheroClockPong":
+      sendMessageToClient("SpheroBrain", "SpheroClockPong", parsedMessage.message);
+      break;
   }
 }
 
@@ -176,12 +327,33 @@ function handleBrainMessage(ws, parsedMessage) {
 
   switch (messageType) {
     case "BrainConnection":
-      handleBrainConnection(ws);
+      handleBrainConnection(ws, parsedMessage.encoding);
       break;
 
     case "BrainControl":
       let message = parsedMessage.message;
-      moveSphero(message.id, message.angle, message.timing);
+      stamp(message, "relay_in");
+      moveSphero(message.id, message.angle, message.timing, message.execute_at, message.trace);
+      break;
+
+    case "BrainControlSequence":
+      let sequence = parsedMessage.message;
+      stamp(sequence, "relay_in");
+      moveSpheroSequence(sequence.id, sequence.segments, sequence.execute_at, sequence.trace);
+      break;
+
+    case "BrainTick":
+      parsedMessage.message.commands.forEach((command) => stamp(command, "relay_in"));
+      tickCall(parsedMessage.message.commands, parsedMessage.message.execute_at);
+      break;
+
+    case "BrainClockPing":
+      broadcastToControllers("SpheroClockPing", parsedMessage.message);
+      break;
+
+    case "BrainMatrixFrame":
+      let matrix = parsedMessage.message;
+      matrixFrameCall(matrix.id, matrix.frame);
       break;
   }
 }
@@ -210,7 +382,8 @@ function handleClientMessage(ws, parsedMessage) {
 // Listen for new WebSocket connections
 wss.on("connection", (ws) => {
   ws.on("message", (message) => {
-    let parsedMessage = JSON.parse(message.toString());
+    // JSON text or a binary frame (see wire_format.js)
+    let parsedMessage = wire.decode(message);
     try {
       handleClientMessage(ws, parsedMessage);
     } catch (e) {